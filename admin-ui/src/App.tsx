@@ -1,4 +1,4 @@
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
 import {
   AlertCircle,
   BadgeCheck,
@@ -104,32 +104,103 @@ const ActionButton = ({
   </Button>
 );
 
-type Appeal = {
+// Строка очереди: только столбцы, которые показывает таблица
+type AppealRow = {
   id: number;
   review_id: number;
   master_id: number;
-  company_id: number;
+  company_id: number | null;
   status: string;
   created_at: string;
+  master_full_name: string;
+  master_public_id: string;
+  company_name: string | null;
+  company_public_id: string | null;
+};
+
+// Карточка жалобы загружается отдельно: /api/review-appeals/<id>
+type Appeal = AppealRow & {
   updated_at: string;
   master_comment: string;
   company_comment: string;
   master_files_message_id: string | null;
   company_files_message_id: number | null;
-  review_text: string;
-  master_full_name: string;
-  master_public_id: string;
-  company_name: string;
-  company_public_id: string;
+  // null — отзыв удалён (статус auto_removed_review)
+  review_text: string | null;
+};
+
+type AppealsPage = {
+  items: AppealRow[];
+  next_cursor: string | null;
+  last_event_id: number;
+};
+
+// Событие потока /api/review-appeals/events: текущая строка очереди;
+// listed = false — жалоба удалена и больше не показывается
+type AppealEvent = {
+  kind: "created" | "status";
+  appeal: AppealRow & { listed: boolean };
+};
+
+// Сводка /api/stats (счётчики из таблицы daily_stats)
+type Stats = {
+  period_days: number;
+  new_masters: number;
+  new_companies: number;
+  new_appeals: number;
+  pending_kyc: number;
+  active_subscriptions: number;
+  employments_by_status: Record<string, number>;
+  appeals_by_status: Record<string, number>;
+  companies_by_kyc_status: Record<string, number>;
+};
+
+type AppealFilters = {
+  status: string;
+  company_id: string;
+  master_id: string;
+  date_from: string;
+  date_to: string;
+};
+
+const defaultAppealFilters: AppealFilters = {
+  status: "",
+  company_id: "",
+  master_id: "",
+  date_from: "",
+  date_to: "",
+};
+
+const appealStatuses = ["pending_company_response", "company_responded", "auto_removed_review"];
+
+const matchesAppealFilters = (appeal: AppealRow, filters: AppealFilters) =>
+  (!filters.status || appeal.status === filters.status) &&
+  (!filters.company_id || appeal.company_id === Number(filters.company_id)) &&
+  (!filters.master_id || appeal.master_id === Number(filters.master_id)) &&
+  (!filters.date_from || appeal.created_at.slice(0, 10) >= filters.date_from) &&
+  (!filters.date_to || appeal.created_at.slice(0, 10) <= filters.date_to);
+
+const appealsUrl = (filters: AppealFilters, cursor: string | null) => {
+  const params = new URLSearchParams();
+  Object.entries(filters).forEach(([key, value]) => {
+    if (value) params.set(key, value);
+  });
+  if (cursor) params.set("cursor", cursor);
+  return `/api/review-appeals?${params}`;
 };
 
 export default function App() {
   const [active, setActive] = useState("dashboard");
   const [dialog, setDialog] = useState<DialogState>(defaultDialog);
   const [reason, setReason] = useState("");
-  const [appeals, setAppeals] = useState<Appeal[]>([]);
+  const [appeals, setAppeals] = useState<AppealRow[]>([]);
+  const [appealFilters, setAppealFilters] = useState<AppealFilters>(defaultAppealFilters);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [eventCursor, setEventCursor] = useState<number | null>(null);
   const [selectedAppeal, setSelectedAppeal] = useState<Appeal | null>(null);
   const [loading, setLoading] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [stats, setStats] = useState<Stats | null>(null);
 
   const openDialog = (state: Omit<DialogState, "open">) => {
     setReason("");
@@ -140,23 +211,101 @@ export default function App() {
 
   const pageTitle = useMemo(() => menuItems.find((item) => item.key === active)?.label, [active]);
 
-  // Загрузка жалоб при открытии раздела споров
+  // Сводка для дашборда
   useEffect(() => {
-    if (active === "disputes") {
-      setLoading(true);
-      fetch("/api/review-appeals")
+    if (active === "dashboard") {
+      fetch("/api/stats")
         .then((res) => res.json())
-        .then((data) => {
-          setAppeals(data);
-          setLoading(false);
-        })
+        .then((data: Stats) => setStats(data))
         .catch((err) => {
-          console.error("Ошибка загрузки жалоб:", err);
-          setLoading(false);
+          console.error("Ошибка загрузки статистики:", err);
         });
     }
   }, [active]);
 
+  // cursor = null — первая страница, иначе продолжение списка с next_cursor
+  const loadAppeals = (cursor: string | null = null) => {
+    if (cursor) {
+      setLoadingMore(true);
+    } else {
+      setLoading(true);
+    }
+    fetch(appealsUrl(appealFilters, cursor))
+      .then((res) => res.json())
+      .then((data: AppealsPage) => {
+        setAppeals((prev) => (cursor ? [...prev, ...data.items] : data.items));
+        setNextCursor(data.next_cursor);
+        if (!cursor) {
+          setEventCursor(data.last_event_id);
+        }
+      })
+      .catch((err) => {
+        console.error("Ошибка загрузки жалоб:", err);
+      })
+      .finally(() => {
+        setLoading(false);
+        setLoadingMore(false);
+      });
+  };
+
+  const openAppeal = (appeal: AppealRow) => {
+    fetch(`/api/review-appeals/${appeal.id}`)
+      .then((res) => res.json())
+      .then((data: Appeal) => setSelectedAppeal(data))
+      .catch((err) => {
+        console.error("Ошибка загрузки жалобы:", err);
+      });
+  };
+
+  const setAppealFilter = (key: keyof AppealFilters, value: string) =>
+    setAppealFilters((prev) => ({ ...prev, [key]: value }));
+
+  // Загрузка жалоб при открытии раздела споров и при смене фильтров
+  useEffect(() => {
+    if (active === "disputes") {
+      loadAppeals();
+    }
+  }, [active, appealFilters]);
+
+  // Обработчики потока событий живут дольше одного рендера — читают актуальные значения через ref
+  const appealFiltersRef = useRef(appealFilters);
+  appealFiltersRef.current = appealFilters;
+  const selectedAppealIdRef = useRef<number | null>(null);
+  selectedAppealIdRef.current = selectedAppeal?.id ?? null;
+
+  const applyAppealEvent = ({ kind, appeal }: AppealEvent) => {
+    const { listed, ...row } = appeal;
+    const visible = listed && matchesAppealFilters(row, appealFiltersRef.current);
+    setAppeals((prev) => {
+      if (!prev.some((item) => item.id === row.id)) {
+        // Новые жалобы — в начало очереди; остальные появятся при следующей загрузке
+        return visible && kind === "created" ? [row, ...prev] : prev;
+      }
+      return visible
+        ? prev.map((item) => (item.id === row.id ? row : item))
+        : prev.filter((item) => item.id !== row.id);
+    });
+    if (selectedAppealIdRef.current === row.id) {
+      if (listed) {
+        openAppeal(row);
+      } else {
+        setSelectedAppeal(null);
+      }
+    }
+  };
+
+  // Поток изменений с позиции, на которой был загружен список: браузер сам
+  // переподключается и продолжает с Last-Event-ID, reset — события потеряны
+  useEffect(() => {
+    if (active !== "disputes" || eventCursor === null) {
+      return;
+    }
+    const source = new EventSource(`/api/review-appeals/events?last_event_id=${eventCursor}`);
+    source.addEventListener("appeal", (e) => applyAppealEvent(JSON.parse((e as MessageEvent).data)));
+    source.addEventListener("reset", () => setAppealFilters((prev) => ({ ...prev })));
+    return () => source.close();
+  }, [active, eventCursor]);
+
   return (
     <div className="min-h-screen bg-slate-50 font-sans text-slate-900">
       <div className="flex min-h-screen">
@@ -205,17 +354,19 @@ export default function App() {
               <div className="space-y-6">
                 <div className="grid gap-4 md:grid-cols-2 xl:grid-cols-4">
                   {[
-                    { label: "Новые исполнители", value: "24" },
-                    { label: "Новые компании", value: "11" },
-                    { label: "Ожидает верификации", value: "9" },
-                    { label: "Новые споры", value: "4" },
+                    { label: `Новые исполнители за ${stats?.period_days ?? 7} дн.`, value: stats?.new_masters },
+                    { label: `Новые компании за ${stats?.period_days ?? 7} дн.`, value: stats?.new_companies },
+                    { label: "Ожидает верификации", value: stats?.pending_kyc },
+                    { label: `Новые споры за ${stats?.period_days ?? 7} дн.`, value: stats?.new_appeals },
+                    { label: "Активные подписки", value: stats?.active_subscriptions },
+                    { label: "Споры без ответа компании", value: stats?.appeals_by_status.pending_company_response ?? 0 },
                   ].map((card) => (
                     <Card key={card.label}>
                       <CardHeader className="pb-3">
                         <CardTitle className="text-sm font-medium text-slate-500">{card.label}</CardTitle>
                       </CardHeader>
                       <CardContent>
-                        <div className="text-2xl font-semibold text-slate-900">{card.value}</div>
+                        <div className="text-2xl font-semibold text-slate-900">{stats ? card.value : "—"}</div>
                       </CardContent>
                     </Card>
                   ))}
@@ -719,7 +870,55 @@ export default function App() {
 
             {active === "disputes" && (
               <div className="space-y-6">
-                {filters("dispute")}
+                <div className="flex flex-wrap items-center gap-3 border-b border-slate-200 pb-4">
+                  <select
+                    className="h-9 rounded-md border border-slate-200 bg-white px-3 text-sm text-slate-900"
+                    value={appealFilters.status}
+                    onChange={(e) => setAppealFilter("status", e.target.value)}
+                  >
+                    <option value="">Все статусы</option>
+                    {appealStatuses.map((status) => (
+                      <option key={status} value={status}>
+                        {status}
+                      </option>
+                    ))}
+                  </select>
+                  <div className="w-36">
+                    <Input
+                      placeholder="company_id"
+                      inputMode="numeric"
+                      value={appealFilters.company_id}
+                      onChange={(e) => setAppealFilter("company_id", e.target.value.replace(/\D/g, ""))}
+                    />
+                  </div>
+                  <div className="w-36">
+                    <Input
+                      placeholder="master_id"
+                      inputMode="numeric"
+                      value={appealFilters.master_id}
+                      onChange={(e) => setAppealFilter("master_id", e.target.value.replace(/\D/g, ""))}
+                    />
+                  </div>
+                  <div className="w-40">
+                    <Input
+                      type="date"
+                      aria-label="Создано с"
+                      value={appealFilters.date_from}
+                      onChange={(e) => setAppealFilter("date_from", e.target.value)}
+                    />
+                  </div>
+                  <div className="w-40">
+                    <Input
+                      type="date"
+                      aria-label="Создано по"
+                      value={appealFilters.date_to}
+                      onChange={(e) => setAppealFilter("date_to", e.target.value)}
+                    />
+                  </div>
+                  <Button variant="secondary" onClick={() => setAppealFilters(defaultAppealFilters)}>
+                    Сбросить
+                  </Button>
+                </div>
                 <Card>
                   <CardHeader>
                     <CardTitle>Очередь жалоб на отзывы</CardTitle>
@@ -747,7 +946,7 @@ export default function App() {
                             <TableRow
                               key={appeal.id}
                               className={selectedAppeal?.id === appeal.id ? "bg-blue-50" : ""}
-                              onClick={() => setSelectedAppeal(appeal)}
+                              onClick={() => openAppeal(appeal)}
                             >
                               <TableCell className="font-mono">#{appeal.id}</TableCell>
                               <TableCell className="font-mono">#{appeal.review_id}</TableCell>
@@ -766,7 +965,7 @@ export default function App() {
                                     icon={FileText}
                                     onClick={(e) => {
                                       e.stopPropagation();
-                                      setSelectedAppeal(appeal);
+                                      openAppeal(appeal);
                                     }}
                                   />
                                 </div>
@@ -776,6 +975,13 @@ export default function App() {
                         </TableBody>
                       </Table>
                     )}
+                    {!loading && nextCursor && (
+                      <div className="pt-4 text-center">
+                        <Button variant="secondary" disabled={loadingMore} onClick={() => loadAppeals(nextCursor)}>
+                          {loadingMore ? "Загрузка..." : "Показать ещё"}
+                        </Button>
+                      </div>
+                    )}
                   </CardContent>
                 </Card>
 
@@ -807,7 +1013,7 @@ export default function App() {
                       </div>
                       <div>
                         <p className="text-slate-500">текст отзыва</p>
-                        <p className="text-slate-700">{selectedAppeal.review_text}</p>
+                        <p className="text-slate-700">{selectedAppeal.review_text ?? "отзыв удалён"}</p>
                       </div>
                       <div>
                         <p className="text-slate-500">жалоба исполнителя</p>
@@ -1,11 +1,14 @@
 import asyncio
 import logging
-from contextlib import closing
+import signal
+import sys
 from datetime import datetime, timedelta
 from typing import Optional
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from aiogram.types import (
     CallbackQuery,
     KeyboardButton,
@@ -35,7 +38,6 @@ except RuntimeError as e:
     input("Нажмите Enter для выхода...")
     exit(1)
 
-from states import get_state, pop_state, set_state, clear_expired_states
 from utils import (
     format_company_profile,
     format_employment_reviews,
@@ -54,43 +56,44 @@ from utils import (
     validate_appeal_reason,
 )
 from db import (
-    auto_close_leave_requests,
-    can_master_appeal_review,
+    close_pool,
     company_has_active_subscription,
+    get_db_pragmas,
     init_db,
+    init_pool,
+)
+from db_async import (
+    auto_close_leave_requests,
+    can_master_appeal_review,
     create_company,
     create_employment,
     create_master,
     create_review,
     create_review_appeal,
-    delete_review,
     end_employment,
     create_fast_connect_invite,
     get_active_appeal_for_review_and_master,
     get_active_temporary_collaboration,
     get_company_by_id,
     get_company_by_public_id,
-    get_company_by_user,
     get_company_employments,
     get_company_ended_employments,
-    get_company_requests_count,
+    get_company_menu_counters,
     get_company_temporary_collaborations,
     get_company_verification_by_company_id,
     get_current_employment,
     get_employment_by_id,
     get_fast_connect_invite_by_token,
     get_master_by_id,
+    decrypt_master_passport,
     get_master_by_public_id,
-    get_master_by_user,
     get_temporary_collaboration_by_id,
-    get_or_create_user,
     get_pending_company_appeals,
     get_pending_employments_for_company,
     get_review_appeal_by_id,
     get_review_by_id,
     get_reviews_for_employment,
     get_reviews_for_master,
-    get_user,
     has_any_current_employment,
     has_pending_or_active_employment,
     has_pending_request_for_company,
@@ -100,6 +103,7 @@ from db import (
     create_temporary_collaboration,
     set_employment_accepted,
     set_employment_leave_requested,
+    get_leave_request_times,
     set_employment_rejected,
     set_master_passport_locked,
     create_company_verification,
@@ -107,10 +111,40 @@ from db import (
     set_user_role,
     update_master_profile,
     update_review_appeal_company_response,
-    get_conn,
     cancel_employment_leave_request,
     get_pending_leave_requests_for_company,
     get_master_rating,
+    get_master_profile_snapshot,
+    save_master_profile_snapshot,
+    get_pending_review_appeal_times,
+    process_due_review_appeals,
+    set_review_appeal_master_files,
+    purge_appeal_events,
+    purge_delivered_outbox,
+    update_company_name,
+    pop_state,
+    set_state,
+    clear_expired_states,
+    get_oldest_state_created_at,
+    shutdown_db_executor,
+)
+from middlewares import RequestContextMiddleware
+from notifications import notifier, outbox_dispatcher
+from scheduler import scheduler
+from workers import (
+    ShardRouter,
+    build_router_app,
+    consume_notifications,
+    consume_updates,
+    poll_updates,
+)
+from states import (
+    PendingState,
+    find_unhandled_state_actions,
+    get_state_action,
+    state_action,
+    start_state_flusher,
+    stop_state_flusher,
 )
 from keyboards import (
     appeal_button_kb,
@@ -150,6 +184,8 @@ try:
 
     bot = Bot(config.BOT_TOKEN)
     dp = Dispatcher()
+    # Пользователь, мастер, компания и состояние загружаются один раз на апдейт
+    dp.update.outer_middleware(RequestContextMiddleware())
 except Exception as e:
     print("=" * 60)
     print("ОШИБКА ПРИ ИНИЦИАЛИЗАЦИИ БОТА!")
@@ -223,24 +259,21 @@ async def submit_master_appeal(
     photo_message_ids: Optional[list[int]] = None,
     photo_chat_id: Optional[int] = None,
 ):
-    appeal_id = create_review_appeal(
+    appeal_id = await create_review_appeal(
         review_id=review_id,
         master_id=master["id"],
         company_id=review["company_id"],
         reason=reason,
     )
+    schedule_review_appeal(appeal_id, datetime.utcnow())
 
     # Сохраняем все фото в БД как JSON массив для админ панели
     if photo_message_ids and photo_chat_id:
         import json
         photos_json = json.dumps(photo_message_ids)
-        with closing(get_conn()) as conn, conn:
-            conn.execute(
-                "UPDATE review_appeals SET master_files_message_id = ? WHERE id = ?",
-                (photos_json, appeal_id),
-            )
+        await set_review_appeal_master_files(appeal_id, photos_json)
 
-    pop_state(tg_id)
+    await pop_state(tg_id)
     await reply_message.answer(
         "Ваша жалоба отправлена компании.\n"
         "Компания должна предоставить ответ и доказательства. "
@@ -248,7 +281,7 @@ async def submit_master_appeal(
         reply_markup=ReplyKeyboardRemove(),
     )
 
-    company = get_company_by_id(review["company_id"])
+    company = await get_company_by_id(review["company_id"])
     if company:
         text = (
             f"Исполнитель {master['full_name']} ({master['public_id']}) "
@@ -256,139 +289,104 @@ async def submit_master_appeal(
             f"Текст жалобы:\n{reason}\n\n"
             "Зайдите в раздел «Жалобы на отзывы» в меню компании, чтобы ответить."
         )
-        try:
-            await bot.send_message(
-                company["tg_id"],
-                text,
-                reply_markup=company_appeal_actions_kb(appeal_id),
+        notifier.enqueue(
+            company["tg_id"],
+            text,
+            reply_markup=company_appeal_actions_kb(appeal_id),
+            failure_log=(
+                "Не удалось уведомить компанию %s о жалобе",
+                company["id"],
+            ),
+        )
+        # Фото больше не отправляются в Telegram - они доступны в админ панели
+        # if photo_message_ids and photo_chat_id:
+        #     for message_id in photo_message_ids:
+        #         try:
+        #             await bot.copy_message(
+        #                 company["tg_id"],
+        #                 from_chat_id=photo_chat_id,
+        #                 message_id=message_id,
+        #             )
+        #         except Exception:
+        #             logger.exception(
+        #                 "Не удалось переслать фото компании по жалобе %s",
+        #                 appeal_id,
+        #             )
+
+
+def review_appeal_notifications(appeal: dict):
+    """Уведомления по жалобам, срок которых наступил (пишутся в outbox вместе с изменениями)."""
+    messages = []
+    if appeal["remind"]:
+        messages.append(
+            (
+                appeal["company_tg_id"],
+                f"Напоминание по жалобе #{appeal['id']} на отзыв по исполнителю "
+                f"{appeal['master_full_name']} ({appeal['master_public_id']}):\n\n"
+                f"Текст отзыва:\n{appeal['review_text']}\n\n"
+                "Пожалуйста, ответьте на жалобу и при необходимости приложите доказательства.",
             )
-            # Фото больше не отправляются в Telegram - они доступны в админ панели
-            # if photo_message_ids and photo_chat_id:
-            #     for message_id in photo_message_ids:
-            #         try:
-            #             await bot.copy_message(
-            #                 company["tg_id"],
-            #                 from_chat_id=photo_chat_id,
-            #                 message_id=message_id,
-            #             )
-            #         except Exception:
-            #             logger.exception(
-            #                 "Не удалось переслать фото компании по жалобе %s",
-            #                 appeal_id,
-            #             )
-        except Exception:
-            logger.exception("Не удалось уведомить компанию %s о жалобе", company["id"])
+        )
+    if appeal["remove"]:
+        messages.append(
+            (
+                appeal["master_tg_id"],
+                "Ваша жалоба на отзыв была рассмотрена автоматически, "
+                "так как компания не предоставила ответ в течение 5 дней.\n\n"
+                "Отзыв был удалён.",
+            )
+        )
+    return messages
 
 
 async def auto_review_appeals_maintenance():
     """Отслеживание жалоб: напоминание через 3 дня и автоудаление через 5 дней."""
-    now = datetime.utcnow()
-    three_days_ago = now - timedelta(days=3)
-    five_days_ago = now - timedelta(days=5)
-
-    with closing(get_conn()) as conn, conn:
-        c = conn.cursor()
-        c.execute(
-            """
-            SELECT ra.*, r.text as review_text, r.created_at as review_created_at,
-                   m.full_name as master_full_name, m.public_id as master_public_id,
-                   c2.name as company_name, c2.public_id as company_public_id
-            FROM review_appeals ra
-            JOIN reviews r ON ra.review_id = r.id
-            JOIN masters m ON ra.master_id = m.id
-            LEFT JOIN companies c2 ON ra.company_id = c2.id
-            WHERE ra.status = 'pending_company_response'
-            """
-        )
-        appeals = [dict(row) for row in c.fetchall()]
-
-    for appeal in appeals:
-        try:
-            created_at = datetime.fromisoformat(appeal["created_at"])
-        except (TypeError, ValueError):
-            continue
-
-        reminder_sent_at = appeal.get("reminder_sent_at")
-        if not reminder_sent_at and created_at <= three_days_ago:
-            company = get_company_by_id(appeal.get("company_id"))
-            if company:
-                text = (
-                    f"Напоминание по жалобе #{appeal['id']} на отзыв по исполнителю "
-                    f"{appeal['master_full_name']} ({appeal['master_public_id']}):\n\n"
-                    f"Текст отзыва:\n{appeal['review_text']}\n\n"
-                    "Пожалуйста, ответьте на жалобу и при необходимости приложите доказательства."
-                )
-                try:
-                    await bot.send_message(company["tg_id"], text)
-                    # Обновляем reminder_sent_at только если сообщение успешно отправлено
-                    with closing(get_conn()) as conn, conn:
-                        conn.execute(
-                            """
-                            UPDATE review_appeals
-                            SET reminder_sent_at = ?, updated_at = ?
-                            WHERE id = ?
-                            """,
-                            (
-                                datetime.utcnow().isoformat(timespec="seconds"),
-                                datetime.utcnow().isoformat(timespec="seconds"),
-                                appeal["id"],
-                            ),
-                        )
-                except Exception:
-                    logger.exception(
-                        "Не удалось отправить напоминание компании по жалобе %s",
-                        appeal["id"],
-                    )
-
-        if created_at <= five_days_ago:
-            review_id = appeal["review_id"]
-            delete_review(review_id)
-            with closing(get_conn()) as conn, conn:
-                conn.execute(
-                    """
-                    UPDATE review_appeals
-                    SET status = 'auto_removed_review', updated_at = ?, final_decision_at = ?
-                    WHERE id = ?
-                    """,
-                    (
-                        datetime.utcnow().isoformat(timespec="seconds"),
-                        datetime.utcnow().isoformat(timespec="seconds"),
-                        appeal["id"],
-                    ),
-                )
-
-            master = get_master_by_id(appeal["master_id"])
-            if master:
-                text = (
-                    "Ваша жалоба на отзыв была рассмотрена автоматически, "
-                    "так как компания не предоставила ответ в течение 5 дней.\n\n"
-                    "Отзыв был удалён."
-                )
-                try:
-                    await bot.send_message(master["tg_id"], text)
-                except Exception:
-                    logger.exception(
-                        "Не удалось уведомить мастера %s об автоудалении отзыва",
-                        master["id"],
-                    )
+    processed = await process_due_review_appeals(
+        review_appeal_notifications, APPEAL_REMINDER_AFTER, APPEAL_AUTO_REMOVE_AFTER
+    )
+    if processed:
+        outbox_dispatcher.wake()
+
 
 # ==========================
 # СЕРВИСНЫЕ ХЕЛПЕРЫ
 # ==========================
 
 
+async def render_master_public_profile(public_id: str) -> Optional[str]:
+    """
+    Текст публичного профиля исполнителя для проверки по ID.
+    Повторная проверка отдаётся из сохранённого снимка одним запросом.
+    """
+    snapshot = await get_master_profile_snapshot(public_id)
+    if snapshot and snapshot["text"] is not None:
+        return snapshot["text"]
+
+    master = await get_master_by_public_id(public_id)
+    if not master:
+        return None
+
+    reviews = await get_reviews_for_master(master["id"])
+    rating_info = await get_master_rating(master["id"])
+    text = format_master_public_profile(master, reviews, rating_info)
+    version = snapshot["version"] if snapshot else 0
+    await save_master_profile_snapshot(master["id"], master["public_id"], version, text)
+    return text
+
+
 # ==========================
 # КОМАНДЫ
 # ==========================
 
 
-async def handle_fastconnect_start(message: Message, token: str):
-    invite = get_fast_connect_invite_by_token(token)
+async def handle_fastconnect_start(
+    message: Message, token: str, master: Optional[dict] = None
+):
+    invite = await get_fast_connect_invite_by_token(token)
     if not invite or invite.get("status") != "pending":
         await message.answer("Ссылка на быстрый коннект недействительна или уже использована.")
         return
 
-    master = get_master_by_user(message.from_user.id)
     if not master:
         await message.answer(
             "Для подтверждения сотрудничества нужно зарегистрироваться как исполнитель.\n"
@@ -401,7 +399,7 @@ async def handle_fastconnect_start(message: Message, token: str):
         await message.answer("Эта ссылка предназначена для другого исполнителя.")
         return
 
-    if get_active_temporary_collaboration(invite["company_id"], master["id"]):
+    if await get_active_temporary_collaboration(invite["company_id"], master["id"]):
         await message.answer("У вас уже есть активное сотрудничество с этой компанией.")
         return
 
@@ -414,8 +412,7 @@ async def handle_fastconnect_start(message: Message, token: str):
 
 
 @dp.message(Command("start"))
-async def cmd_start(message: Message):
-    get_or_create_user(message)
+async def cmd_start(message: Message, master: Optional[dict] = None):
     args = ""
     if message.text:
         parts = message.text.split(maxsplit=1)
@@ -424,7 +421,7 @@ async def cmd_start(message: Message):
     if args and args.startswith("fastconnect_"):
         token = args.split("fastconnect_", 1)[-1]
         if token:
-            await handle_fastconnect_start(message, token)
+            await handle_fastconnect_start(message, token, master)
             return
 
     text = (
@@ -449,41 +446,45 @@ async def cmd_role(message: Message):
 
 
 @dp.message(Command("menu"))
-async def cmd_menu(message: Message):
+async def cmd_menu(
+    message: Message,
+    user: Optional[dict] = None,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
     tg_id = message.from_user.id
-    user = get_user(tg_id)
     role = user["role"] if user else None
 
     if role == "master":
-        master = get_master_by_user(tg_id)
         if not master:
             await message.answer(
                 "Вы выбрали роль исполнителя.\nДавайте зарегистрируем вас.\n\n"
                 "Введите ваше ФИО:",
                 reply_markup=back_kb(),
             )
-            set_state(tg_id, "master_register_full_name")
+            await set_state(tg_id, "master_register_full_name")
             return
 
-        rating = get_master_rating(master["id"])
+        rating = await get_master_rating(master["id"])
+        master = await decrypt_master_passport(master)
         await message.answer(format_master_profile(master, rating))
         await message.answer("Меню исполнителя:", reply_markup=master_menu_kb())
         return
 
     if role == "company":
-        company = get_company_by_user(tg_id)
         if not company:
             await message.answer(
                 "Вы выбрали роль компании.\nДавайте зарегистрируем вашу компанию.\n\n"
                 "Введите название компании:",
                 reply_markup=back_kb(),
             )
-            set_state(tg_id, "company_enter_name")
+            await set_state(tg_id, "company_enter_name")
             return
 
         await message.answer(format_company_profile(company))
+        counters = await get_company_menu_counters(company["id"])
         await message.answer(
-            "Меню компании:", reply_markup=company_menu_kb(company["id"])
+            "Меню компании:", reply_markup=company_menu_kb(counters)
         )
         return
 
@@ -494,7 +495,7 @@ async def cmd_menu(message: Message):
                 "пожалуйста, отправьте ваш номер телефона:",
                 reply_markup=back_kb(),
             )
-            set_state(tg_id, "viewer_enter_phone")
+            await set_state(tg_id, "viewer_enter_phone")
             return
 
         await message.answer("Меню:", reply_markup=viewer_menu_kb())
@@ -508,7 +509,7 @@ async def prompt_fastconnect(message: Message, company: dict):
         "Введите ID исполнителя (например, M-123456), чтобы создать быстрый коннект:",
         reply_markup=back_kb(),
     )
-    set_state(
+    await set_state(
         message.from_user.id,
         "company_fastconnect_master_id",
         company_id=company["id"],
@@ -516,9 +517,8 @@ async def prompt_fastconnect(message: Message, company: dict):
 
 
 @dp.message(Command("fastconnect"))
-async def cmd_fastconnect(message: Message):
+async def cmd_fastconnect(message: Message, company: Optional[dict] = None):
     tg_id = message.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -532,8 +532,7 @@ async def cmd_fastconnect(message: Message):
 
 
 @dp.message(Command("info"))
-async def cmd_info(message: Message):
-    user = get_user(message.from_user.id) or get_or_create_user(message)
+async def cmd_info(message: Message, user: Optional[dict] = None):
     role = user["role"]
 
     if role == "master":
@@ -573,12 +572,12 @@ async def cmd_info(message: Message):
 
 
 @dp.callback_query(F.data == "role_master")
-async def cb_role_master(callback: CallbackQuery):
+async def cb_role_master(
+    callback: CallbackQuery, user: Optional[dict] = None, master: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    set_user_role(tg_id, "master")
-    user = get_user(tg_id) or get_or_create_user(callback.message)
+    await set_user_role(tg_id, "master")
     _ = user["first_name"] or ""
-    master = get_master_by_user(tg_id)
     if master:
         await callback.message.answer(
             "Ваш личный кабинет исполнителя:", reply_markup=master_menu_kb()
@@ -589,18 +588,18 @@ async def cb_role_master(callback: CallbackQuery):
             "Введите ваше ФИО:",
             reply_markup=back_kb(),
         )
-        set_state(tg_id, "master_register_full_name")
+        await set_state(tg_id, "master_register_full_name")
 
 
 @dp.callback_query(F.data == "role_company")
-async def cb_role_company(callback: CallbackQuery):
+async def cb_role_company(callback: CallbackQuery, company: Optional[dict] = None):
     tg_id = callback.from_user.id
-    set_user_role(tg_id, "company")
-    company = get_company_by_user(tg_id)
+    await set_user_role(tg_id, "company")
     if company:
+        counters = await get_company_menu_counters(company["id"])
         await callback.message.answer(
             "Личный кабинет компании:",
-            reply_markup=company_menu_kb(company["id"]),
+            reply_markup=company_menu_kb(counters),
         )
     else:
         await callback.message.answer(
@@ -608,14 +607,13 @@ async def cb_role_company(callback: CallbackQuery):
             "Введите название компании:",
             reply_markup=back_kb(),
         )
-        set_state(tg_id, "company_enter_name")
+        await set_state(tg_id, "company_enter_name")
 
 
 @dp.callback_query(F.data == "role_viewer")
-async def cb_role_viewer(callback: CallbackQuery):
+async def cb_role_viewer(callback: CallbackQuery, user: Optional[dict] = None):
     tg_id = callback.from_user.id
-    set_user_role(tg_id, "viewer")
-    user = get_user(tg_id) or get_or_create_user(callback.message)
+    await set_user_role(tg_id, "viewer")
     if not user.get("phone"):
         await callback.message.answer(
             "Вы выбрали роль обычного пользователя.\n\n"
@@ -623,7 +621,7 @@ async def cb_role_viewer(callback: CallbackQuery):
             "пожалуйста, отправьте ваш номер телефона:",
             reply_markup=back_kb(),
         )
-        set_state(tg_id, "viewer_enter_phone")
+        await set_state(tg_id, "viewer_enter_phone")
     else:
         await callback.message.answer(
             "Вы выбрали роль обычного пользователя.",
@@ -639,23 +637,24 @@ async def cb_role_viewer(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "master_profile")
-async def cb_master_profile(callback: CallbackQuery):
+async def cb_master_profile(callback: CallbackQuery, master: Optional[dict] = None):
     tg_id = callback.from_user.id
-    master = get_master_by_user(tg_id)
     if not master:
         await callback.message.answer(
             "Вы ещё не зарегистрированы как исполнитель. Используйте /role и выберите «Я исполнитель»."
         )
         return
-    rating = get_master_rating(master["id"])
+    rating = await get_master_rating(master["id"])
+    master = await decrypt_master_passport(master)
     await callback.message.answer(format_master_profile(master, rating))
     await callback.message.answer("Меню исполнителя:", reply_markup=master_menu_kb())
 
 
 @dp.callback_query(F.data == "master_edit_profile")
-async def cb_master_edit_profile(callback: CallbackQuery):
+async def cb_master_edit_profile(
+    callback: CallbackQuery, master: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    master = get_master_by_user(tg_id)
     if not master:
         await callback.message.answer(
             "Вы ещё не зарегистрированы как исполнитель. Используйте /role и выберите «Я исполнитель»."
@@ -666,28 +665,26 @@ async def cb_master_edit_profile(callback: CallbackQuery):
         "Введите новое ФИО (или отправьте '-' чтобы оставить без изменений):",
         reply_markup=back_kb(),
     )
-    set_state(
+    await set_state(
         tg_id,
         "master_edit_full_name",
         master_id=master["id"],
         full_name=master["full_name"],
         phone=master.get("phone"),
-        passport=master.get("passport"),
         passport_locked=bool(master.get("passport_locked")),
     )
 
 
 @dp.callback_query(F.data == "master_reviews")
-async def cb_master_reviews(callback: CallbackQuery):
+async def cb_master_reviews(callback: CallbackQuery, master: Optional[dict] = None):
     tg_id = callback.from_user.id
-    master = get_master_by_user(tg_id)
     if not master:
         await callback.message.answer(
             "Вы ещё не зарегистрированы как исполнитель."
         )
         return
 
-    reviews = get_reviews_for_master(master["id"])
+    reviews = await get_reviews_for_master(master["id"])
     await callback.message.answer(format_reviews_list_for_master(reviews))
     if reviews:
         await callback.message.answer(
@@ -697,9 +694,10 @@ async def cb_master_reviews(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.startswith("master_review_"))
-async def cb_master_review_detail(callback: CallbackQuery):
+async def cb_master_review_detail(
+    callback: CallbackQuery, master: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    master = get_master_by_user(tg_id)
     if not master:
         await callback.message.answer("Вы ещё не зарегистрированы как исполнитель.")
         return
@@ -710,7 +708,7 @@ async def cb_master_review_detail(callback: CallbackQuery):
         await callback.message.answer("Некорректный формат данных.")
         return
 
-    review = get_review_by_id(review_id)
+    review = await get_review_by_id(review_id)
     if not review or review["master_id"] != master["id"]:
         await callback.message.answer("Отзыв не найден или не относится к вам.")
         return
@@ -722,10 +720,14 @@ async def cb_master_review_detail(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "master_appeal_skip_proof")
-async def cb_master_appeal_skip_proof(callback: CallbackQuery):
+async def cb_master_appeal_skip_proof(
+    callback: CallbackQuery,
+    pending_state: Optional[PendingState] = None,
+    master: Optional[dict] = None,
+):
     await callback.answer()
     tg_id = callback.from_user.id
-    state = get_state(tg_id)
+    state = pending_state
     
     if not state or state.action != "master_appeal_proof":
         await callback.message.answer("Ошибка: состояние не найдено. Попробуйте начать заново.")
@@ -734,12 +736,11 @@ async def cb_master_appeal_skip_proof(callback: CallbackQuery):
     review_id = state.data["review_id"]
     reason = state.data["reason"]
 
-    master = get_master_by_user(tg_id)
-    review = get_review_by_id(review_id)
+    review = await get_review_by_id(review_id)
 
     if not master or not review:
         await callback.message.answer("Не удалось найти данные по отзыву. Попробуйте позже.")
-        pop_state(tg_id)
+        await pop_state(tg_id)
         return
 
     await submit_master_appeal(
@@ -753,10 +754,14 @@ async def cb_master_appeal_skip_proof(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "master_appeal_finish_proof")
-async def cb_master_appeal_finish_proof(callback: CallbackQuery):
+async def cb_master_appeal_finish_proof(
+    callback: CallbackQuery,
+    pending_state: Optional[PendingState] = None,
+    master: Optional[dict] = None,
+):
     await callback.answer()
     tg_id = callback.from_user.id
-    state = get_state(tg_id)
+    state = pending_state
 
     if not state or state.action != "master_appeal_proof":
         await callback.message.answer("Ошибка: состояние не найдено. Попробуйте начать заново.")
@@ -774,12 +779,11 @@ async def cb_master_appeal_finish_proof(callback: CallbackQuery):
         )
         return
 
-    master = get_master_by_user(tg_id)
-    review = get_review_by_id(review_id)
+    review = await get_review_by_id(review_id)
 
     if not master or not review:
         await callback.message.answer("Не удалось найти данные по отзыву. Попробуйте позже.")
-        pop_state(tg_id)
+        await pop_state(tg_id)
         return
 
     await submit_master_appeal(
@@ -795,10 +799,11 @@ async def cb_master_appeal_finish_proof(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.startswith("master_appeal_"))
-async def cb_master_appeal_review(callback: CallbackQuery):
+async def cb_master_appeal_review(
+    callback: CallbackQuery, master: Optional[dict] = None
+):
     
     tg_id = callback.from_user.id
-    master = get_master_by_user(tg_id)
     if not master:
         await callback.message.answer("Вы ещё не зарегистрированы как исполнитель.")
         return
@@ -809,12 +814,12 @@ async def cb_master_appeal_review(callback: CallbackQuery):
         await callback.message.answer("Некорректный формат данных.")
         return
 
-    review = get_review_by_id(review_id)
+    review = await get_review_by_id(review_id)
     if not review or review["master_id"] != master["id"]:
         await callback.message.answer("Отзыв не найден или не относится к вам.")
         return
 
-    if not can_master_appeal_review(review, master["id"]):
+    if not await can_master_appeal_review(review, master["id"]):
         await callback.message.answer(
             "Сейчас нельзя подать жалобу по этому отзыву.\n"
             "Возможно, прошло более 14 дней, уже есть активная жалоба или превышен лимит попыток."
@@ -826,7 +831,7 @@ async def cb_master_appeal_review(callback: CallbackQuery):
         "Это сообщение будет направлено компании.",
         reply_markup=back_kb(),
     )
-    set_state(
+    await set_state(
         tg_id,
         "master_appeal_reason",
         review_id=review_id,
@@ -834,15 +839,16 @@ async def cb_master_appeal_review(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "master_link_company")
-async def cb_master_link_company(callback: CallbackQuery):
+async def cb_master_link_company(
+    callback: CallbackQuery, master: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    master = get_master_by_user(tg_id)
     if not master:
         await callback.message.answer(
             "Вы ещё не зарегистрированы как исполнитель."
         )
         return
-    if has_any_current_employment(master["id"]):
+    if await has_any_current_employment(master["id"]):
         await callback.message.answer(
             "Сначала завершите текущее сотрудничество.\n"
             "Вы уже числитесь в одной из компаний и не можете прикрепиться к другой."
@@ -853,18 +859,19 @@ async def cb_master_link_company(callback: CallbackQuery):
         "Введите публичный ID компании (например, C-123456), к которой хотите прикрепиться:",
         reply_markup=back_kb(),
     )
-    set_state(tg_id, "master_link_company_enter_id")
+    await set_state(tg_id, "master_link_company_enter_id")
 
 
 @dp.callback_query(F.data == "master_request_leave")
-async def cb_master_request_leave(callback: CallbackQuery):
+async def cb_master_request_leave(
+    callback: CallbackQuery, master: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    master = get_master_by_user(tg_id)
     if not master:
         await callback.message.answer("Вы ещё не зарегистрированы как исполнитель.")
         return
 
-    employment = get_current_employment(master["id"])
+    employment = await get_current_employment(master["id"])
     if not employment:
         await callback.message.answer(
             "Сейчас вы не числитесь ни в одной компании."
@@ -878,34 +885,37 @@ async def cb_master_request_leave(callback: CallbackQuery):
         )
         return
 
-    set_employment_leave_requested(employment["id"])
+    await set_employment_leave_requested(employment["id"])
+    schedule_leave_auto_close(employment["id"], datetime.utcnow())
     await callback.message.answer(
         "Запрос на увольнение отправлен компании.\n"
         "Если компания не отреагирует в течение 2 дней, система автоматически завершит сотрудничество.",
         reply_markup=master_leave_request_kb(employment["id"]),
     )
 
-    company = get_company_by_id(employment["company_id"])
+    company = await get_company_by_id(employment["company_id"])
     if company:
         text = (
             f"Исполнитель {master['full_name']} ({master['public_id']}) "
             f"запросил увольнение.\n"
             "Зайдите в раздел «Запросы» в меню компании, чтобы подтвердить или отменить запрос."
         )
-        try:
-            await bot.send_message(
-                company["tg_id"],
-                text,
-                reply_markup=company_leave_request_actions_kb(employment["id"]),
-            )
-        except Exception:
-            logger.exception("Не удалось уведомить компанию %s о запросе на увольнение", company["id"])
+        notifier.enqueue(
+            company["tg_id"],
+            text,
+            reply_markup=company_leave_request_actions_kb(employment["id"]),
+            failure_log=(
+                "Не удалось уведомить компанию %s о запросе на увольнение",
+                company["id"],
+            ),
+        )
 
 
 @dp.callback_query(F.data.startswith("master_cancel_leave_"))
-async def cb_master_cancel_leave(callback: CallbackQuery):
+async def cb_master_cancel_leave(
+    callback: CallbackQuery, master: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    master = get_master_by_user(tg_id)
     if not master:
         await callback.message.answer("Вы ещё не зарегистрированы как исполнитель.")
         return
@@ -916,7 +926,7 @@ async def cb_master_cancel_leave(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if not employment or employment["master_id"] != master["id"]:
         await callback.message.answer("Сотрудничество не найдено.")
         return
@@ -925,7 +935,7 @@ async def cb_master_cancel_leave(callback: CallbackQuery):
         await callback.message.answer("Запрос на увольнение уже обработан.")
         return
 
-    if not cancel_employment_leave_request(employment_id):
+    if not await cancel_employment_leave_request(employment_id):
         await callback.message.answer("Не удалось отменить запрос. Попробуйте позже.")
         return
 
@@ -934,16 +944,17 @@ async def cb_master_cancel_leave(callback: CallbackQuery):
         reply_markup=master_menu_kb(),
     )
 
-    company = get_company_by_id(employment["company_id"])
+    company = await get_company_by_id(employment["company_id"])
     if company:
-        try:
-            await bot.send_message(
-                company["tg_id"],
-                f"Исполнитель {employment['full_name']} ({employment['master_public_id']}) "
-                "отменил запрос на увольнение.",
-            )
-        except Exception:
-            logger.exception("Не удалось уведомить компанию %s об отмене увольнения", company["id"])
+        notifier.enqueue(
+            company["tg_id"],
+            f"Исполнитель {employment['full_name']} ({employment['master_public_id']}) "
+            "отменил запрос на увольнение.",
+            failure_log=(
+                "Не удалось уведомить компанию %s об отмене увольнения",
+                company["id"],
+            ),
+        )
 
 
 @dp.callback_query(F.data == "master_support")
@@ -961,22 +972,23 @@ async def cb_master_support(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "company_profile")
-async def cb_company_profile(callback: CallbackQuery):
+async def cb_company_profile(callback: CallbackQuery, company: Optional[dict] = None):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer(
             "Вы ещё не зарегистрированы как компания. Используйте /role и выберите «Я компания»."
         )
         return
     await callback.message.answer(format_company_profile(company))
-    await callback.message.answer("Меню компании:", reply_markup=company_menu_kb(company["id"]))
+    counters = await get_company_menu_counters(company["id"])
+    await callback.message.answer("Меню компании:", reply_markup=company_menu_kb(counters))
 
 
 @dp.callback_query(F.data == "company_edit_profile")
-async def cb_company_edit_profile(callback: CallbackQuery):
+async def cb_company_edit_profile(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -985,7 +997,7 @@ async def cb_company_edit_profile(callback: CallbackQuery):
         "Введите новое название компании (или '-' чтобы оставить без изменений):",
         reply_markup=back_kb(),
     )
-    set_state(
+    await set_state(
         tg_id,
         "company_edit_name",
         company_id=company["id"],
@@ -996,14 +1008,15 @@ async def cb_company_edit_profile(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "company_verification")
-async def cb_company_verification(callback: CallbackQuery):
+async def cb_company_verification(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
 
-    verification = get_company_verification_by_company_id(company["id"])
+    verification = await get_company_verification_by_company_id(company["id"])
     if verification and verification["status"] in {"WAITING"}:
         await callback.message.answer(
             "Ваша заявка на верификацию уже в обработке.\n"
@@ -1016,13 +1029,12 @@ async def cb_company_verification(callback: CallbackQuery):
         "Документ доступен только администраторам и хранится после принятия решения.",
         reply_markup=back_kb(),
     )
-    set_state(tg_id, "company_verification_photo", company_id=company["id"])
+    await set_state(tg_id, "company_verification_photo", company_id=company["id"])
 
 
 @dp.callback_query(F.data == "company_employees")
-async def cb_company_employees(callback: CallbackQuery):
+async def cb_company_employees(callback: CallbackQuery, company: Optional[dict] = None):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1032,7 +1044,7 @@ async def cb_company_employees(callback: CallbackQuery):
         await callback.message.answer(msg)
         return
 
-    employments = get_company_employments(company["id"])
+    employments = await get_company_employments(company["id"])
     if not employments:
         await callback.message.answer("У вас пока нет прикреплённых исполнителей.")
     else:
@@ -1040,7 +1052,7 @@ async def cb_company_employees(callback: CallbackQuery):
             "Ваши исполнители:", reply_markup=company_employees_kb(employments)
         )
 
-    ended_exists = bool(get_company_ended_employments(company["id"], limit=1))
+    ended_exists = bool(await get_company_ended_employments(company["id"], limit=1))
     if ended_exists:
         await callback.message.answer(
             "Ниже вы можете посмотреть уволенных сотрудников:",
@@ -1049,9 +1061,10 @@ async def cb_company_employees(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "company_fastconnect")
-async def cb_company_fastconnect(callback: CallbackQuery):
+async def cb_company_fastconnect(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1065,9 +1078,10 @@ async def cb_company_fastconnect(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "company_collaborations")
-async def cb_company_collaborations(callback: CallbackQuery):
+async def cb_company_collaborations(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1089,7 +1103,7 @@ async def send_company_collaborations_list(
     statuses: list[str],
     empty_text: str,
 ):
-    collaborations = get_company_temporary_collaborations(company["id"], statuses)
+    collaborations = await get_company_temporary_collaborations(company["id"], statuses)
     if not collaborations:
         await message.answer(empty_text)
         return
@@ -1109,9 +1123,10 @@ async def send_company_collaborations_list(
 
 
 @dp.callback_query(F.data == "company_collabs_active")
-async def cb_company_collabs_active(callback: CallbackQuery):
+async def cb_company_collabs_active(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1130,9 +1145,10 @@ async def cb_company_collabs_active(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "company_collabs_archive")
-async def cb_company_collabs_archive(callback: CallbackQuery):
+async def cb_company_collabs_archive(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1151,9 +1167,10 @@ async def cb_company_collabs_archive(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.startswith("company_collab_open_"))
-async def cb_company_collab_open(callback: CallbackQuery):
+async def cb_company_collab_open(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1169,7 +1186,7 @@ async def cb_company_collab_open(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    collaboration = get_temporary_collaboration_by_id(collaboration_id)
+    collaboration = await get_temporary_collaboration_by_id(collaboration_id)
     if not collaboration or collaboration["company_id"] != company["id"]:
         await callback.message.answer("Сотрудничество не найдено.")
         return
@@ -1202,18 +1219,22 @@ async def cb_company_collab_open(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.startswith("company_collab_close_success_"))
-async def cb_company_collab_close_success(callback: CallbackQuery):
-    await handle_company_collab_close(callback, "closed_success")
+async def cb_company_collab_close_success(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
+    await handle_company_collab_close(callback, "closed_success", company)
 
 
 @dp.callback_query(F.data.startswith("company_collab_close_problem_"))
-async def cb_company_collab_close_problem(callback: CallbackQuery):
-    await handle_company_collab_close(callback, "closed_problem")
+async def cb_company_collab_close_problem(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
+    await handle_company_collab_close(callback, "closed_problem", company)
 
 
-async def handle_company_collab_close(callback: CallbackQuery, status: str):
-    tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
+async def handle_company_collab_close(
+    callback: CallbackQuery, status: str, company: Optional[dict] = None
+):
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1229,7 +1250,7 @@ async def handle_company_collab_close(callback: CallbackQuery, status: str):
         await callback.message.answer("Некорректные данные.")
         return
 
-    collaboration = get_temporary_collaboration_by_id(collaboration_id)
+    collaboration = await get_temporary_collaboration_by_id(collaboration_id)
     if not collaboration or collaboration["company_id"] != company["id"]:
         await callback.message.answer("Сотрудничество не найдено.")
         return
@@ -1238,32 +1259,31 @@ async def handle_company_collab_close(callback: CallbackQuery, status: str):
         await callback.message.answer("Это сотрудничество уже закрыто.")
         return
 
-    close_temporary_collaboration(collaboration_id, status)
+    await close_temporary_collaboration(collaboration_id, status)
     await callback.message.answer("Сотрудничество закрыто.")
 
-    master = get_master_by_id(collaboration["master_id"])
+    master = await get_master_by_id(collaboration["master_id"])
     if master:
-        try:
-            await bot.send_message(
-                master["tg_id"],
-                f"Компания {company['name']} закрыла временное сотрудничество с вами.",
-            )
-        except Exception:
-            logger.exception(
+        notifier.enqueue(
+            master["tg_id"],
+            f"Компания {company['name']} закрыла временное сотрудничество с вами.",
+            failure_log=(
                 "Не удалось уведомить мастера %s о закрытии временного сотрудничества",
                 master["id"],
-            )
+            ),
+        )
 
 
 @dp.callback_query(F.data.startswith("fastconnect_confirm_"))
-async def cb_fastconnect_confirm(callback: CallbackQuery):
+async def cb_fastconnect_confirm(
+    callback: CallbackQuery, master: Optional[dict] = None, user: Optional[dict] = None
+):
     token = callback.data.split("fastconnect_confirm_", 1)[-1]
-    invite = get_fast_connect_invite_by_token(token)
+    invite = await get_fast_connect_invite_by_token(token)
     if not invite or invite.get("status") != "pending":
         await callback.message.answer("Ссылка на быстрый коннект недействительна или уже использована.")
         return
 
-    master = get_master_by_user(callback.from_user.id)
     if not master:
         await callback.message.answer("Вы ещё не зарегистрированы как исполнитель.")
         return
@@ -1272,46 +1292,44 @@ async def cb_fastconnect_confirm(callback: CallbackQuery):
         await callback.message.answer("Эта ссылка предназначена для другого исполнителя.")
         return
 
-    existing = get_active_temporary_collaboration(invite["company_id"], master["id"])
+    existing = await get_active_temporary_collaboration(invite["company_id"], master["id"])
     if existing:
-        mark_fast_connect_invite_used(invite["id"])
+        await mark_fast_connect_invite_used(invite["id"])
         await callback.message.answer("У вас уже есть активное сотрудничество с этой компанией.")
         return
 
-    user = get_user(callback.from_user.id)
-    collaboration = create_temporary_collaboration(
+    collaboration = await create_temporary_collaboration(
         invite["company_id"],
         master["id"],
         master.get("tg_id"),
         user.get("username") if user else None,
     )
-    mark_fast_connect_invite_used(invite["id"])
+    await mark_fast_connect_invite_used(invite["id"])
 
     await callback.message.answer(
         "Сотрудничество подтверждено ✅\n"
         "Компания сможет закрыть его вручную после завершения работ."
     )
 
-    company = get_company_by_id(invite["company_id"])
+    company = await get_company_by_id(invite["company_id"])
     if company:
-        try:
-            await bot.send_message(
-                company["tg_id"],
-                "Исполнитель подтвердил быстрое сотрудничество.\n"
-                f"Мастер: {invite['master_full_name']} ({invite['master_public_id']})\n"
-                f"ID сотрудничества: {collaboration['id']}",
-            )
-        except Exception:
-            logger.exception(
+        notifier.enqueue(
+            company["tg_id"],
+            "Исполнитель подтвердил быстрое сотрудничество.\n"
+            f"Мастер: {invite['master_full_name']} ({invite['master_public_id']})\n"
+            f"ID сотрудничества: {collaboration['id']}",
+            failure_log=(
                 "Не удалось уведомить компанию %s о подтверждении быстрого коннекта",
                 company["id"],
-            )
+            ),
+        )
 
 
 @dp.callback_query(F.data.startswith("company_employee_"))
-async def cb_company_employee_detail(callback: CallbackQuery):
+async def cb_company_employee_detail(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1327,7 +1345,7 @@ async def cb_company_employee_detail(callback: CallbackQuery):
         await callback.message.answer("Некорректный формат данных.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if not employment or employment["company_id"] != company["id"]:
         await callback.message.answer("Сотрудник не найден.")
         return
@@ -1351,9 +1369,10 @@ async def cb_company_employee_detail(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.startswith("company_ended_employee_"))
-async def cb_company_ended_employee_detail(callback: CallbackQuery):
+async def cb_company_ended_employee_detail(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1369,7 +1388,7 @@ async def cb_company_ended_employee_detail(callback: CallbackQuery):
         await callback.message.answer("Некорректный формат данных.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if not employment or employment["company_id"] != company["id"] or employment["status"] != "ended":
         await callback.message.answer("Уволенный сотрудник не найден.")
         return
@@ -1386,9 +1405,10 @@ async def cb_company_ended_employee_detail(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.startswith("company_end_"))
-async def cb_company_end_employment(callback: CallbackQuery):
+async def cb_company_end_employment(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1404,29 +1424,31 @@ async def cb_company_end_employment(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if not employment or employment["company_id"] != company["id"] or employment["status"] == "ended":
         await callback.message.answer("Сотрудничество не найдено или уже завершено.")
         return
 
-    end_employment(employment_id)
+    await end_employment(employment_id)
     await callback.message.answer("Сотрудничество завершено.")
 
-    master = get_master_by_id(employment["master_id"])
+    master = await get_master_by_id(employment["master_id"])
     if master:
-        try:
-            await bot.send_message(
-                master["tg_id"],
-                f"Компания {company['name']} завершила сотрудничество с вами.",
-            )
-        except Exception:
-            logger.exception("Не удалось уведомить мастера %s о завершении сотрудничества", master["id"])
+        notifier.enqueue(
+            master["tg_id"],
+            f"Компания {company['name']} завершила сотрудничество с вами.",
+            failure_log=(
+                "Не удалось уведомить мастера %s о завершении сотрудничества",
+                master["id"],
+            ),
+        )
 
 
 @dp.callback_query(F.data.startswith("company_employment_reviews_"))
-async def cb_company_employment_reviews(callback: CallbackQuery):
+async def cb_company_employment_reviews(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1442,19 +1464,20 @@ async def cb_company_employment_reviews(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if not employment or employment["company_id"] != company["id"]:
         await callback.message.answer("Сотрудничество не найдено.")
         return
 
-    reviews = get_reviews_for_employment(employment_id)
+    reviews = await get_reviews_for_employment(employment_id)
     await callback.message.answer(format_employment_reviews(employment, reviews))
 
 
 @dp.callback_query(F.data.startswith("company_review_"))
-async def cb_company_review_employment(callback: CallbackQuery):
+async def cb_company_review_employment(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1470,7 +1493,7 @@ async def cb_company_review_employment(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if not employment or employment["company_id"] != company["id"]:
         await callback.message.answer("Сотрудничество не найдено.")
         return
@@ -1479,7 +1502,7 @@ async def cb_company_review_employment(callback: CallbackQuery):
         "Выберите оценку исполнителю (1 — плохо, 5 — отлично):",
         reply_markup=rating_choice_kb(),
     )
-    set_state(
+    await set_state(
         tg_id,
         "company_review_rating",
         employment_id=employment_id,
@@ -1489,9 +1512,10 @@ async def cb_company_review_employment(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "company_view_requests")
-async def cb_company_view_requests(callback: CallbackQuery):
+async def cb_company_view_requests(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1501,8 +1525,8 @@ async def cb_company_view_requests(callback: CallbackQuery):
         await callback.message.answer(msg)
         return
 
-    hire_requests = get_pending_employments_for_company(company["id"])
-    leave_requests = get_pending_leave_requests_for_company(company["id"])
+    hire_requests = await get_pending_employments_for_company(company["id"])
+    leave_requests = await get_pending_leave_requests_for_company(company["id"])
 
     if not hire_requests and not leave_requests:
         await callback.message.answer("У вас нет новых запросов от исполнителей.")
@@ -1522,9 +1546,10 @@ async def cb_company_view_requests(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.regexp(r"^company_request_\d+$"))
-async def cb_company_request_detail(callback: CallbackQuery):
+async def cb_company_request_detail(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1540,7 +1565,7 @@ async def cb_company_request_detail(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id, include_passport=True)
     if not employment or employment["company_id"] != company["id"]:
         await callback.message.answer("Запрос не найден.")
         return
@@ -1561,9 +1586,10 @@ async def cb_company_request_detail(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.regexp(r"^company_leave_request_\d+$"))
-async def cb_company_leave_request_detail(callback: CallbackQuery):
+async def cb_company_leave_request_detail(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1574,7 +1600,7 @@ async def cb_company_leave_request_detail(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if (
         not employment
         or employment["company_id"] != company["id"]
@@ -1597,9 +1623,10 @@ async def cb_company_leave_request_detail(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.startswith("company_leave_request_accept_"))
-async def cb_company_leave_request_accept(callback: CallbackQuery):
+async def cb_company_leave_request_accept(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1610,7 +1637,7 @@ async def cb_company_leave_request_accept(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if (
         not employment
         or employment["company_id"] != company["id"]
@@ -1619,12 +1646,12 @@ async def cb_company_leave_request_accept(callback: CallbackQuery):
         await callback.message.answer("Запрос не найден или уже обработан.")
         return
 
-    end_employment(employment_id)
+    await end_employment(employment_id)
     await callback.message.answer(
         "Запрос на увольнение подтверждён. Сотрудничество завершено.\n\n"
         "Хотите оставить отзыв об этом исполнителе?"
     )
-    set_state(
+    await set_state(
         tg_id,
         "company_review_prompt_after_leave",
         employment_id=employment_id,
@@ -1632,21 +1659,23 @@ async def cb_company_leave_request_accept(callback: CallbackQuery):
         company_id=company["id"],
     )
 
-    master = get_master_by_id(employment["master_id"])
+    master = await get_master_by_id(employment["master_id"])
     if master:
-        try:
-            await bot.send_message(
-                master["tg_id"],
-                f"Компания {company['name']} завершила сотрудничество по вашему запросу на увольнение.",
-            )
-        except Exception:
-            logger.exception("Не удалось уведомить мастера %s о подтверждении увольнения", master["id"])
+        notifier.enqueue(
+            master["tg_id"],
+            f"Компания {company['name']} завершила сотрудничество по вашему запросу на увольнение.",
+            failure_log=(
+                "Не удалось уведомить мастера %s о подтверждении увольнения",
+                master["id"],
+            ),
+        )
 
 
 @dp.callback_query(F.data.startswith("company_leave_request_decline_"))
-async def cb_company_leave_request_decline(callback: CallbackQuery):
+async def cb_company_leave_request_decline(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1657,7 +1686,7 @@ async def cb_company_leave_request_decline(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if (
         not employment
         or employment["company_id"] != company["id"]
@@ -1666,27 +1695,29 @@ async def cb_company_leave_request_decline(callback: CallbackQuery):
         await callback.message.answer("Запрос не найден или уже обработан.")
         return
 
-    if not cancel_employment_leave_request(employment_id):
+    if not await cancel_employment_leave_request(employment_id):
         await callback.message.answer("Не удалось отменить запрос. Попробуйте позже.")
         return
 
     await callback.message.answer("Запрос на увольнение отменён. Сотрудник остаётся в компании.")
 
-    master = get_master_by_id(employment["master_id"])
+    master = await get_master_by_id(employment["master_id"])
     if master:
-        try:
-            await bot.send_message(
-                master["tg_id"],
-                f"Компания {company['name']} отклонила ваш запрос на увольнение.",
-            )
-        except Exception:
-            logger.exception("Не удалось уведомить мастера %s об отклонении увольнения", master["id"])
+        notifier.enqueue(
+            master["tg_id"],
+            f"Компания {company['name']} отклонила ваш запрос на увольнение.",
+            failure_log=(
+                "Не удалось уведомить мастера %s об отклонении увольнения",
+                master["id"],
+            ),
+        )
 
 
 @dp.callback_query(F.data.startswith("company_request_accept_"))
-async def cb_company_request_accept(callback: CallbackQuery):
+async def cb_company_request_accept(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1702,34 +1733,33 @@ async def cb_company_request_accept(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if not employment or employment["company_id"] != company["id"]:
         await callback.message.answer("Запрос не найден.")
         return
 
-    set_employment_accepted(employment_id)
+    await set_employment_accepted(employment_id)
 
     master_id = employment["master_id"]
-    master = get_master_by_id(master_id)
+    master = await get_master_by_id(master_id)
     if master:
         if not master.get("passport_locked"):
-            set_master_passport_locked(master_id, True)
-        try:
-            await bot.send_message(
-                master["tg_id"],
-                f"Компания {company['name']} приняла ваш запрос на сотрудничество.\n"
-                "Вы теперь числитесь в их команде.",
-            )
-        except Exception:
-            logger.exception("Не удалось отправить уведомление мастеру о подтверждении запроса")
+            await set_master_passport_locked(master_id, True)
+        notifier.enqueue(
+            master["tg_id"],
+            f"Компания {company['name']} приняла ваш запрос на сотрудничество.\n"
+            "Вы теперь числитесь в их команде.",
+            failure_log=("Не удалось отправить уведомление мастеру о подтверждении запроса",),
+        )
 
     await callback.message.answer("Запрос подтверждён, паспорт совпадает, исполнитель добавлен в вашу компанию.")
 
 
 @dp.callback_query(F.data.startswith("company_request_reject_"))
-async def cb_company_request_reject(callback: CallbackQuery):
+async def cb_company_request_reject(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1745,7 +1775,7 @@ async def cb_company_request_reject(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if not employment or employment["company_id"] != company["id"]:
         await callback.message.answer("Запрос не найден.")
         return
@@ -1754,7 +1784,7 @@ async def cb_company_request_reject(callback: CallbackQuery):
         "Напишите причину отказа (это сообщение увидит исполнитель):",
         reply_markup=back_kb(),
     )
-    set_state(
+    await set_state(
         tg_id,
         "company_request_reject_reason",
         employment_id=employment_id,
@@ -1763,9 +1793,10 @@ async def cb_company_request_reject(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.startswith("company_ended_list_"))
-async def cb_company_ended_list(callback: CallbackQuery):
+async def cb_company_ended_list(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1775,17 +1806,22 @@ async def cb_company_ended_list(callback: CallbackQuery):
         await callback.message.answer(msg)
         return
 
-    try:
-        offset = int(callback.data.split("_")[-1])
-    except ValueError:
-        await callback.message.answer("Некорректные данные.")
-        return
+    # company_ended_list_0 — первая страница, company_ended_list_<ended_at>_<id> — следующие
+    cursor = callback.data[len("company_ended_list_"):]
+    after = None
+    if "_" in cursor:
+        ended_at, _, last_id = cursor.rpartition("_")
+        try:
+            after = (ended_at, int(last_id))
+        except ValueError:
+            await callback.message.answer("Некорректные данные.")
+            return
 
     per_page = 10
     slice_size = per_page + 1
-    ended = get_company_ended_employments(company["id"], limit=slice_size, offset=offset)
+    ended = await get_company_ended_employments(company["id"], limit=slice_size, after=after)
     if not ended:
-        if offset == 0:
+        if after is None:
             await callback.message.answer("У вас пока нет уволенных сотрудников.")
         else:
             await callback.message.answer("Больше уволенных сотрудников нет.")
@@ -1793,18 +1829,18 @@ async def cb_company_ended_list(callback: CallbackQuery):
 
     has_more = len(ended) > per_page
     shown = ended[:per_page]
-    next_offset = offset + per_page if has_more else None
 
     await callback.message.answer(
-        f"Уволенные сотрудники (с {offset + 1}-го):",
-        reply_markup=company_ended_employees_kb(shown, next_offset),
+        "Уволенные сотрудники:" if after is None else "Уволенные сотрудники (продолжение):",
+        reply_markup=company_ended_employees_kb(shown, has_more),
     )
 
 
 @dp.callback_query(F.data == "company_check_master")
-async def cb_company_check_master(callback: CallbackQuery):
+async def cb_company_check_master(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1813,7 +1849,7 @@ async def cb_company_check_master(callback: CallbackQuery):
         "Введите ID исполнителя (например, M-123456), которого хотите проверить:",
         reply_markup=back_kb(),
     )
-    set_state(
+    await set_state(
         tg_id,
         "company_check_master_enter_id",
     )
@@ -1826,9 +1862,10 @@ async def cb_company_change_passport_root(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.startswith("company_change_passport_"))
-async def cb_company_change_passport(callback: CallbackQuery):
+async def cb_company_change_passport(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1844,12 +1881,12 @@ async def cb_company_change_passport(callback: CallbackQuery):
         await callback.message.answer("Некорректные данные.")
         return
 
-    employment = get_employment_by_id(employment_id)
+    employment = await get_employment_by_id(employment_id)
     if not employment or employment["company_id"] != company["id"]:
         await callback.message.answer("Сотрудничество не найдено.")
         return
 
-    master = get_master_by_id(employment["master_id"])
+    master = await get_master_by_id(employment["master_id"], include_passport=True)
     if not master:
         await callback.message.answer("Исполнитель не найден.")
         return
@@ -1860,7 +1897,7 @@ async def cb_company_change_passport(callback: CallbackQuery):
         "Введите новые паспортные данные (серия и номер), которые вы видите в документе:",
         reply_markup=back_kb(),
     )
-    set_state(
+    await set_state(
         tg_id,
         "company_change_passport_enter",
         master_id=master["id"],
@@ -1868,9 +1905,10 @@ async def cb_company_change_passport(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "company_view_appeals")
-async def cb_company_view_appeals(callback: CallbackQuery):
+async def cb_company_view_appeals(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1880,7 +1918,7 @@ async def cb_company_view_appeals(callback: CallbackQuery):
         await callback.message.answer(msg)
         return
 
-    appeals = get_pending_company_appeals(company["id"])
+    appeals = await get_pending_company_appeals(company["id"])
     if not appeals:
         await callback.message.answer("По вашим отзывам нет активных жалоб от исполнителей.")
         return
@@ -1892,9 +1930,10 @@ async def cb_company_view_appeals(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.startswith("company_appeal_"))
-async def cb_company_appeal_detail(callback: CallbackQuery):
+async def cb_company_appeal_detail(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1911,7 +1950,7 @@ async def cb_company_appeal_detail(callback: CallbackQuery):
         except ValueError:
             await callback.message.answer("Некорректные данные.")
             return
-        appeal = get_review_appeal_by_id(appeal_id)
+        appeal = await get_review_appeal_by_id(appeal_id)
         if not appeal or appeal["company_id"] != company["id"]:
             await callback.message.answer("Жалоба не найдена.")
             return
@@ -1921,7 +1960,7 @@ async def cb_company_appeal_detail(callback: CallbackQuery):
             f"Исполнитель: {appeal['master_full_name']} ({appeal['master_public_id']})\n"
             f"Компания: {appeal.get('company_name') or 'не указана'} "
             f"({appeal.get('company_public_id') or '-'})\n\n"
-            f"Текст отзыва:\n{appeal['review_text']}\n\n"
+            f"Текст отзыва:\n{appeal['review_text'] or 'отзыв удалён'}\n\n"
             f"Жалоба исполнителя:\n{appeal.get('master_comment') or 'не указано'}\n\n"
             "Вы можете отправить комментарий и при необходимости приложить файлы (фото/сканы документов)."
         )
@@ -1937,7 +1976,7 @@ async def cb_company_appeal_detail(callback: CallbackQuery):
             await callback.message.answer("Некорректные данные.")
             return
 
-        appeal = get_review_appeal_by_id(appeal_id)
+        appeal = await get_review_appeal_by_id(appeal_id)
         if not appeal or appeal["company_id"] != company["id"]:
             await callback.message.answer("Жалоба не найдена.")
             return
@@ -1949,7 +1988,7 @@ async def cb_company_appeal_detail(callback: CallbackQuery):
             "Это сообщение мы передадим исполнителю вместе с жалобой.",
             reply_markup=back_kb(),
         )
-        set_state(
+        await set_state(
             tg_id,
             "company_appeal_respond",
             appeal_id=appeal_id,
@@ -1958,9 +1997,10 @@ async def cb_company_appeal_detail(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data == "company_subscription")
-async def cb_company_subscription(callback: CallbackQuery):
+async def cb_company_subscription(
+    callback: CallbackQuery, company: Optional[dict] = None
+):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -1988,9 +2028,8 @@ async def cb_company_subscription(callback: CallbackQuery):
 
 
 @dp.callback_query(F.data.startswith("company_sub_plan_"))
-async def cb_company_sub_plan(callback: CallbackQuery):
+async def cb_company_sub_plan(callback: CallbackQuery, company: Optional[dict] = None):
     tg_id = callback.from_user.id
-    company = get_company_by_user(tg_id)
     if not company:
         await callback.message.answer("Вы ещё не зарегистрированы как компания.")
         return
@@ -2017,7 +2056,7 @@ async def cb_company_sub_plan(callback: CallbackQuery):
         "После получения подтверждения мы активируем подписку.",
         reply_markup=back_kb(),
     )
-    set_state(
+    await set_state(
         tg_id,
         "company_send_payment_proof",
         company_id=company["id"],
@@ -2045,7 +2084,7 @@ async def cb_viewer_check_master(callback: CallbackQuery):
         "Введите ID исполнителя (например, M-123456), которого хотите проверить:",
         reply_markup=back_kb(),
     )
-    set_state(
+    await set_state(
         callback.from_user.id,
         "viewer_check_master_enter_id",
     )
@@ -2066,12 +2105,14 @@ async def cb_viewer_about(callback: CallbackQuery):
 
 
 @dp.message()
-async def generic_message_handler(message: Message):
+async def generic_message_handler(
+    message: Message,
+    pending_state: Optional[PendingState] = None,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
     tg_id = message.from_user.id
-    user = get_user(tg_id) or get_or_create_user(message)
-    _role = user["role"]
-
-    state = get_state(tg_id)
+    state = pending_state
     if not state:
         await message.answer(
             "Я пока не понимаю это сообщение.\n"
@@ -2081,7 +2122,7 @@ async def generic_message_handler(message: Message):
 
     # Обработка кнопки «Назад»
     if message.text and message.text.strip() == BACK_TEXT:
-        pop_state(tg_id)
+        await pop_state(tg_id)
         await message.answer(
             "Действие отменено. Вы вернулись в главное состояние.\n"
             "Используйте /start или /role, чтобы начать заново.",
@@ -2089,951 +2130,1130 @@ async def generic_message_handler(message: Message):
         )
         return
 
-    action = state.action
-
-    # === Регистрация исполнителя ===
-    if action == "master_register_full_name":
-        full_name = message.text.strip()
-        is_valid, error_msg = validate_full_name(full_name)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
-        
-        await message.answer(
-            "Введите ваш номер телефона:",
-            reply_markup=back_kb(),
-        )
-        set_state(tg_id, "master_register_phone", full_name=full_name)
-        return
-
-    if action == "master_register_phone":
-        phone = message.text.strip()
-        is_valid, error_msg = validate_phone(phone)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
-        
-        full_name = state.data["full_name"]
+    handler = get_state_action(state.action)
+    if handler is None:
+        # Состояние без обработчика (например, осталось от старой версии бота)
         await message.answer(
-            "Укажите серию и номер паспорта:",
-            reply_markup=back_kb(),
-        )
-        set_state(
-            tg_id,
-            "master_register_passport",
-            full_name=full_name,
-            phone=phone,
+            "Похоже, я не понял, что вы хотели сделать.\n"
+            "Попробуйте воспользоваться командами /start или /role."
         )
         return
 
-    if action == "master_register_passport":
-        passport = message.text.strip()
-        is_valid, error_msg = validate_passport(passport)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
-        
-        full_name = state.data["full_name"]
-        phone = state.data["phone"]
+    await handler(message, state, master=master, company=company)
 
-        master = create_master(tg_id, full_name, phone, passport)
-        pop_state(tg_id)
 
-        await message.answer(
-            "Вы зарегистрированы как исполнитель ✅",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-        rating = get_master_rating(master["id"])
-        await message.answer(format_master_profile(master, rating))
-        await message.answer(
-            "Ваш личный кабинет:", reply_markup=master_menu_kb()
-        )
+# === Регистрация исполнителя ===
+@state_action("master_register_full_name")
+async def state_master_register_full_name(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    full_name = message.text.strip()
+    is_valid, error_msg = validate_full_name(full_name)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
         return
 
-    # === Мастер – ввод ID компании для прикрепления ===
-    if action == "master_link_company_enter_id":
-        company_id_text = message.text.strip().upper()
-        is_valid, error_msg = validate_public_id(company_id_text)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
-        
-        master = get_master_by_user(tg_id)
-        if not master:
-            await message.answer("Вы ещё не зарегистрированы как исполнитель.")
-            pop_state(tg_id)
-            return
-
-        company = get_company_by_public_id(company_id_text)
-        if not company:
-            await message.answer("Компания с таким ID не найдена.")
-            pop_state(tg_id)
-            return
-
-        if has_pending_or_active_employment(master["id"], company["id"]):
-            await message.answer(
-                "У вас уже есть запрос или активное сотрудничество с этой компанией."
-            )
-            pop_state(tg_id)
-            return
+    await message.answer(
+        "Введите ваш номер телефона:",
+        reply_markup=back_kb(),
+    )
+    await set_state(tg_id, "master_register_phone", full_name=full_name)
 
-        if has_any_current_employment(master["id"]):
-            await message.answer(
-                "Сначала завершите текущее сотрудничество.\n"
-                "Вы уже числитесь в одной из компаний и не можете прикрепиться к другой."
-            )
-            pop_state(tg_id)
-            return
 
-        await message.answer(
-            f"Компания найдена: {company['name']} ({company['public_id']}).\n"
-            "Введите вашу должность (например, «мастер по ремонту техники»):",
-            reply_markup=back_kb(),
-        )
-        set_state(
-            tg_id,
-            "master_enter_position",
-            master_id=master["id"],
-            company_id=company["id"],
-        )
+@state_action("master_register_phone")
+async def state_master_register_phone(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    phone = message.text.strip()
+    is_valid, error_msg = validate_phone(phone)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
         return
 
-    if action == "master_enter_position":
-        position = message.text.strip() if message.text else ""
-        
-        # Валидация должности
-        is_valid, error_msg = validate_position(position)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
-        
-        master_id = state.data["master_id"]
-        company_id = state.data["company_id"]
-
-        if has_any_current_employment(master_id):
-            await message.answer(
-                "Сначала завершите текущее сотрудничество.\n"
-                "Вы уже числитесь в одной из компаний и не можете прикрепиться к другой."
-            )
-            pop_state(tg_id)
-            return
+    full_name = state.data["full_name"]
+    await message.answer(
+        "Укажите серию и номер паспорта:",
+        reply_markup=back_kb(),
+    )
+    await set_state(
+        tg_id,
+        "master_register_passport",
+        full_name=full_name,
+        phone=phone,
+    )
 
-        if has_pending_or_active_employment(master_id, company_id):
-            await message.answer(
-                "У вас уже есть запрос или активное сотрудничество с этой компанией."
-            )
-            pop_state(tg_id)
-            return
 
-        create_employment(master_id, company_id, position)
-        pop_state(tg_id)
-        await message.answer(
-            "Запрос отправлен компании. Ожидайте подтверждения.\n"
-            "Вы получите уведомление в этом чате, когда компания отреагирует.",
-            reply_markup=ReplyKeyboardRemove(),
-        )
+@state_action("master_register_passport")
+async def state_master_register_passport(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    passport = message.text.strip()
+    is_valid, error_msg = validate_passport(passport)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
+        return
 
-        master = get_master_by_id(master_id)
-        company = get_company_by_id(company_id)
-        if company:
-            try:
-                await bot.send_message(
-                    company["tg_id"],
-                    (
-                        "Новый запрос на сотрудничество:\n"
-                        f"Исполнитель: {master['full_name']} ({master['public_id']})\n"
-                        f"Должность: {position or 'не указана'}\n\n"
-                        "Перейдите в раздел «Запросы», чтобы подтвердить или отклонить."
-                    ),
-                )
-            except Exception:
-                logger.exception("Не удалось уведомить компанию %s о новом запросе", company_id)
-        return
-
-    if action == "company_fastconnect_master_id":
-        public_id = message.text.strip().upper()
-        is_valid, error_msg = validate_public_id(public_id)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
+    full_name = state.data["full_name"]
+    phone = state.data["phone"]
 
-        company_id = state.data["company_id"]
-        company = get_company_by_user(tg_id)
-        if not company or company["id"] != company_id:
-            await message.answer("Ошибка контекста компании. Попробуйте начать заново.")
-            pop_state(tg_id)
-            return
+    master = await create_master(tg_id, full_name, phone, passport)
+    await pop_state(tg_id)
 
-        msg = ensure_company_can_act(company, require_subscription=False)
-        if msg:
-            await message.answer(msg)
-            pop_state(tg_id)
-            return
+    await message.answer(
+        "Вы зарегистрированы как исполнитель ✅",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    rating = await get_master_rating(master["id"])
+    await message.answer(format_master_profile(master, rating))
+    await message.answer(
+        "Ваш личный кабинет:", reply_markup=master_menu_kb()
+    )
 
-        master = get_master_by_public_id(public_id)
-        if not master:
-            await message.answer("Исполнитель с таким ID не найден.")
-            pop_state(tg_id)
-            return
 
-        if master.get("blocked"):
-            await message.answer("Профиль исполнителя заблокирован, быстрый коннект недоступен.")
-            pop_state(tg_id)
-            return
+# === Мастер – ввод ID компании для прикрепления ===
+@state_action("master_link_company_enter_id")
+async def state_master_link_company_enter_id(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    company_id_text = message.text.strip().upper()
+    is_valid, error_msg = validate_public_id(company_id_text)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
+        return
 
-        existing = get_active_temporary_collaboration(company["id"], master["id"])
-        if existing:
-            await message.answer("У вас уже есть активное сотрудничество с этим мастером.")
-            pop_state(tg_id)
-            return
+    if not master:
+        await message.answer("Вы ещё не зарегистрированы как исполнитель.")
+        await pop_state(tg_id)
+        return
 
-        invite = create_fast_connect_invite(company["id"], master["id"])
-        bot_info = await bot.get_me()
-        bot_username = bot_info.username
-        link = f"https://t.me/{bot_username}?start=fastconnect_{invite['token']}"
+    company = await get_company_by_public_id(company_id_text)
+    if not company:
+        await message.answer("Компания с таким ID не найдена.")
+        await pop_state(tg_id)
+        return
 
-        pop_state(tg_id)
+    if await has_pending_or_active_employment(master["id"], company["id"]):
         await message.answer(
-            "Готово! Отправьте эту ссылку мастеру для подтверждения сотрудничества:\n"
-            f"{link}",
-            reply_markup=ReplyKeyboardRemove(),
+            "У вас уже есть запрос или активное сотрудничество с этой компанией."
         )
-
-        try:
-            await bot.send_message(
-                master["tg_id"],
-                (
-                    f"Компания {company['name']} приглашает вас к быстрому сотрудничеству.\n"
-                    "Нажмите кнопку ниже для подтверждения."
-                ),
-                reply_markup=fastconnect_confirm_kb(invite["token"]),
-            )
-        except Exception:
-            logger.exception("Не удалось отправить ссылку на быстрый коннект мастеру %s", master["id"])
+        await pop_state(tg_id)
         return
 
-    # === Регистрация компании ===
-    if action == "company_enter_name":
-        name = message.text.strip()
-        is_valid, error_msg = validate_company_name(name)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
-        
+    if await has_any_current_employment(master["id"]):
         await message.answer(
-            "Введите город (можно пропустить, отправив -):",
-            reply_markup=back_kb(),
+            "Сначала завершите текущее сотрудничество.\n"
+            "Вы уже числитесь в одной из компаний и не можете прикрепиться к другой."
         )
-        set_state(tg_id, "company_enter_city", name=name)
+        await pop_state(tg_id)
         return
 
-    if action == "company_enter_city":
-        city_raw = message.text.strip()
-        city = None if city_raw == "-" else city_raw
-        name = state.data["name"]
+    await message.answer(
+        f"Компания найдена: {company['name']} ({company['public_id']}).\n"
+        "Введите вашу должность (например, «мастер по ремонту техники»):",
+        reply_markup=back_kb(),
+    )
+    await set_state(
+        tg_id,
+        "master_enter_position",
+        master_id=master["id"],
+        company_id=company["id"],
+    )
+
 
-        await message.answer(
-            "Введите номер ответственного лица (телефон для связи):",
-            reply_markup=back_kb(),
-        )
-        set_state(
-            tg_id,
-            "company_enter_responsible_phone",
-            name=name,
-            city=city,
-        )
-        return
+@state_action("master_enter_position")
+async def state_master_enter_position(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    position = message.text.strip() if message.text else ""
 
-    if action == "company_enter_responsible_phone":
-        phone = message.text.strip()
-        is_valid, error_msg = validate_phone(phone)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
-        
-        name = state.data["name"]
-        city = state.data["city"]
+    # Валидация должности
+    is_valid, error_msg = validate_position(position)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
+        return
 
-        company = create_company(tg_id, name, city, phone)
-        pop_state(tg_id)
+    master_id = state.data["master_id"]
+    company_id = state.data["company_id"]
 
+    if await has_any_current_employment(master_id):
         await message.answer(
-            "Компания зарегистрирована ✅",
-            reply_markup=ReplyKeyboardRemove(),
+            "Сначала завершите текущее сотрудничество.\n"
+            "Вы уже числитесь в одной из компаний и не можете прикрепиться к другой."
         )
-        await message.answer(format_company_profile(company))
+        await pop_state(tg_id)
+        return
+
+    if await has_pending_or_active_employment(master_id, company_id):
         await message.answer(
-            "Личный кабинет компании:", reply_markup=company_menu_kb(company["id"])
+            "У вас уже есть запрос или активное сотрудничество с этой компанией."
         )
+        await pop_state(tg_id)
         return
 
-    # === Верификация компании: фото паспорта ===
-    if action == "company_verification_photo":
-        if message.video or message.video_note:
-            await message.answer("Сначала отправьте фото паспорта, видео будет следующим шагом.")
-            return
-        if not message.photo:
-            await message.answer("Пожалуйста, отправьте фото паспорта ответственного лица.")
-            return
-
-        company_id = state.data["company_id"]
-        photo_file_id = message.photo[-1].file_id
+    await create_employment(master_id, company_id, position)
+    await pop_state(tg_id)
+    await message.answer(
+        "Запрос отправлен компании. Ожидайте подтверждения.\n"
+        "Вы получите уведомление в этом чате, когда компания отреагирует.",
+        reply_markup=ReplyKeyboardRemove(),
+    )
 
-        await message.answer(
-            "Фото получено. Теперь отправьте видео с паспортом.",
-            reply_markup=back_kb(),
-        )
-        set_state(
-            tg_id,
-            "company_verification_video",
-            company_id=company_id,
-            passport_photo_file_id=photo_file_id,
-        )
+    master = await get_master_by_id(master_id)
+    company = await get_company_by_id(company_id)
+    if company:
+        notifier.enqueue(
+            company["tg_id"],
+            (
+                "Новый запрос на сотрудничество:\n"
+                f"Исполнитель: {master['full_name']} ({master['public_id']})\n"
+                f"Должность: {position or 'не указана'}\n\n"
+                "Перейдите в раздел «Запросы», чтобы подтвердить или отклонить."
+            ),
+            failure_log=(
+                "Не удалось уведомить компанию %s о новом запросе",
+                company_id,
+            ),
+        )
+
+
+@state_action("company_fastconnect_master_id")
+async def state_company_fastconnect_master_id(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    public_id = message.text.strip().upper()
+    is_valid, error_msg = validate_public_id(public_id)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
         return
 
-    # === Верификация компании: видео с паспортом ===
-    if action == "company_verification_video":
-        if message.photo and not (message.video or message.video_note):
-            await message.answer("Нужно видео. Фото уже получено.")
-            return
-        if not (message.video or message.video_note):
-            await message.answer("Пожалуйста, отправьте видео с паспортом.")
-            return
+    company_id = state.data["company_id"]
+    if not company or company["id"] != company_id:
+        await message.answer("Ошибка контекста компании. Попробуйте начать заново.")
+        await pop_state(tg_id)
+        return
 
-        company_id = state.data["company_id"]
-        photo_file_id = state.data["passport_photo_file_id"]
-        video = message.video or message.video_note
-        video_file_id = video.file_id
+    msg = ensure_company_can_act(company, require_subscription=False)
+    if msg:
+        await message.answer(msg)
+        await pop_state(tg_id)
+        return
 
-        create_company_verification(
-            company_id=company_id,
-            passport_photo_file_id=photo_file_id,
-            passport_video_file_id=video_file_id,
-        )
-        pop_state(tg_id)
-        await message.answer(
-            "Верификация отправлена ✅\n"
-            "Видео хранится до принятия решения и затем удаляется.",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-        await message.answer("Меню компании:", reply_markup=company_menu_kb(company_id))
+    master = await get_master_by_public_id(public_id)
+    if not master:
+        await message.answer("Исполнитель с таким ID не найден.")
+        await pop_state(tg_id)
         return
 
-    # === Компания редактирует название ===
-    if action == "company_edit_name":
-        new_name = message.text.strip()
-        if new_name != "-":
-            is_valid, error_msg = validate_company_name(new_name)
-            if not is_valid:
-                await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-                return
+    if master.get("blocked"):
+        await message.answer("Профиль исполнителя заблокирован, быстрый коннект недоступен.")
+        await pop_state(tg_id)
+        return
 
-        company_id = state.data["company_id"]
-        company = get_company_by_user(tg_id)
-        if not company or company["id"] != company_id:
-            await message.answer("Ошибка контекста компании. Попробуйте начать заново.")
-            pop_state(tg_id)
-            return
+    existing = await get_active_temporary_collaboration(company["id"], master["id"])
+    if existing:
+        await message.answer("У вас уже есть активное сотрудничество с этим мастером.")
+        await pop_state(tg_id)
+        return
 
-        final_name = state.data["name"] if new_name == "-" else new_name
-        with closing(get_conn()) as conn, conn:
-            conn.execute(
-                "UPDATE companies SET name = ? WHERE id = ?",
-                (final_name, company_id),
-            )
+    invite = await create_fast_connect_invite(company["id"], master["id"])
+    bot_info = await bot.get_me()
+    bot_username = bot_info.username
+    link = f"https://t.me/{bot_username}?start=fastconnect_{invite['token']}"
 
-        pop_state(tg_id)
-        updated_company = get_company_by_id(company_id)
-        await message.answer(
-            "Название компании обновлено.",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-        await message.answer(
-            format_company_profile(updated_company),
-            reply_markup=company_menu_kb(company_id),
-        )
+    await pop_state(tg_id)
+    await message.answer(
+        "Готово! Отправьте эту ссылку мастеру для подтверждения сотрудничества:\n"
+        f"{link}",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+
+    notifier.enqueue(
+        master["tg_id"],
+        (
+            f"Компания {company['name']} приглашает вас к быстрому сотрудничеству.\n"
+            "Нажмите кнопку ниже для подтверждения."
+        ),
+        reply_markup=fastconnect_confirm_kb(invite["token"]),
+        failure_log=(
+            "Не удалось отправить ссылку на быстрый коннект мастеру %s",
+            master["id"],
+        ),
+    )
+
+
+# === Регистрация компании ===
+@state_action("company_enter_name")
+async def state_company_enter_name(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    name = message.text.strip()
+    is_valid, error_msg = validate_company_name(name)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
         return
 
-    # === Регистрация обычного пользователя (телефон) ===
-    if action == "viewer_enter_phone":
-        phone = message.text.strip()
-        is_valid, error_msg = validate_phone(phone)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
-        
-        set_user_phone(tg_id, phone)
-        pop_state(tg_id)
-        await message.answer(
-            "Телефон сохранён. Теперь вы можете проверять исполнителей по ID.",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-        await message.answer("Меню:", reply_markup=viewer_menu_kb())
+    await message.answer(
+        "Введите город (можно пропустить, отправив -):",
+        reply_markup=back_kb(),
+    )
+    await set_state(tg_id, "company_enter_city", name=name)
+
+
+@state_action("company_enter_city")
+async def state_company_enter_city(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    city_raw = message.text.strip()
+    city = None if city_raw == "-" else city_raw
+    name = state.data["name"]
+
+    await message.answer(
+        "Введите номер ответственного лица (телефон для связи):",
+        reply_markup=back_kb(),
+    )
+    await set_state(
+        tg_id,
+        "company_enter_responsible_phone",
+        name=name,
+        city=city,
+    )
+
+
+@state_action("company_enter_responsible_phone")
+async def state_company_enter_responsible_phone(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    phone = message.text.strip()
+    is_valid, error_msg = validate_phone(phone)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
         return
 
-    # === Проверка исполнителя по ID (для зрителя / компании) ===
-    if action == "viewer_check_master_enter_id":
-        public_id = message.text.strip().upper()
-        is_valid, error_msg = validate_public_id(public_id)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
-        
-        master = get_master_by_public_id(public_id)
-        if not master:
-            await message.answer("Исполнитель с таким ID не найден.")
-            pop_state(tg_id)
-            return
+    name = state.data["name"]
+    city = state.data["city"]
+
+    company = await create_company(tg_id, name, city, phone)
+    await pop_state(tg_id)
+
+    await message.answer(
+        "Компания зарегистрирована ✅",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    await message.answer(format_company_profile(company))
+    counters = await get_company_menu_counters(company["id"])
+    await message.answer(
+        "Личный кабинет компании:", reply_markup=company_menu_kb(counters)
+    )
+
+
+# === Верификация компании: фото паспорта ===
+@state_action("company_verification_photo")
+async def state_company_verification_photo(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    if message.video or message.video_note:
+        await message.answer("Сначала отправьте фото паспорта, видео будет следующим шагом.")
+        return
+    if not message.photo:
+        await message.answer("Пожалуйста, отправьте фото паспорта ответственного лица.")
+        return
+
+    company_id = state.data["company_id"]
+    photo_file_id = message.photo[-1].file_id
+
+    await message.answer(
+        "Фото получено. Теперь отправьте видео с паспортом.",
+        reply_markup=back_kb(),
+    )
+    await set_state(
+        tg_id,
+        "company_verification_video",
+        company_id=company_id,
+        passport_photo_file_id=photo_file_id,
+    )
+
 
-        reviews = get_reviews_for_master(master["id"])
-        rating_info = get_master_rating(master["id"])
-        text = format_master_public_profile(master, reviews, rating_info)
-        pop_state(tg_id)
-        await message.answer(text, reply_markup=ReplyKeyboardRemove())
+# === Верификация компании: видео с паспортом ===
+@state_action("company_verification_video")
+async def state_company_verification_video(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    if message.photo and not (message.video or message.video_note):
+        await message.answer("Нужно видео. Фото уже получено.")
+        return
+    if not (message.video or message.video_note):
+        await message.answer("Пожалуйста, отправьте видео с паспортом.")
         return
 
-    if action == "company_check_master_enter_id":
-        public_id = message.text.strip().upper()
-        is_valid, error_msg = validate_public_id(public_id)
+    company_id = state.data["company_id"]
+    photo_file_id = state.data["passport_photo_file_id"]
+    video = message.video or message.video_note
+    video_file_id = video.file_id
+
+    await create_company_verification(
+        company_id=company_id,
+        passport_photo_file_id=photo_file_id,
+        passport_video_file_id=video_file_id,
+    )
+    await pop_state(tg_id)
+    await message.answer(
+        "Верификация отправлена ✅\n"
+        "Видео хранится до принятия решения и затем удаляется.",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    counters = await get_company_menu_counters(company_id)
+    await message.answer("Меню компании:", reply_markup=company_menu_kb(counters))
+
+
+# === Компания редактирует название ===
+@state_action("company_edit_name")
+async def state_company_edit_name(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    new_name = message.text.strip()
+    if new_name != "-":
+        is_valid, error_msg = validate_company_name(new_name)
         if not is_valid:
             await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
             return
-        
-        company = get_company_by_user(tg_id)
-        if not company:
-            await message.answer("Вы ещё не зарегистрированы как компания.")
-            pop_state(tg_id)
-            return
 
-        msg = ensure_company_can_act(company, require_subscription=False)
-        if msg:
-            await message.answer(msg)
-            pop_state(tg_id)
-            return
+    company_id = state.data["company_id"]
+    if not company or company["id"] != company_id:
+        await message.answer("Ошибка контекста компании. Попробуйте начать заново.")
+        await pop_state(tg_id)
+        return
+
+    final_name = state.data["name"] if new_name == "-" else new_name
+    await update_company_name(company_id, final_name)
+
+    await pop_state(tg_id)
+    updated_company = await get_company_by_id(company_id)
+    await message.answer(
+        "Название компании обновлено.",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    counters = await get_company_menu_counters(company_id)
+    await message.answer(
+        format_company_profile(updated_company),
+        reply_markup=company_menu_kb(counters),
+    )
 
-        master = get_master_by_public_id(public_id)
-        if not master:
-            await message.answer("Исполнитель с таким ID не найден.")
-            pop_state(tg_id)
-            return
 
-        reviews = get_reviews_for_master(master["id"])
-        rating_info = get_master_rating(master["id"])
-        text = format_master_public_profile(master, reviews, rating_info)
-        pop_state(tg_id)
-        await message.answer(text, reply_markup=ReplyKeyboardRemove())
+# === Регистрация обычного пользователя (телефон) ===
+@state_action("viewer_enter_phone")
+async def state_viewer_enter_phone(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    phone = message.text.strip()
+    is_valid, error_msg = validate_phone(phone)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
         return
 
-    # === Компания пишет отзыв по сотруднику ===
-    if action == "company_review_rating":
-        rating_raw = message.text.strip()
-        if rating_raw not in {"1", "2", "3", "4", "5"}:
-            await message.answer("Используйте кнопки с оценкой от 1 до 5.")
-            return
-        rating_value = int(rating_raw)
+    await set_user_phone(tg_id, phone)
+    await pop_state(tg_id)
+    await message.answer(
+        "Телефон сохранён. Теперь вы можете проверять исполнителей по ID.",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    await message.answer("Меню:", reply_markup=viewer_menu_kb())
+
+
+# === Проверка исполнителя по ID (для зрителя / компании) ===
+@state_action("viewer_check_master_enter_id")
+async def state_viewer_check_master_enter_id(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    public_id = message.text.strip().upper()
+    is_valid, error_msg = validate_public_id(public_id)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
+        return
+
+    text = await render_master_public_profile(public_id)
+    if text is None:
+        await message.answer("Исполнитель с таким ID не найден.")
+        await pop_state(tg_id)
+        return
+
+    await pop_state(tg_id)
+    await message.answer(text, reply_markup=ReplyKeyboardRemove())
+
+
+@state_action("company_check_master_enter_id")
+async def state_company_check_master_enter_id(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    public_id = message.text.strip().upper()
+    is_valid, error_msg = validate_public_id(public_id)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
+        return
+
+    if not company:
+        await message.answer("Вы ещё не зарегистрированы как компания.")
+        await pop_state(tg_id)
+        return
+
+    msg = ensure_company_can_act(company, require_subscription=False)
+    if msg:
+        await message.answer(msg)
+        await pop_state(tg_id)
+        return
+
+    text = await render_master_public_profile(public_id)
+    if text is None:
+        await message.answer("Исполнитель с таким ID не найден.")
+        await pop_state(tg_id)
+        return
+
+    await pop_state(tg_id)
+    await message.answer(text, reply_markup=ReplyKeyboardRemove())
+
+
+# === Компания пишет отзыв по сотруднику ===
+@state_action("company_review_rating")
+async def state_company_review_rating(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    rating_raw = message.text.strip()
+    if rating_raw not in {"1", "2", "3", "4", "5"}:
+        await message.answer("Используйте кнопки с оценкой от 1 до 5.")
+        return
+    rating_value = int(rating_raw)
+
+    await message.answer(
+        "Напишите, пожалуйста, ваш отзыв по этому исполнителю.\n"
+        "Укажите, как проходило сотрудничество, были ли проблемы, порекомендовали бы вы его другим.",
+        reply_markup=back_kb(),
+    )
+    await set_state(
+        tg_id,
+        "company_review_text",
+        employment_id=state.data["employment_id"],
+        master_id=state.data["master_id"],
+        company_id=state.data["company_id"],
+        rating=rating_value,
+    )
+
+
+@state_action("company_request_reject_reason")
+async def state_company_request_reject_reason(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    reason = message.text.strip()
+    if not reason:
+        await message.answer("Причина отказа не может быть пустой. Укажите текст:")
+        return
+    company_id = state.data["company_id"]
+    employment_id = state.data["employment_id"]
+
+    if not company or company["id"] != company_id:
+        await message.answer("Ошибка контекста компании. Попробуйте начать заново.")
+        await pop_state(tg_id)
+        return
+
+    employment = await get_employment_by_id(employment_id)
+    if not employment or employment["company_id"] != company_id:
+        await message.answer("Запрос не найден.")
+        await pop_state(tg_id)
+        return
+
+    await set_employment_rejected(employment_id)
+    await pop_state(tg_id)
+    await message.answer("Запрос отклонён. Исполнителю отправлено сообщение.", reply_markup=ReplyKeyboardRemove())
+
+    master = await get_master_by_id(employment["master_id"])
+    if master:
+        notifier.enqueue(
+            master["tg_id"],
+            f"Компания {company['name']} отклонила ваш запрос на сотрудничество.\n"
+            f"Причина: {reason}",
+            failure_log=("Не удалось отправить уведомление мастеру о несоответствии паспорта",),
+        )
+
+
+@state_action("company_review_prompt_after_leave")
+async def state_company_review_prompt_after_leave(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    answer = message.text.strip().lower()
+    company_id = state.data["company_id"]
+    master_id = state.data["master_id"]
+    employment_id = state.data["employment_id"]
+
+    if answer not in ("да", "нет", "yes", "no", "y", "n"):
+        await message.answer("Ответьте «Да» или «Нет». Хотите оставить отзыв?")
+        return
 
+    if answer in ("да", "yes", "y"):
         await message.answer(
-            "Напишите, пожалуйста, ваш отзыв по этому исполнителю.\n"
-            "Укажите, как проходило сотрудничество, были ли проблемы, порекомендовали бы вы его другим.",
-            reply_markup=back_kb(),
+            "Выберите оценку исполнителю (1 — плохо, 5 — отлично):",
+            reply_markup=rating_choice_kb(),
         )
-        set_state(
+        await set_state(
             tg_id,
-            "company_review_text",
-            employment_id=state.data["employment_id"],
-            master_id=state.data["master_id"],
-            company_id=state.data["company_id"],
-            rating=rating_value,
+            "company_review_rating",
+            employment_id=employment_id,
+            master_id=master_id,
+            company_id=company_id,
         )
+    else:
+        await pop_state(tg_id)
+        await message.answer("Хорошо, отзыв можно будет оставить позже в разделе «Уволенные сотрудники».")
+
+
+@state_action("company_review_text")
+async def state_company_review_text(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    text_body = message.text.strip() if message.text else ""
+
+    # Валидация текста отзыва
+    is_valid, error_msg = validate_review_text(text_body)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
         return
 
-    if action == "company_request_reject_reason":
-        reason = message.text.strip()
-        if not reason:
-            await message.answer("Причина отказа не может быть пустой. Укажите текст:")
-            return
-        company_id = state.data["company_id"]
-        employment_id = state.data["employment_id"]
+    company_id = state.data["company_id"]
+    master_id = state.data["master_id"]
+    employment_id = state.data["employment_id"]
+    rating_value = state.data.get("rating")
 
-        company = get_company_by_user(tg_id)
-        if not company or company["id"] != company_id:
-            await message.answer("Ошибка контекста компании. Попробуйте начать заново.")
-            pop_state(tg_id)
-            return
+    if not company or company["id"] != company_id:
+        await message.answer("Ошибка контекста компании. Попробуйте начать заново.")
+        await pop_state(tg_id)
+        return
 
-        employment = get_employment_by_id(employment_id)
-        if not employment or employment["company_id"] != company_id:
-            await message.answer("Запрос не найден.")
-            pop_state(tg_id)
-            return
+    msg = ensure_company_can_act(company)
+    if msg:
+        await message.answer(msg)
+        await pop_state(tg_id)
+        return
 
-        set_employment_rejected(employment_id)
-        pop_state(tg_id)
-        await message.answer("Запрос отклонён. Исполнителю отправлено сообщение.", reply_markup=ReplyKeyboardRemove())
+    review_id = await create_review(
+        company_id=company_id,
+        master_id=master_id,
+        employment_id=employment_id,
+        text=text_body,
+        rating=rating_value,
+    )
+    await pop_state(tg_id)
+    await message.answer("Отзыв сохранён ✅", reply_markup=ReplyKeyboardRemove())
 
-        master = get_master_by_id(employment["master_id"])
-        if master:
-            try:
-                await bot.send_message(
-                    master["tg_id"],
-                    f"Компания {company['name']} отклонила ваш запрос на сотрудничество.\n"
-                    f"Причина: {reason}",
-                )
-            except Exception:
-                logger.exception("Не удалось отправить уведомление мастеру о несоответствии паспорта")
-        return
-
-    if action == "company_review_prompt_after_leave":
-        answer = message.text.strip().lower()
-        company_id = state.data["company_id"]
-        master_id = state.data["master_id"]
-        employment_id = state.data["employment_id"]
-
-        if answer not in ("да", "нет", "yes", "no", "y", "n"):
-            await message.answer("Ответьте «Да» или «Нет». Хотите оставить отзыв?")
-            return
+    master = await get_master_by_id(master_id)
+    if master:
+        snippet = text_body[:200]
+        rating_text = f"Оценка: {rating_value:g}" if rating_value is not None else ""
+        notifier.enqueue(
+            master["tg_id"],
+            (
+                f"Компания {company['name']} оставила по вам отзыв.\n"
+                f"{rating_text}\n\n"
+                f"{snippet}{'...' if len(text_body) > 200 else ''}"
+            ).strip(),
+            reply_markup=master_open_review_kb(review_id),
+            failure_log=(
+                "Не удалось уведомить мастера %s о новом отзыве",
+                master_id,
+            ),
+        )
 
-        if answer in ("да", "yes", "y"):
-            await message.answer(
-                "Выберите оценку исполнителю (1 — плохо, 5 — отлично):",
-                reply_markup=rating_choice_kb(),
-            )
-            set_state(
-                tg_id,
-                "company_review_rating",
-                employment_id=employment_id,
-                master_id=master_id,
-                company_id=company_id,
-            )
-        else:
-            pop_state(tg_id)
-            await message.answer("Хорошо, отзыв можно будет оставить позже в разделе «Уволенные сотрудники».")
+
+# === Мастер обосновывает жалобу (СТАДИЯ 1: описание) ===
+@state_action("master_appeal_reason")
+async def state_master_appeal_reason(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    # Получаем только текст
+    reason = message.text.strip() if message.text else ""
+
+    # Проверка на видео
+    if message.video or message.video_note:
+        await message.answer(
+            "❌ Видео не поддерживаются. Пожалуйста, отправьте только текст."
+        )
         return
 
-    if action == "company_review_text":
-        text_body = message.text.strip() if message.text else ""
-        
-        # Валидация текста отзыва
-        is_valid, error_msg = validate_review_text(text_body)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
-        
-        company_id = state.data["company_id"]
-        master_id = state.data["master_id"]
-        employment_id = state.data["employment_id"]
-        rating_value = state.data.get("rating")
-
-        company = get_company_by_user(tg_id)
-        if not company or company["id"] != company_id:
-            await message.answer("Ошибка контекста компании. Попробуйте начать заново.")
-            pop_state(tg_id)
-            return
+    # Если есть фото на первой стадии - просим только текст
+    if message.photo:
+        await message.answer(
+            "Пожалуйста, сначала опишите причину жалобы текстом. "
+            "Фото можно будет приложить на следующем шаге."
+        )
+        return
 
-        msg = ensure_company_can_act(company)
-        if msg:
-            await message.answer(msg)
-            pop_state(tg_id)
-            return
+    # Валидация причины жалобы
+    is_valid, error_msg = validate_appeal_reason(reason)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
+        return
 
-        review_id = create_review(
-            company_id=company_id,
-            master_id=master_id,
-            employment_id=employment_id,
-            text=text_body,
-            rating=rating_value,
+    review_id = state.data["review_id"]
+
+    review = await get_review_by_id(review_id)
+
+    if not master or not review:
+        await message.answer("Не удалось найти данные по отзыву. Попробуйте позже.")
+        await pop_state(tg_id)
+        return
+
+    if not await can_master_appeal_review(review, master["id"]):
+        await message.answer(
+            "Сейчас нельзя подать жалобу по этому отзыву.\n"
+            "Возможно, прошло более 14 дней, уже есть активная жалоба или превышен лимит попыток."
         )
-        pop_state(tg_id)
-        await message.answer("Отзыв сохранён ✅", reply_markup=ReplyKeyboardRemove())
+        await pop_state(tg_id)
+        return
 
-        master = get_master_by_id(master_id)
-        if master:
-            snippet = text_body[:200]
-            rating_text = f"Оценка: {rating_value:g}" if rating_value is not None else ""
-            try:
-                await bot.send_message(
-                    master["tg_id"],
-                    (
-                        f"Компания {company['name']} оставила по вам отзыв.\n"
-                        f"{rating_text}\n\n"
-                        f"{snippet}{'...' if len(text_body) > 200 else ''}"
-                    ).strip(),
-                    reply_markup=master_open_review_kb(review_id),
-                )
-            except Exception:
-                logger.exception("Не удалось уведомить мастера %s о новом отзыве", master_id)
-        return
-
-    # === Мастер обосновывает жалобу (СТАДИЯ 1: описание) ===
-    if action == "master_appeal_reason":
-        # Получаем только текст
-        reason = message.text.strip() if message.text else ""
-        
-        # Проверка на видео
-        if message.video or message.video_note:
-            await message.answer(
-                "❌ Видео не поддерживаются. Пожалуйста, отправьте только текст."
-            )
-            return
-        
-        # Если есть фото на первой стадии - просим только текст
-        if message.photo:
-            await message.answer(
-                "Пожалуйста, сначала опишите причину жалобы текстом. "
-                "Фото можно будет приложить на следующем шаге."
-            )
-            return
-        
-        # Валидация причины жалобы
-        is_valid, error_msg = validate_appeal_reason(reason)
-        if not is_valid:
-            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-            return
-        
-        review_id = state.data["review_id"]
+    existing_appeal = await get_active_appeal_for_review_and_master(review_id, master["id"])
+    if existing_appeal:
+        await message.answer(
+            "У вас уже есть активная жалоба по этому отзыву.\n"
+            "Дождитесь решения по существующей жалобе."
+        )
+        await pop_state(tg_id)
+        return
+
+    # Сохраняем описание и переходим к стадии доказательств
+    await set_state(
+        tg_id,
+        "master_appeal_proof",
+        review_id=review_id,
+        reason=reason,
+        photo_message_ids=[],
+    )
 
-        master = get_master_by_user(tg_id)
-        review = get_review_by_id(review_id)
+    await message.answer(
+        "Описание сохранено.\n\n"
+        "Теперь вы можете приложить до 5 фото в качестве доказательств "
+        "(можно отправлять по одному) или нажмите «Пропустить», если доказательств нет.",
+        reply_markup=master_appeal_proof_kb(),
+    )
 
-        if not master or not review:
-            await message.answer("Не удалось найти данные по отзыву. Попробуйте позже.")
-            pop_state(tg_id)
-            return
 
-        if not can_master_appeal_review(review, master["id"]):
-            await message.answer(
-                "Сейчас нельзя подать жалобу по этому отзыву.\n"
-                "Возможно, прошло более 14 дней, уже есть активная жалоба или превышен лимит попыток."
-            )
-            pop_state(tg_id)
-            return
+# === Мастер прикладывает доказательства (СТАДИЯ 2: фото) ===
+@state_action("master_appeal_proof")
+async def state_master_appeal_proof(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    review_id = state.data["review_id"]
+    reason = state.data["reason"]
+
+    review = await get_review_by_id(review_id)
 
-        existing_appeal = get_active_appeal_for_review_and_master(review_id, master["id"])
-        if existing_appeal:
+    if not master or not review:
+        await message.answer("Не удалось найти данные по отзыву. Попробуйте позже.")
+        await pop_state(tg_id)
+        return
+
+    # Если пришёл текст вместо фото - напоминаем
+    if message.text and not message.photo:
+        await message.answer(
+            "На этом этапе нужно отправить фото (до 5 штук) в качестве доказательств "
+            "или нажмите кнопку «Пропустить», если доказательств нет.",
+            reply_markup=master_appeal_proof_kb(),
+        )
+        return
+
+    # Проверка на видео
+    if message.video or message.video_note:
+        await message.answer(
+            "❌ Видео не поддерживаются. Пожалуйста, отправьте только фото (до 5 штук) или нажмите «Пропустить».",
+            reply_markup=master_appeal_proof_kb(),
+        )
+        return
+
+    # Проверка количества фото
+    if message.photo:
+        photo_message_ids = state.data.get("photo_message_ids") or []
+        if len(photo_message_ids) >= 5:
             await message.answer(
-                "У вас уже есть активная жалоба по этому отзыву.\n"
-                "Дождитесь решения по существующей жалобе."
+                "❌ Можно отправить максимум 5 фото. Нажмите «Готово» или «Пропустить».",
+                reply_markup=master_appeal_proof_kb(),
             )
-            pop_state(tg_id)
             return
+    else:
+        # Если нет фото - напоминаем
+        await message.answer(
+            "Пожалуйста, отправьте фото (до 5 штук) в качестве доказательств "
+            "или нажмите кнопку «Пропустить», если доказательств нет.",
+            reply_markup=master_appeal_proof_kb(),
+        )
+        return
 
-        # Сохраняем описание и переходим к стадии доказательств
-        set_state(
+    photo_message_ids = state.data.get("photo_message_ids") or []
+    photo_message_ids.append(message.message_id)
+
+    if len(photo_message_ids) < 5:
+        await set_state(
             tg_id,
             "master_appeal_proof",
             review_id=review_id,
             reason=reason,
-            photo_message_ids=[],
+            photo_message_ids=photo_message_ids,
+            photo_chat_id=message.chat.id,
         )
-        
         await message.answer(
-            "Описание сохранено.\n\n"
-            "Теперь вы можете приложить до 5 фото в качестве доказательств "
-            "(можно отправлять по одному) или нажмите «Пропустить», если доказательств нет.",
+            "Фото получено. Можете отправить ещё или нажмите «Готово».",
             reply_markup=master_appeal_proof_kb(),
         )
         return
 
-    # === Мастер прикладывает доказательства (СТАДИЯ 2: фото) ===
-    if action == "master_appeal_proof":
-        review_id = state.data["review_id"]
-        reason = state.data["reason"]
+    await submit_master_appeal(
+        reply_message=message,
+        tg_id=tg_id,
+        review_id=review_id,
+        reason=reason,
+        master=master,
+        review=review,
+        photo_message_ids=photo_message_ids,
+        photo_chat_id=message.chat.id,
+    )
 
-        master = get_master_by_user(tg_id)
-        review = get_review_by_id(review_id)
 
-        if not master or not review:
-            await message.answer("Не удалось найти данные по отзыву. Попробуйте позже.")
-            pop_state(tg_id)
-            return
+# === Компания отвечает на жалобу, присылая комментарий и файлы ===
+@state_action("company_appeal_respond")
+async def state_company_appeal_respond(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    appeal_id = state.data["appeal_id"]
+    company_tg_chat_id = state.data["company_tg_chat_id"]
 
-        # Если пришёл текст вместо фото - напоминаем
-        if message.text and not message.photo:
-            await message.answer(
-                "На этом этапе нужно отправить фото (до 5 штук) в качестве доказательств "
-                "или нажмите кнопку «Пропустить», если доказательств нет.",
-                reply_markup=master_appeal_proof_kb(),
-            )
-            return
+    appeal = await get_review_appeal_by_id(appeal_id)
+    if not appeal:
+        await message.answer("Жалоба не найдена, попробуйте позже.")
+        await pop_state(tg_id)
+        return
 
-        # Проверка на видео
-        if message.video or message.video_note:
-            await message.answer(
-                "❌ Видео не поддерживаются. Пожалуйста, отправьте только фото (до 5 штук) или нажмите «Пропустить».",
-                reply_markup=master_appeal_proof_kb(),
-            )
-            return
-        
-        # Проверка количества фото
-        if message.photo:
-            photo_message_ids = state.data.get("photo_message_ids") or []
-            if len(photo_message_ids) >= 5:
-                await message.answer(
-                    "❌ Можно отправить максимум 5 фото. Нажмите «Готово» или «Пропустить».",
-                    reply_markup=master_appeal_proof_kb(),
-                )
-                return
-        else:
-            # Если нет фото - напоминаем
-            await message.answer(
-                "Пожалуйста, отправьте фото (до 5 штук) в качестве доказательств "
-                "или нажмите кнопку «Пропустить», если доказательств нет.",
-                reply_markup=master_appeal_proof_kb(),
-            )
-            return
+    company_comment = message.caption or message.text or "Комментарий не указан."
+    files_message_id = message.message_id if message.content_type != "text" else None
 
-        photo_message_ids = state.data.get("photo_message_ids") or []
-        photo_message_ids.append(message.message_id)
-
-        if len(photo_message_ids) < 5:
-            set_state(
-                tg_id,
-                "master_appeal_proof",
-                review_id=review_id,
-                reason=reason,
-                photo_message_ids=photo_message_ids,
-                photo_chat_id=message.chat.id,
+    await update_review_appeal_company_response(
+        appeal_id,
+        comment=company_comment,
+        files_message_id=files_message_id,
+    )
+    await pop_state(tg_id)
+
+    appeal = await get_review_appeal_by_id(appeal_id)
+    if appeal:
+        master = await get_master_by_id(appeal["master_id"])
+        if master:
+            meta = (
+                f"Компания ответила по жалобе #{appeal_id}:\n\n"
+                f"Комментарий компании:\n{company_comment}\n\n"
+                "Материалы доступны в админ панели для рассмотрения."
             )
-            await message.answer(
-                "Фото получено. Можете отправить ещё или нажмите «Готово».",
-                reply_markup=master_appeal_proof_kb(),
+            notifier.enqueue(
+                master["tg_id"],
+                meta,
+                failure_log=(
+                    "Не удалось уведомить мастера %s о жалобе %s",
+                    master["id"],
+                    appeal_id,
+                ),
             )
-            return
+            # Фото больше не отправляются в Telegram - они доступны в админ панели
+            # if files_message_id:
+            #     await bot.copy_message(
+            #         master["tg_id"],
+            #         from_chat_id=company_tg_chat_id,
+            #         message_id=files_message_id,
+            #     )
 
-        await submit_master_appeal(
-            reply_message=message,
-            tg_id=tg_id,
-            review_id=review_id,
-            reason=reason,
-            master=master,
-            review=review,
-            photo_message_ids=photo_message_ids,
-            photo_chat_id=message.chat.id,
-        )
+    await message.answer(
+        "Ваш комментарий и материалы отправлены исполнителю.",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+
+
+# === Компания отправляет чек об оплате подписки ===
+# ВНИМАНИЕ: Подписка активируется автоматически при получении сообщения.
+# В продакшене рекомендуется добавить проверку чека администратором
+# или интеграцию с платёжной системой для автоматической верификации.
+@state_action("company_send_payment_proof")
+async def state_company_send_payment_proof(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    company_id = state.data["company_id"]
+    months = state.data["months"]
+
+    company = await get_company_by_id(company_id)
+    if not company or company["tg_id"] != tg_id:
+        await message.answer("Контекст компании потерян, попробуйте оформить подписку заново.")
+        await pop_state(tg_id)
         return
 
-    # === Компания отвечает на жалобу, присылая комментарий и файлы ===
-    if action == "company_appeal_respond":
-        appeal_id = state.data["appeal_id"]
-        company_tg_chat_id = state.data["company_tg_chat_id"]
+    # TODO: Добавить проверку чека об оплате перед активацией подписки
+    # В текущей реализации подписка активируется автоматически
+    await set_company_subscription(company_id, months)
+    await pop_state(tg_id)
 
-        appeal = get_review_appeal_by_id(appeal_id)
-        if not appeal:
-            await message.answer("Жалоба не найдена, попробуйте позже.")
-            pop_state(tg_id)
-            return
+    updated_company = await get_company_by_id(company_id)
+    await message.answer(
+        "Спасибо! Ваш чек получен. Подписка будет активирована после проверки администратором.\n\n"
+        "Вы получите уведомление, когда подписка будет активирована.\n\n"
+        f"{format_company_profile(updated_company) if updated_company else ''}",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    # TODO: Отправить уведомление администратору о новом чеке для проверки
+    logger.info(
+        "Компания %s (ID: %s) отправила чек на подписку %s месяцев. Требуется проверка.",
+        company["name"],
+        company_id,
+        months,
+    )
 
-        company_comment = message.caption or message.text or "Комментарий не указан."
-        files_message_id = message.message_id if message.content_type != "text" else None
-
-        update_review_appeal_company_response(
-            appeal_id,
-            comment=company_comment,
-            files_message_id=files_message_id,
-        )
-        pop_state(tg_id)
-
-        appeal = get_review_appeal_by_id(appeal_id)
-        if appeal:
-            master = get_master_by_id(appeal["master_id"])
-            if master:
-                meta = (
-                    f"Компания ответила по жалобе #{appeal_id}:\n\n"
-                    f"Комментарий компании:\n{company_comment}\n\n"
-                    "Материалы доступны в админ панели для рассмотрения."
-                )
-                try:
-                    await bot.send_message(master["tg_id"], meta)
-                    # Фото больше не отправляются в Telegram - они доступны в админ панели
-                    # if files_message_id:
-                    #     await bot.copy_message(
-                    #         master["tg_id"],
-                    #         from_chat_id=company_tg_chat_id,
-                    #         message_id=files_message_id,
-                    #     )
-                except Exception:
-                    logger.exception(
-                        "Не удалось уведомить мастера %s о жалобе %s",
-                        master["id"],
-                        appeal_id,
-                    )
 
-        await message.answer(
-            "Ваш комментарий и материалы отправлены исполнителю.",
-            reply_markup=ReplyKeyboardRemove(),
-        )
+# === Компания меняет паспорт исполнителя ===
+@state_action("company_change_passport_enter")
+async def state_company_change_passport_enter(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    new_passport = message.text.strip()
+    is_valid, error_msg = validate_passport(new_passport)
+    if not is_valid:
+        await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
         return
 
-    # === Компания отправляет чек об оплате подписки ===
-    # ВНИМАНИЕ: Подписка активируется автоматически при получении сообщения.
-    # В продакшене рекомендуется добавить проверку чека администратором
-    # или интеграцию с платёжной системой для автоматической верификации.
-    if action == "company_send_payment_proof":
-        company_id = state.data["company_id"]
-        months = state.data["months"]
+    master_id = state.data["master_id"]
 
-        company = get_company_by_id(company_id)
-        if not company or company["tg_id"] != tg_id:
-            await message.answer("Контекст компании потерян, попробуйте оформить подписку заново.")
-            pop_state(tg_id)
-            return
+    if not company:
+        await message.answer("Вы больше не зарегистрированы как компания.")
+        await pop_state(tg_id)
+        return
 
-        # TODO: Добавить проверку чека об оплате перед активацией подписки
-        # В текущей реализации подписка активируется автоматически
-        set_company_subscription(company_id, months)
-        pop_state(tg_id)
+    msg = ensure_company_can_act(company)
+    if msg:
+        await message.answer(msg)
+        await pop_state(tg_id)
+        return
 
-        updated_company = get_company_by_id(company_id)
-        await message.answer(
-            "Спасибо! Ваш чек получен. Подписка будет активирована после проверки администратором.\n\n"
-            "Вы получите уведомление, когда подписка будет активирована.\n\n"
-            f"{format_company_profile(updated_company) if updated_company else ''}",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-        # TODO: Отправить уведомление администратору о новом чеке для проверки
-        logger.info(
-            "Компания %s (ID: %s) отправила чек на подписку %s месяцев. Требуется проверка.",
-            company["name"],
-            company_id,
-            months,
+    await update_master_profile(
+        master_id,
+        passport=new_passport,
+        passport_locked=True,
+    )
+
+    await pop_state(tg_id)
+
+    master = await get_master_by_id(master_id)
+    if master:
+        notifier.enqueue(
+            master["tg_id"],
+            f"Компания {company['name']} обновила ваши паспортные данные в системе.",
+            failure_log=("Не удалось уведомить мастера об изменении паспорта компанией",),
         )
-        return
 
-    # === Компания меняет паспорт исполнителя ===
-    if action == "company_change_passport_enter":
-        new_passport = message.text.strip()
-        is_valid, error_msg = validate_passport(new_passport)
+    await message.answer(
+        "Паспортные данные исполнителя обновлены и залочены для изменения со стороны мастера.",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+
+
+# === Мастер редактирует профиль (ФИО / телефон / паспорт) ===
+@state_action("master_edit_full_name")
+async def state_master_edit_full_name(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    master_id = state.data["master_id"]
+    new_full_name = message.text.strip()
+    if new_full_name != "-":
+        is_valid, error_msg = validate_full_name(new_full_name)
         if not is_valid:
             await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
             return
-        
-        master_id = state.data["master_id"]
+        state.data["full_name"] = new_full_name
 
-        company = get_company_by_user(tg_id)
-        if not company:
-            await message.answer("Вы больше не зарегистрированы как компания.")
-            pop_state(tg_id)
-            return
+    await message.answer(
+        "Введите новый номер телефона (или '-' чтобы оставить без изменений):",
+        reply_markup=back_kb(),
+    )
+    await set_state(
+        tg_id,
+        "master_edit_phone",
+        **state.data,
+    )
 
-        msg = ensure_company_can_act(company)
-        if msg:
-            await message.answer(msg)
-            pop_state(tg_id)
+
+@state_action("master_edit_phone")
+async def state_master_edit_phone(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    master_id = state.data["master_id"]
+    new_phone = message.text.strip()
+    if new_phone != "-":
+        is_valid, error_msg = validate_phone(new_phone)
+        if not is_valid:
+            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
             return
+        state.data["phone"] = new_phone
 
-        update_master_profile(
+    passport_locked = bool(state.data.get("passport_locked"))
+    if passport_locked:
+        await update_master_profile(
             master_id,
-            passport=new_passport,
-            passport_locked=True,
+            full_name=state.data["full_name"],
+            phone=state.data["phone"],
         )
-
-        pop_state(tg_id)
-
-        master = get_master_by_id(master_id)
-        if master:
-            try:
-                await bot.send_message(
-                    master["tg_id"],
-                    f"Компания {company['name']} обновила ваши паспортные данные в системе."
-                )
-            except Exception:
-                logger.exception("Не удалось уведомить мастера об изменении паспорта компанией")
-
+        await pop_state(tg_id)
+        master = await get_master_by_id(master_id, include_passport=True)
         await message.answer(
-            "Паспортные данные исполнителя обновлены и залочены для изменения со стороны мастера.",
+            "Профиль обновлён (паспорт изменить может только компания).",
             reply_markup=ReplyKeyboardRemove(),
         )
+        rating = await get_master_rating(master_id)
+        await message.answer(format_master_profile(master, rating))
         return
-
-    # === Мастер редактирует профиль (ФИО / телефон / паспорт) ===
-    if action == "master_edit_full_name":
-        master_id = state.data["master_id"]
-        new_full_name = message.text.strip()
-        if new_full_name != "-":
-            is_valid, error_msg = validate_full_name(new_full_name)
-            if not is_valid:
-                await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-                return
-            state.data["full_name"] = new_full_name
-
+    else:
         await message.answer(
-            "Введите новый номер телефона (или '-' чтобы оставить без изменений):",
+            "Введите новые паспортные данные (или '-' чтобы оставить без изменений):",
             reply_markup=back_kb(),
         )
-        set_state(
+        await set_state(
             tg_id,
-            "master_edit_phone",
+            "master_edit_passport",
             **state.data,
         )
         return
 
-    if action == "master_edit_phone":
-        master_id = state.data["master_id"]
-        new_phone = message.text.strip()
-        if new_phone != "-":
-            is_valid, error_msg = validate_phone(new_phone)
-            if not is_valid:
-                await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-                return
-            state.data["phone"] = new_phone
 
-        passport_locked = bool(state.data.get("passport_locked"))
-        if passport_locked:
-            update_master_profile(
-                master_id,
-                full_name=state.data["full_name"],
-                phone=state.data["phone"],
-            )
-            pop_state(tg_id)
-            master = get_master_by_id(master_id)
-            await message.answer(
-                "Профиль обновлён (паспорт изменить может только компания).",
-                reply_markup=ReplyKeyboardRemove(),
-            )
-            rating = get_master_rating(master_id)
-            await message.answer(format_master_profile(master, rating))
-            return
-        else:
-            await message.answer(
-                "Введите новые паспортные данные (или '-' чтобы оставить без изменений):",
-                reply_markup=back_kb(),
-            )
-            set_state(
-                tg_id,
-                "master_edit_passport",
-                **state.data,
-            )
+@state_action("master_edit_passport")
+async def state_master_edit_passport(
+    message: Message,
+    state: PendingState,
+    master: Optional[dict] = None,
+    company: Optional[dict] = None,
+):
+    tg_id = message.from_user.id
+    master_id = state.data["master_id"]
+    new_passport = message.text.strip()
+    if new_passport != "-":
+        is_valid, error_msg = validate_passport(new_passport)
+        if not is_valid:
+            await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
             return
+        state.data["passport"] = new_passport
 
-    if action == "master_edit_passport":
-        master_id = state.data["master_id"]
-        new_passport = message.text.strip()
-        if new_passport != "-":
-            is_valid, error_msg = validate_passport(new_passport)
-            if not is_valid:
-                await message.answer(f"❌ {error_msg}\n\nПопробуйте ещё раз:")
-                return
-            state.data["passport"] = new_passport
-
-        update_master_profile(
-            master_id,
-            full_name=state.data["full_name"],
-            phone=state.data["phone"],
-            passport=state.data["passport"],
-        )
+    # Если паспорт не вводили, update_master_profile его не трогает
+    await update_master_profile(
+        master_id,
+        full_name=state.data["full_name"],
+        phone=state.data["phone"],
+        passport=state.data.get("passport"),
+    )
 
-        pop_state(tg_id)
-        master = get_master_by_id(master_id)
-        await message.answer("Профиль обновлён.", reply_markup=ReplyKeyboardRemove())
-        rating = get_master_rating(master_id)
-        await message.answer(format_master_profile(master, rating))
-        return
+    await pop_state(tg_id)
+    master = await get_master_by_id(master_id, include_passport=True)
+    await message.answer("Профиль обновлён.", reply_markup=ReplyKeyboardRemove())
+    rating = await get_master_rating(master_id)
+    await message.answer(format_master_profile(master, rating))
 
-    # Если дошли до сюда — что-то не учли
-    await message.answer(
-        "Похоже, я не понял, что вы хотели сделать.\n"
-        "Попробуйте воспользоваться командами /start или /role."
-    )
 
 
 # ==========================
@@ -3041,65 +3261,282 @@ async def generic_message_handler(message: Message):
 # ==========================
 
 
-async def maintenance_worker():
-    """Фоновая задача: регулярно выполняет обслуживание базы (увольнения, жалобы, очистка состояний)."""
-    while True:
-        try:
-            closed_employments = auto_close_leave_requests()
-            for employment in closed_employments:
-                try:
-                    await bot.send_message(
-                        employment["master_tg_id"],
-                        (
-                            "Система автоматически завершила сотрудничество по вашему запросу "
-                            "на увольнение, так как компания не ответила в течение 2 дней.\n\n"
-                            f"Компания: {employment['company_name']} ({employment['company_public_id']})"
-                        ),
-                    )
-                except Exception:
-                    logger.exception(
-                        "Не удалось уведомить мастера %s об авто-увольнении",
-                        employment["master_id"],
-                    )
-
-                try:
-                    await bot.send_message(
-                        employment["company_tg_id"],
-                        (
-                            "Система автоматически завершила сотрудничество по запросу на увольнение, "
-                            "так как вы не ответили в течение 2 дней.\n\n"
-                            f"Исполнитель: {employment['master_full_name']} "
-                            f"({employment['master_public_id']})"
-                        ),
-                    )
-                except Exception:
-                    logger.exception(
-                        "Не удалось уведомить компанию %s об авто-увольнении",
-                        employment["company_id"],
-                    )
-            await auto_review_appeals_maintenance()
-            clear_expired_states(max_age_hours=24)  # Очистка состояний старше 24 часов
-        except Exception:
-            logger.exception("Ошибка в задаче обслуживания (maintenance_worker)")
-        await asyncio.sleep(3600)
+def auto_close_notifications(employment: dict):
+    """Уведомления сторонам об авто-увольнении (пишутся в outbox вместе с закрытием)."""
+    return [
+        (
+            employment["master_tg_id"],
+            "Система автоматически завершила сотрудничество по вашему запросу "
+            "на увольнение, так как компания не ответила в течение 2 дней.\n\n"
+            f"Компания: {employment['company_name']} ({employment['company_public_id']})",
+        ),
+        (
+            employment["company_tg_id"],
+            "Система автоматически завершила сотрудничество по запросу на увольнение, "
+            "так как вы не ответили в течение 2 дней.\n\n"
+            f"Исполнитель: {employment['master_full_name']} "
+            f"({employment['master_public_id']})",
+        ),
+    ]
+
+
+# Сроки фоновых задач (см. scheduler.py)
+LEAVE_AUTO_CLOSE_AFTER = timedelta(days=2)
+APPEAL_REMINDER_AFTER = timedelta(days=3)
+APPEAL_AUTO_REMOVE_AFTER = timedelta(days=5)
+STATE_MAX_AGE = timedelta(hours=24)
+OUTBOX_PURGE_INTERVAL = timedelta(days=1)
+
+
+def _parse_utc(value: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def schedule_leave_auto_close(employment_id: int, requested_at: datetime):
+    scheduler.schedule("leave_auto_close", employment_id, requested_at + LEAVE_AUTO_CLOSE_AFTER)
+
+
+def schedule_review_appeal(appeal_id: int, created_at: datetime, reminder_sent: bool = False):
+    if not reminder_sent:
+        scheduler.schedule("review_appeals", ("reminder", appeal_id), created_at + APPEAL_REMINDER_AFTER)
+    scheduler.schedule("review_appeals", ("remove", appeal_id), created_at + APPEAL_AUTO_REMOVE_AFTER)
+
+
+async def schedule_state_expiry():
+    oldest = _parse_utc(await get_oldest_state_created_at())
+    # Новое состояние истечёт не раньше, чем через STATE_MAX_AGE от текущего момента;
+    # лишняя секунда — потому что порог очистки округляется до секунд
+    due = (oldest or datetime.utcnow()) + STATE_MAX_AGE + timedelta(seconds=1)
+    scheduler.schedule("state_expiry", None, due)
+
+
+async def job_auto_close_leave_requests(keys):
+    closed_employments = await auto_close_leave_requests(auto_close_notifications)
+    if closed_employments:
+        outbox_dispatcher.wake()
+
+
+async def job_review_appeals(keys):
+    await auto_review_appeals_maintenance()
+
+
+async def job_state_expiry(keys):
+    await clear_expired_states(max_age_hours=int(STATE_MAX_AGE.total_seconds() // 3600))
+    await schedule_state_expiry()
+
+
+async def job_purge_outbox(keys):
+    await purge_delivered_outbox(max_age_days=7)
+    # Заодно — журнал событий жалоб для админки: клиент, отставший больше
+    # чем на неделю, получает событие reset и перезагружает список
+    await purge_appeal_events(max_age_days=7)
+    scheduler.schedule("outbox_purge", None, datetime.utcnow() + OUTBOX_PURGE_INTERVAL)
+
+
+# Задачи с арендой "maintenance" при нескольких процессах выполняет один из них;
+# очистка состояний идёт в каждом процессе, потому что чистит и его кэш
+scheduler.register("leave_auto_close", job_auto_close_leave_requests, lease="maintenance")
+scheduler.register("review_appeals", job_review_appeals, lease="maintenance")
+scheduler.register("state_expiry", job_state_expiry)
+scheduler.register("outbox_purge", job_purge_outbox, lease="maintenance")
+
+
+async def seed_maintenance_schedule():
+    """Заполняет планировщик сроками из БД (при старте бота)."""
+    for row in await get_leave_request_times():
+        requested_at = _parse_utc(row["leave_requested_at"])
+        if requested_at:
+            schedule_leave_auto_close(row["id"], requested_at)
+
+    for row in await get_pending_review_appeal_times():
+        created_at = _parse_utc(row["created_at"])
+        if created_at:
+            schedule_review_appeal(row["id"], created_at, bool(row["reminder_sent_at"]))
+
+    await schedule_state_expiry()
+    scheduler.schedule("outbox_purge", None, datetime.utcnow())
+    logger.info("Запланировано сроков фоновых задач: %s", scheduler.pending)
+
+
+def build_webhook_app() -> web.Application:
+    """aiohttp-приложение, которое принимает обновления Telegram на WEBHOOK_PATH."""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=config.WEBHOOK_SECRET or None,
+    ).register(app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def register_webhook():
+    """Регистрирует вебхук в Telegram, если задан WEBHOOK_BASE_URL."""
+    if config.WEBHOOK_BASE_URL:
+        await bot.set_webhook(
+            url=config.WEBHOOK_BASE_URL + config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info("Вебхук зарегистрирован: %s", config.WEBHOOK_BASE_URL + config.WEBHOOK_PATH)
+
+
+async def serve_webhook(app: web.Application):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+    logger.info(
+        "Приём обновлений на http://%s:%s%s",
+        config.WEBHOOK_HOST,
+        config.WEBHOOK_PORT,
+        config.WEBHOOK_PATH,
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook():
+    """
+    Режим вебхука в одном процессе. Несколько копий бота за балансировщиком
+    запускать нельзя: кэш user_states и планировщик обслуживания у каждого
+    процесса свои. Для нескольких процессов — BOT_WORKERS > 1 (run_sharded),
+    там обновления раскладываются по воркерам по tg_id.
+    Вебхук регистрируется в Telegram, только если задан WEBHOOK_BASE_URL.
+    """
+    await register_webhook()
+    await serve_webhook(build_webhook_app())
+
+
+async def start_services(deliver: bool = True):
+    """
+    Пул соединений, отложенная запись состояний и фоновые задачи процесса.
+    deliver=False — воркер: уведомления и outbox обслуживает родитель (run_sharded).
+    """
+    init_pool(config.DB_POOL_SIZE)
+    if start_state_flusher(config.STATE_FLUSH_INTERVAL_SECONDS):
+        logger.info(
+            "Отложенная запись состояний: сброс раз в %s с",
+            config.STATE_FLUSH_INTERVAL_SECONDS,
+        )
+
+    logger.info("Запуск фоновых задач...")
+    if deliver:
+        notifier.start(bot)
+        outbox_dispatcher.start()
+    await seed_maintenance_schedule()
+    scheduler.start()
+
+
+async def stop_delivery():
+    await outbox_dispatcher.stop()
+    dropped = await notifier.stop()
+    if dropped:
+        logger.warning("Не отправлено уведомлений при остановке: %s", dropped)
+
+
+async def stop_services():
+    await scheduler.stop()
+    await stop_delivery()
+    shutdown_db_executor()
+    flushed = stop_state_flusher()
+    logger.info("Состояния пользователей сброшены в БД (%s изменений)", flushed)
+    closed = close_pool()
+    logger.info("Пул соединений с БД закрыт (%s соединений)", closed)
+
+
+async def run_worker(index: int, updates_queue, notifications_queue):
+    """Воркер: обрабатывает обновления своей доли пользователей (см. workers.py)."""
+    logger.info("Воркер %s из %s запущен", index, config.BOT_WORKERS)
+    notifier.forward_to(notifications_queue)
+    await start_services(deliver=False)
+    try:
+        await consume_updates(updates_queue, lambda update: dp.feed_raw_update(bot, update))
+    finally:
+        await stop_services()
+        await bot.session.close()
+
+
+def worker_process(index: int, updates_queue, notifications_queue):
+    # Ctrl+C обрабатывает родитель: он досылает воркерам сигнал остановки
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_worker(index, updates_queue, notifications_queue))
+
+
+async def run_sharded():
+    """
+    Родительский процесс: принимает обновления и раскладывает их по
+    BOT_WORKERS воркерам по tg_id, отправляет уведомления всех воркеров
+    и сообщения outbox, перезапускает упавшие воркеры.
+    """
+    router = ShardRouter(config.BOT_WORKERS)
+    router.start(worker_process)
+    # Отправка только здесь: лимиты NOTIFY_* действуют на весь бот, а не на каждый воркер
+    init_pool(config.DB_POOL_SIZE)
+    notifier.start(bot)
+    outbox_dispatcher.start()
+    relay = asyncio.create_task(consume_notifications(router.notifications, notifier.enqueue))
+    supervisor = asyncio.create_task(router.supervise())
+    try:
+        if config.BOT_MODE == "webhook":
+            await register_webhook()
+            await serve_webhook(
+                build_router_app(router.route, config.WEBHOOK_PATH, config.WEBHOOK_SECRET)
+            )
+        else:
+            await poll_updates(bot, router.route, dp.resolve_used_update_types())
+    finally:
+        supervisor.cancel()
+        await asyncio.gather(supervisor, return_exceptions=True)
+        await asyncio.get_running_loop().run_in_executor(None, router.stop)
+        # router.stop закрывает очередь уведомлений после остановки воркеров
+        await relay
+        await stop_delivery()
+        shutdown_db_executor()
+        close_pool()
+        await bot.session.close()
 
 
 async def main():
+    missing_actions = find_unhandled_state_actions(sys.modules[__name__])
+    if missing_actions:
+        raise RuntimeError(
+            "Нет обработчиков для состояний: " + ", ".join(missing_actions)
+        )
+
+    logger.info("Инициализация базы данных...")
+    init_db()
+    logger.info("База данных инициализирована (PRAGMA: %s)", get_db_pragmas())
+
+    if config.BOT_WORKERS > 1:
+        close_pool()
+        logger.info("Запуск бота (режим %s, воркеров: %s)...", config.BOT_MODE, config.BOT_WORKERS)
+        try:
+            await run_sharded()
+        except KeyboardInterrupt:
+            logger.info("Бот остановлен пользователем")
+        return
+
     try:
-        logger.info("Инициализация базы данных...")
-        init_db()
-        logger.info("База данных инициализирована")
-        
-        logger.info("Запуск фоновых задач...")
-        asyncio.create_task(maintenance_worker())
-        
-        logger.info("Запуск бота...")
-        await dp.start_polling(bot)
+        await start_services()
+
+        logger.info("Запуск бота (режим %s)...", config.BOT_MODE)
+        if config.BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await dp.start_polling(bot)
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
     except Exception as e:
         logger.exception("Критическая ошибка при работе бота")
         raise
+    finally:
+        await stop_services()
 
 
 if __name__ == "__main__":
@@ -12,6 +12,67 @@ PASSPORT_SECRET = os.getenv("PASSPORT_SECRET")
 DB_PATH = os.getenv("DB_PATH", "bot.db")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 
+# Получение обновлений: polling (getUpdates) или webhook (aiohttp-сервер)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")  # если задан — вебхук регистрируется при старте
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # сверяется с X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Несколько процессов-воркеров с разбиением обновлений по tg_id (workers.py)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))  # 1 — всё в одном процессе
+MAINTENANCE_LEASE_SECONDS = int(os.getenv("MAINTENANCE_LEASE_SECONDS", "300"))  # аренда фоновых задач
+
+# Пул соединений с SQLite
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))  # сколько простаивающих соединений держать открытыми
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))  # ожидание снятия блокировки БД
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))  # потоки для запросов из async-хендлеров
+
+# Профиль PRAGMA для SQLite (применяется к каждому соединению из пула)
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL").upper()  # WAL: чтение не блокируется записью
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").upper()  # в режиме WAL NORMAL безопасен
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))  # кэш страниц на соединение
+DB_MMAP_SIZE_MB = int(os.getenv("DB_MMAP_SIZE_MB", "128"))  # 0 — отключить memory-mapped I/O
+DB_TEMP_STORE = os.getenv("DB_TEMP_STORE", "MEMORY").upper()  # DEFAULT, FILE или MEMORY
+
+# Кэш состояний пользователей (states/state_manager.py)
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "10000"))  # сколько пользователей держать в памяти
+STATE_CACHE_TTL_SECONDS = float(os.getenv("STATE_CACHE_TTL_SECONDS", "600"))  # перечитать из БД после
+STATE_FLUSH_INTERVAL_SECONDS = float(os.getenv("STATE_FLUSH_INTERVAL_SECONDS", "1"))  # 0 — писать сразу
+
+# Кэш счётчиков в меню компании (запросы, увольнения, жалобы)
+COMPANY_COUNTERS_TTL_SECONDS = float(os.getenv("COMPANY_COUNTERS_TTL_SECONDS", "30"))
+
+# Очередь исходящих уведомлений (notifications.py)
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))  # параллельных отправителей
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "30"))  # сообщений в секунду на бота
+NOTIFY_PER_CHAT_INTERVAL = float(os.getenv("NOTIFY_PER_CHAT_INTERVAL", "1"))  # секунд между сообщениями в чат
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))  # попыток с учётом RetryAfter
+
+# Таблица outbox: уведомления, записанные вместе с изменением данных
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))  # сообщений за одну выборку
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "20"))  # одновременно отправляемых из пачки
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))  # секунд между проверками
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))  # через сколько вернуть невыполненное
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))  # после — статус failed
+OUTBOX_RETRY_BASE_SECONDS = int(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "30"))  # база экспоненциальной паузы
+
+# Админка (start_admin_ui.py): dev — отладочный сервер Flask, production — waitress
+ADMIN_UI_MODE = os.getenv("ADMIN_UI_MODE", "dev").lower()
+ADMIN_UI_HOST = os.getenv("ADMIN_UI_HOST", "0.0.0.0")
+ADMIN_UI_PORT = int(os.getenv("ADMIN_UI_PORT", "5001"))
+ADMIN_UI_THREADS = int(os.getenv("ADMIN_UI_THREADS", "16"))  # рабочие потоки; открытый поток SSE занимает один
+ADMIN_UI_CONNECTION_LIMIT = int(os.getenv("ADMIN_UI_CONNECTION_LIMIT", "200"))  # одновременных соединений
+ADMIN_UI_KEEPALIVE_TIMEOUT = int(os.getenv("ADMIN_UI_KEEPALIVE_TIMEOUT", "120"))  # закрыть простаивающее, с
+ADMIN_UI_COMPRESS_MIN_SIZE = int(os.getenv("ADMIN_UI_COMPRESS_MIN_SIZE", "500"))  # меньшие ответы не сжимаются
+# Через запятую; пусто — CORS выключен. По умолчанию в dev разрешены все источники, в production — никакие
+ADMIN_UI_CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("ADMIN_UI_CORS_ORIGINS", "*" if ADMIN_UI_MODE == "dev" else "").split(",")
+    if origin.strip()
+]
+
 # Настройки подписок
 PRICE_PER_MONTH = 790  # базовая цена за 1 месяц
 PLAN_DISCOUNTS = {
@@ -25,6 +86,16 @@ PAYMENT_CARD = os.getenv("PAYMENT_CARD", "0000 0000 0000 0000")  # карта д
 # Валидация
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN is not set in .env")
+if BOT_MODE not in ("polling", "webhook"):
+    raise RuntimeError("BOT_MODE must be 'polling' or 'webhook'")
+if BOT_WORKERS < 1:
+    raise RuntimeError("BOT_WORKERS must be at least 1")
+if not WEBHOOK_PATH.startswith("/"):
+    raise RuntimeError("WEBHOOK_PATH must start with '/'")
+if ADMIN_UI_MODE not in ("dev", "production"):
+    raise RuntimeError("ADMIN_UI_MODE must be 'dev' or 'production'")
+if ADMIN_UI_THREADS < 1:
+    raise RuntimeError("ADMIN_UI_THREADS must be at least 1")
 if not PASSPORT_SECRET:
     raise RuntimeError(
         "PASSPORT_SECRET is not set in .env. "
@@ -1,22 +1,209 @@
 import calendar
+import queue
 import secrets
 import sqlite3
 import string
+import threading
+import time
 from contextlib import closing
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
-
-from config import DB_PATH
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import (
+    COMPANY_COUNTERS_TTL_SECONDS,
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB,
+    DB_JOURNAL_MODE,
+    DB_MMAP_SIZE_MB,
+    DB_PATH,
+    DB_POOL_SIZE,
+    DB_SYNCHRONOUS,
+    DB_TEMP_STORE,
+)
 from security import decrypt_passport, encrypt_passport
 
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+# Таблицы, для которых ведётся счётчик версий (table_versions)
+VERSIONED_TABLES = ("companies", "masters", "reviews", "review_appeals")
+
+
+# Connection pool -------------------------------------------------------------
+
+
+class _PooledConnection(sqlite3.Connection):
+    """
+    Соединение из пула: close() не закрывает его, а возвращает в пул.
+    Благодаря этому существующий код вида `with closing(get_conn()) as conn`
+    переиспользует соединения без изменений.
+    """
+
+    _pool: Optional["_ConnectionPool"] = None
+
+    def close(self):
+        pool = self._pool
+        if pool is None:
+            super().close()
+            return
+        pool.release(self)
+
+    def discard(self):
+        self._pool = None
+        super().close()
+
+
+class _ConnectionPool:
+    """
+    Ограниченная очередь простаивающих соединений.
+    Если свободных соединений нет, открывается новое (вложенные get_conn()
+    не должны блокироваться), а при возврате лишние соединения закрываются.
+    """
+
+    def __init__(self, size: int):
+        self._idle: "queue.LifoQueue[_PooledConnection]" = queue.LifoQueue(maxsize=max(size, 0))
+        self._closed = False
+
+    def acquire(self) -> _PooledConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn: _PooledConnection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.discard()
+            return
+        if self._closed:
+            conn.discard()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.discard()
+
+    def drain(self) -> int:
+        self._closed = True
+        drained = 0
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return drained
+            conn.discard()
+            drained += 1
+
+    def _connect(self) -> _PooledConnection:
+        conn = sqlite3.connect(
+            DB_PATH,
+            factory=_PooledConnection,
+            check_same_thread=False,
+        )
+        _configure_connection(conn)
+        conn._pool = self
+        return conn
+
+
+_PRAGMA_CHOICES = {
+    "journal_mode": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+    "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA"},
+    "temp_store": {"DEFAULT", "FILE", "MEMORY"},
+}
+
+
+def _pragma_choice(name: str, value: str) -> str:
+    if value not in _PRAGMA_CHOICES[name]:
+        raise RuntimeError(
+            f"Недопустимое значение PRAGMA {name}: {value!r}. "
+            f"Допустимо: {', '.join(sorted(_PRAGMA_CHOICES[name]))}"
+        )
+    return value
+
+
+def _connection_pragmas() -> List[str]:
+    # Значения подставляются в текст запроса (PRAGMA не принимает параметры),
+    # поэтому строковые значения проверяются по белому списку, а числа приводятся к int.
+    return [
+        f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}",
+        f"PRAGMA journal_mode = {_pragma_choice('journal_mode', DB_JOURNAL_MODE)}",
+        f"PRAGMA synchronous = {_pragma_choice('synchronous', DB_SYNCHRONOUS)}",
+        # Отрицательное значение cache_size задаётся в КиБ, а не в страницах
+        f"PRAGMA cache_size = {-abs(int(DB_CACHE_SIZE_KB))}",
+        f"PRAGMA mmap_size = {int(DB_MMAP_SIZE_MB) * 1024 * 1024}",
+        f"PRAGMA temp_store = {_pragma_choice('temp_store', DB_TEMP_STORE)}",
+    ]
+
+
+def _configure_connection(conn: sqlite3.Connection):
+    """Выполняется один раз при открытии соединения, а не при каждом get_conn()."""
     conn.row_factory = sqlite3.Row
-    return conn
+    for pragma in _connection_pragmas():
+        conn.execute(pragma)
+
+
+def get_db_pragmas() -> Dict[str, Any]:
+    """Фактические значения PRAGMA на соединении из пула (для логов и диагностики)."""
+    with closing(get_conn()) as conn:
+        return {
+            name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+            for name in ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store")
+        }
+
+
+_pool: Optional[_ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def init_pool(size: Optional[int] = None) -> None:
+    """Создаёт (или пересоздаёт) пул соединений заданного размера."""
+    global _pool
+    with _pool_lock:
+        old_pool = _pool
+        _pool = _ConnectionPool(DB_POOL_SIZE if size is None else size)
+    if old_pool is not None:
+        old_pool.drain()
+
+
+def close_pool() -> int:
+    """Закрывает все простаивающие соединения. Возвращает их количество."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    return pool.drain() if pool is not None else 0
+
+
+def _get_pool() -> _ConnectionPool:
+    global _pool
+    pool = _pool
+    if pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = _ConnectionPool(DB_POOL_SIZE)
+            pool = _pool
+    return pool
+
+
+def get_conn():
+    return _get_pool().acquire()
+
+
+def _begin_migration(conn, name: str) -> bool:
+    """
+    Отмечает разовую миграцию name выполненной. True — её нужно выполнить
+    сейчас (в той же транзакции), False — она уже была выполнена раньше.
+    """
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO schema_migrations (name, applied_at) VALUES (?, ?)",
+        (name, utc_now_iso()),
+    )
+    return cursor.rowcount == 1
 
 
 def init_db():
+    # Режим журнала WAL хранится в самом файле БД: первое соединение из пула
+    # переключает базу, после чего чтения не блокируются транзакциями записи
+    # (например, задачами обслуживания).
     with closing(get_conn()) as conn, conn:
         c = conn.cursor()
 
@@ -62,7 +249,10 @@ def init_db():
                 created_at TEXT NOT NULL,
                 blocked INTEGER DEFAULT 0,
                 notes TEXT,
-                passport_locked INTEGER DEFAULT 0
+                passport_locked INTEGER DEFAULT 0,
+                ratings_count INTEGER NOT NULL DEFAULT 0,
+                ratings_sum INTEGER NOT NULL DEFAULT 0,
+                avg_rating REAL
             )
         """
         )
@@ -136,35 +326,17 @@ def init_db():
             except sqlite3.OperationalError:
                 pass
 
+        # Денормализованный рейтинг исполнителя (ведётся в create_review/delete_review)
+        ratings_added = False
         for ddl in (
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_companies_public_id ON companies(public_id)",
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_masters_public_id ON masters(public_id)",
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_companies_tg_id ON companies(tg_id)",
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_masters_tg_id ON masters(tg_id)",
-            # Индексы для улучшения производительности запросов
-            "CREATE INDEX IF NOT EXISTS idx_employments_master_id ON employments(master_id)",
-            "CREATE INDEX IF NOT EXISTS idx_employments_company_id ON employments(company_id)",
-            "CREATE INDEX IF NOT EXISTS idx_employments_status ON employments(status)",
-            "CREATE INDEX IF NOT EXISTS idx_employments_leave_requested_at ON employments(leave_requested_at)",
-            "CREATE INDEX IF NOT EXISTS idx_temp_collabs_company_id ON temporary_collaborations(company_id)",
-            "CREATE INDEX IF NOT EXISTS idx_temp_collabs_master_id ON temporary_collaborations(master_id)",
-            "CREATE INDEX IF NOT EXISTS idx_temp_collabs_status ON temporary_collaborations(status)",
-            "CREATE INDEX IF NOT EXISTS idx_fast_connect_invites_token ON fast_connect_invites(token)",
-            "CREATE INDEX IF NOT EXISTS idx_fast_connect_invites_status ON fast_connect_invites(status)",
-            "CREATE INDEX IF NOT EXISTS idx_reviews_master_id ON reviews(master_id)",
-            "CREATE INDEX IF NOT EXISTS idx_reviews_company_id ON reviews(company_id)",
-            "CREATE INDEX IF NOT EXISTS idx_reviews_employment_id ON reviews(employment_id)",
-            "CREATE INDEX IF NOT EXISTS idx_review_appeals_status ON review_appeals(status)",
-            "CREATE INDEX IF NOT EXISTS idx_review_appeals_company_id ON review_appeals(company_id)",
-            "CREATE INDEX IF NOT EXISTS idx_review_appeals_master_id ON review_appeals(master_id)",
-            "CREATE INDEX IF NOT EXISTS idx_review_appeals_review_id ON review_appeals(review_id)",
-            "CREATE INDEX IF NOT EXISTS idx_review_appeals_created_at ON review_appeals(created_at)",
-            "CREATE INDEX IF NOT EXISTS idx_user_states_tg_id ON user_states(tg_id)",
-            "CREATE INDEX IF NOT EXISTS idx_user_states_created_at ON user_states(created_at)",
+            "ALTER TABLE masters ADD COLUMN ratings_count INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE masters ADD COLUMN ratings_sum INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE masters ADD COLUMN avg_rating REAL",
         ):
             try:
                 c.execute(ddl)
-            except (sqlite3.OperationalError, sqlite3.IntegrityError):
+                ratings_added = True
+            except sqlite3.OperationalError:
                 pass
 
         now = utc_now_iso()
@@ -193,6 +365,8 @@ def init_db():
                 c.execute(ddl)
             except sqlite3.OperationalError:
                 pass
+        if ratings_added:
+            _rebuild_master_ratings(conn)
 
         c.execute(
             """
@@ -270,6 +444,224 @@ def init_db():
         """
         )
 
+        # Готовый текст публичного профиля исполнителя (проверка по M-ID).
+        # text = NULL — снимок сброшен; version растёт при каждом сбросе,
+        # чтобы не сохранить снимок, отрисованный до изменения данных.
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS master_profile_snapshots (
+                master_id INTEGER PRIMARY KEY,
+                public_id TEXT NOT NULL UNIQUE,
+                version INTEGER NOT NULL DEFAULT 0,
+                text TEXT,
+                rendered_at TEXT
+            )
+        """
+        )
+
+        # Исходящие уведомления, записанные в одной транзакции с изменением
+        # данных (transactional outbox). next_attempt_at при выборке сдвигается
+        # на время аренды, поэтому после падения процесса строка вернётся в работу.
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                delivered_at TEXT,
+                last_error TEXT
+            )
+        """
+        )
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbox_status_next_attempt ON outbox(status, next_attempt_at)"
+        )
+
+        # Аренды для фоновых задач: при нескольких процессах бота задачу
+        # выполняет тот, кто держит аренду, пока не истёк expires_at.
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at TEXT NOT NULL
+            )
+        """
+        )
+
+        # Версии таблиц для условных запросов админки (ETag/Last-Modified).
+        # Счётчик увеличивают триггеры на любую запись, в том числе не из db.py
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS table_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL
+            )
+        """
+        )
+        for table in VERSIONED_TABLES:
+            c.execute(
+                "INSERT OR IGNORE INTO table_versions (name, version, updated_at) VALUES (?, 0, ?)",
+                (table, now),
+            )
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                c.execute(
+                    f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+                    AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE table_versions
+                        SET version = version + 1,
+                            updated_at = strftime('%Y-%m-%dT%H:%M:%S', 'now')
+                        WHERE name = '{table}';
+                    END
+                """
+                )
+
+        # Журнал изменений жалоб для потока событий админки (SSE): создание
+        # и смена статуса. Пишется триггерами, id — позиция для Last-Event-ID
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS appeal_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                appeal_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """
+        )
+        c.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_review_appeals_event_insert
+            AFTER INSERT ON review_appeals
+            BEGIN
+                INSERT INTO appeal_events (appeal_id, kind, created_at)
+                VALUES (NEW.id, 'created', strftime('%Y-%m-%dT%H:%M:%S', 'now'));
+            END
+        """
+        )
+        c.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_review_appeals_event_status
+            AFTER UPDATE OF status ON review_appeals
+            WHEN OLD.status IS NOT NEW.status
+            BEGIN
+                INSERT INTO appeal_events (appeal_id, kind, created_at)
+                VALUES (NEW.id, 'status', strftime('%Y-%m-%dT%H:%M:%S', 'now'));
+            END
+        """
+        )
+
+        # Сводная статистика для админки: изменение метрики за день (UTC).
+        # Итоги — сумма по дням; ведётся триггерами из _DAILY_STATS_TRIGGERS
+        stats_exists = c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_stats'"
+        ).fetchone()
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                metric TEXT NOT NULL,
+                day TEXT NOT NULL,
+                value INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (metric, day)
+            )
+        """
+        )
+        for name, event, statements in _DAILY_STATS_TRIGGERS:
+            c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {''.join(statements)} END")
+        if not stats_exists:
+            _rebuild_daily_stats(conn)
+
+        # Разовые преобразования данных: выполненные отмечаются здесь и при
+        # следующих запусках пропускаются
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name TEXT PRIMARY KEY,
+                applied_at TEXT NOT NULL
+            )
+        """
+        )
+
+        # ended_at сравнивается как строка (индекс и курсор списка уволенных),
+        # поэтому приводим его к формату utc_now_iso(); у завершённых без даты — ''.
+        # Новые значения пишутся уже в этом формате, так что достаточно одного раза
+        if _begin_migration(conn, "normalize_employments_ended_at"):
+            c.execute(
+                """
+                UPDATE employments
+                SET ended_at = strftime('%Y-%m-%dT%H:%M:%S', ended_at)
+                WHERE strftime('%Y-%m-%dT%H:%M:%S', ended_at) IS NOT NULL
+                  AND ended_at != strftime('%Y-%m-%dT%H:%M:%S', ended_at)
+            """
+            )
+            c.execute("UPDATE employments SET ended_at = '' WHERE status = 'ended' AND ended_at IS NULL")
+
+        # Индексы создаются после всех таблиц: иначе на новой базе индексы
+        # для таблиц, объявленных ниже по тексту, пропускались до следующего запуска
+        for ddl in (
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_companies_public_id ON companies(public_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_masters_public_id ON masters(public_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_companies_tg_id ON companies(tg_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_masters_tg_id ON masters(tg_id)",
+            # Индексы подобраны под запросы этого модуля; проверка планов —
+            # `python manage.py indexes check` (query_plans.py)
+            "CREATE INDEX IF NOT EXISTS idx_employments_master_status ON employments(master_id, status)",
+            "CREATE INDEX IF NOT EXISTS idx_employments_status_leave_requested ON employments(status, leave_requested_at)",
+            # Покрывающий индекс для постраничного списка уволенных (ключ — ended_at, id)
+            "CREATE INDEX IF NOT EXISTS idx_employments_company_ended "
+            "ON employments(company_id, status, ended_at, id, master_id)",
+            "CREATE INDEX IF NOT EXISTS idx_employments_company_status_leave "
+            "ON employments(company_id, status, leave_requested_at, id DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_temp_collabs_company_id ON temporary_collaborations(company_id)",
+            "CREATE INDEX IF NOT EXISTS idx_temp_collabs_master_id ON temporary_collaborations(master_id)",
+            "CREATE INDEX IF NOT EXISTS idx_temp_collabs_status ON temporary_collaborations(status)",
+            "CREATE INDEX IF NOT EXISTS idx_fast_connect_invites_token ON fast_connect_invites(token)",
+            "CREATE INDEX IF NOT EXISTS idx_fast_connect_invites_status ON fast_connect_invites(status)",
+            "CREATE INDEX IF NOT EXISTS idx_reviews_master_id ON reviews(master_id)",
+            "CREATE INDEX IF NOT EXISTS idx_reviews_company_id ON reviews(company_id)",
+            "CREATE INDEX IF NOT EXISTS idx_reviews_employment_id ON reviews(employment_id)",
+            "CREATE INDEX IF NOT EXISTS idx_review_appeals_status_created ON review_appeals(status, created_at)",
+            # Очередь жалоб в админке: фильтры и курсор (created_at, id)
+            "CREATE INDEX IF NOT EXISTS idx_review_appeals_company_status_created "
+            "ON review_appeals(company_id, status, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_review_appeals_company_created ON review_appeals(company_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_review_appeals_master_created ON review_appeals(master_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_review_appeals_review_master_status "
+            "ON review_appeals(review_id, master_id, status)",
+            "CREATE INDEX IF NOT EXISTS idx_review_appeals_created_at ON review_appeals(created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_appeal_events_created_at ON appeal_events(created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_company_verifications_company_created "
+            "ON company_verifications(company_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_user_states_tg_id ON user_states(tg_id)",
+            "CREATE INDEX IF NOT EXISTS idx_user_states_created_at ON user_states(created_at)",
+        ):
+            try:
+                c.execute(ddl)
+            except (sqlite3.OperationalError, sqlite3.IntegrityError):
+                pass
+
+        # Одностолбцовые индексы, которые стали префиксами составных
+        for index_name in (
+            "idx_employments_master_id",
+            "idx_employments_company_id",
+            "idx_employments_status",
+            "idx_employments_leave_requested_at",
+            "idx_employments_company_status",
+            "idx_employments_company_status_ended",
+            "idx_review_appeals_status",
+            "idx_review_appeals_company_id",
+            "idx_review_appeals_review_id",
+            "idx_review_appeals_company_status",
+            "idx_review_appeals_master_id",
+        ):
+            c.execute(f"DROP INDEX IF EXISTS {index_name}")
+
 
 # Helpers ---------------------------------------------------------------------
 
@@ -290,12 +682,14 @@ def _migrate_legacy_passport(master_id: int, passport: Optional[str]) -> None:
         )
 
 
-def _decrypt_passport_field(data: Optional[Dict], key: str = "passport") -> Optional[Dict]:
+def _decrypt_passport_field(
+    data: Optional[Dict], key: str = "passport", id_key: str = "id"
+) -> Optional[Dict]:
     if data and data.get(key):
         decrypted, legacy = decrypt_passport(data[key])
         data[key] = decrypted
-        if legacy and data.get("id"):
-            _migrate_legacy_passport(data["id"], decrypted)
+        if legacy and data.get(id_key):
+            _migrate_legacy_passport(data[id_key], decrypted)
     return data
 
 
@@ -352,7 +746,7 @@ def generate_public_id(prefix: str, length: int = 6) -> str:
         with closing(get_conn()) as conn, conn:
             c = conn.cursor()
             c.execute(
-                "SELECT 1 FROM masters WHERE public_id = ? UNION SELECT 1 FROM companies WHERE public_id = ?",
+                "SELECT 1 FROM masters WHERE public_id = ? UNION ALL SELECT 1 FROM companies WHERE public_id = ?",
                 (public_id, public_id),
             )
             if not c.fetchone():
@@ -414,11 +808,70 @@ def set_user_phone(tg_id: int, phone: str):
         conn.execute("UPDATE users SET phone = ? WHERE tg_id = ?", (phone, tg_id))
 
 
+def get_user_context(
+    tg_id: int,
+    username: Optional[str] = None,
+    first_name: Optional[str] = None,
+) -> dict:
+    """
+    Загружает всё, что нужно обработчику для идентификации пользователя,
+    за одно обращение к пулу: строку users (создаёт её при первом обращении,
+    как get_or_create_user), профиль исполнителя и профиль компании.
+    Пишет в БД только для нового пользователя: обычный вызов — одни SELECT,
+    без блокировки на запись.
+    """
+    with closing(get_conn()) as conn, conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,))
+        user = _row(c.fetchone())
+        if user is None:
+            c.execute(
+                """
+                INSERT OR IGNORE INTO users (tg_id, username, first_name, role)
+                VALUES (?, ?, ?, NULL)
+                """,
+                (tg_id, username, first_name),
+            )
+            c.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,))
+            user = _row(c.fetchone())
+        c.execute("SELECT * FROM masters WHERE tg_id = ?", (tg_id,))
+        master = _serialize_master(c.fetchone())
+        c.execute("SELECT * FROM companies WHERE tg_id = ?", (tg_id,))
+        company = _row(c.fetchone())
+    return {"user": user, "master": master, "company": company}
+
+
 # Companies & Masters ---------------------------------------------------------
 
 
-def _serialize_master(row) -> Optional[dict]:
-    return _decrypt_passport_field(_row(row))
+def _serialize_master(
+    row, include_passport: bool = False, id_key: str = "id"
+) -> Optional[dict]:
+    """
+    Строка с паспортом исполнителя в виде dict. Паспорт расшифровывается
+    только по запросу: без include_passport поле passport = None, а шифртекст
+    лежит в passport_encrypted (см. decrypt_master_passport). id_key — столбец
+    с id исполнителя (для строк других таблиц, например employments).
+    """
+    data = _row(row)
+    if data is None or include_passport:
+        return _decrypt_passport_field(data, id_key=id_key)
+    data["passport_encrypted"] = data["passport"]
+    data["passport"] = None
+    return data
+
+
+def decrypt_master_passport(master: Optional[dict]) -> Optional[dict]:
+    """
+    Возвращает копию master с расшифрованным паспортом
+    (для словарей, полученных без include_passport, в том числе
+    из get_employment_by_id — там id исполнителя в master_id).
+    """
+    if master is None or "passport_encrypted" not in master:
+        return master
+    data = dict(master)
+    data["passport"] = data.pop("passport_encrypted")
+    return _decrypt_passport_field(data, id_key="master_id" if "master_id" in data else "id")
 
 
 def create_company(tg_id: int, name: str, city: Optional[str], responsible_phone: Optional[str]) -> dict:
@@ -450,7 +903,7 @@ def create_master(tg_id: int, full_name: str, phone: Optional[str], passport: Op
         )
         c = conn.cursor()
         c.execute("SELECT * FROM masters WHERE rowid = last_insert_rowid()")
-        return _serialize_master(c.fetchone())
+        return _serialize_master(c.fetchone(), include_passport=True)
 
 
 def get_company_by_user(tg_id: int) -> Optional[dict]:
@@ -460,11 +913,11 @@ def get_company_by_user(tg_id: int) -> Optional[dict]:
         return _row(c.fetchone())
 
 
-def get_master_by_user(tg_id: int) -> Optional[dict]:
+def get_master_by_user(tg_id: int, include_passport: bool = False) -> Optional[dict]:
     with closing(get_conn()) as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM masters WHERE tg_id = ?", (tg_id,))
-        return _serialize_master(c.fetchone())
+        return _serialize_master(c.fetchone(), include_passport)
 
 
 def get_company_by_public_id(public_id: str) -> Optional[dict]:
@@ -474,11 +927,11 @@ def get_company_by_public_id(public_id: str) -> Optional[dict]:
         return _row(c.fetchone())
 
 
-def get_master_by_public_id(public_id: str) -> Optional[dict]:
+def get_master_by_public_id(public_id: str, include_passport: bool = False) -> Optional[dict]:
     with closing(get_conn()) as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM masters WHERE public_id = ?", (public_id,))
-        return _serialize_master(c.fetchone())
+        return _serialize_master(c.fetchone(), include_passport)
 
 
 def set_company_kyc_status(company_id: int, status: str):
@@ -620,11 +1073,11 @@ def get_company_by_id(company_id: int) -> Optional[dict]:
         return _row(c.fetchone())
 
 
-def get_master_by_id(master_id: int) -> Optional[dict]:
+def get_master_by_id(master_id: int, include_passport: bool = False) -> Optional[dict]:
     with closing(get_conn()) as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM masters WHERE id = ?", (master_id,))
-        return _serialize_master(c.fetchone())
+        return _serialize_master(c.fetchone(), include_passport)
 
 
 def get_company_requests_count(company_id: int) -> int:
@@ -657,6 +1110,64 @@ def get_company_leave_requests_count(company_id: int) -> int:
         return count
 
 
+# Счётчики для меню компании держатся в памяти процесса COMPANY_COUNTERS_TTL_SECONDS
+# и сбрасываются функциями, меняющими статусы заявок и жалоб. Изменения из
+# других процессов (админ-панель, другие воркеры) станут видны по истечении TTL.
+_company_counters_lock = threading.Lock()
+_company_counters: Dict[int, Tuple[float, dict]] = {}
+
+
+def get_company_menu_counters(company_id: int) -> dict:
+    """
+    Счётчики для меню компании одним запросом:
+    {"requests": ..., "leave_requests": ..., "appeals": ...}.
+    """
+    now = time.monotonic()
+    with _company_counters_lock:
+        cached = _company_counters.get(company_id)
+    if cached and now - cached[0] < COMPANY_COUNTERS_TTL_SECONDS:
+        return dict(cached[1])
+
+    with closing(get_conn()) as conn:
+        row = conn.execute(
+            """
+            SELECT
+                (SELECT COUNT(*) FROM employments
+                 WHERE company_id = :company_id AND status = 'pending_company_confirm') AS requests,
+                (SELECT COUNT(*) FROM employments
+                 WHERE company_id = :company_id AND status = 'leave_requested') AS leave_requests,
+                (SELECT COUNT(*) FROM review_appeals
+                 WHERE company_id = :company_id AND status = 'pending_company_response') AS appeals
+            """,
+            {"company_id": company_id},
+        ).fetchone()
+    counters = dict(row)
+    with _company_counters_lock:
+        _company_counters[company_id] = (now, counters)
+        if len(_company_counters) > 10000:
+            # Убираем только устаревшие записи, свежие счётчики других компаний остаются
+            for key in [
+                key
+                for key, (stored_at, _) in _company_counters.items()
+                if now - stored_at >= COMPANY_COUNTERS_TTL_SECONDS
+            ]:
+                del _company_counters[key]
+    return dict(counters)
+
+
+def invalidate_company_counters(*company_ids: Optional[int]):
+    """Сбрасывает кэш счётчиков только для указанных компаний."""
+    with _company_counters_lock:
+        for company_id in company_ids:
+            _company_counters.pop(company_id, None)
+
+
+def _company_id_of(conn, table: str, row_id: int) -> Optional[int]:
+    # table — только литералы из этого модуля
+    row = conn.execute(f"SELECT company_id FROM {table} WHERE id = ?", (row_id,)).fetchone()
+    return row["company_id"] if row else None
+
+
 def company_has_active_subscription(company: dict) -> bool:
     sub_until = company.get("subscription_until")
     if not sub_until:
@@ -705,6 +1216,15 @@ def set_company_subscription(company_id: int, months: int, level: str = "basic")
         )
 
 
+def update_company_name(company_id: int, name: str):
+    with closing(get_conn()) as conn, conn:
+        conn.execute("UPDATE companies SET name = ? WHERE id = ?", (name, company_id))
+        # Название компании выводится в отзывах публичных профилей
+        _invalidate_master_snapshots(
+            conn, "SELECT DISTINCT master_id FROM reviews WHERE company_id = ?", (company_id,)
+        )
+
+
 def set_company_blocked(company_id: int, blocked: bool):
     with closing(get_conn()) as conn, conn:
         conn.execute(
@@ -719,6 +1239,7 @@ def set_master_blocked(master_id: int, blocked: bool):
             "UPDATE masters SET blocked = ? WHERE id = ?",
             (1 if blocked else 0, master_id),
         )
+        _invalidate_master_snapshot(conn, master_id)
 
 
 def set_master_passport_locked(master_id: int, locked: bool):
@@ -767,6 +1288,58 @@ def update_master_profile(
     params.append(master_id)
     with closing(get_conn()) as conn, conn:
         conn.execute(f"UPDATE masters SET {', '.join(sets)} WHERE id = ?", params)
+        _invalidate_master_snapshot(conn, master_id)
+
+
+# Master public profile snapshots ----------------------------------------------
+
+
+def _invalidate_master_snapshots(conn, master_ids_query: str, params: Sequence[Any] = ()):
+    conn.execute(
+        f"""
+        INSERT INTO master_profile_snapshots (master_id, public_id, version, text)
+        SELECT id, public_id, 1, NULL FROM masters
+        WHERE id IN ({master_ids_query}) AND public_id IS NOT NULL
+        ON CONFLICT(master_id) DO UPDATE SET version = version + 1, text = NULL
+        """,
+        params,
+    )
+
+
+def _invalidate_master_snapshot(conn, master_id: int):
+    _invalidate_master_snapshots(conn, "?", (master_id,))
+
+
+def get_master_profile_snapshot(public_id: str) -> Optional[dict]:
+    """
+    Возвращает снимок публичного профиля: {"master_id", "version", "text"}.
+    text = None — снимок нужно отрисовать заново и сохранить с этой версией.
+    """
+    with closing(get_conn()) as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT master_id, version, text FROM master_profile_snapshots WHERE public_id = ?",
+            (public_id,),
+        )
+        return _row(c.fetchone())
+
+
+def save_master_profile_snapshot(master_id: int, public_id: str, version: int, text: str) -> bool:
+    """
+    Сохраняет отрисованный профиль, если с момента чтения version его не сбросили.
+    """
+    with closing(get_conn()) as conn, conn:
+        cursor = conn.execute(
+            """
+            INSERT INTO master_profile_snapshots (master_id, public_id, version, text, rendered_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(master_id) DO UPDATE
+            SET text = excluded.text, rendered_at = excluded.rendered_at
+            WHERE master_profile_snapshots.version = excluded.version
+            """,
+            (master_id, public_id, version, text, utc_now_iso()),
+        )
+        return cursor.rowcount > 0
 
 
 # Employments -----------------------------------------------------------------
@@ -789,21 +1362,29 @@ def get_company_employments(company_id: int) -> List[dict]:
 
 
 def get_company_ended_employments(
-    company_id: int, limit: Optional[int] = None, offset: int = 0
+    company_id: int, limit: Optional[int] = None, after: Optional[Tuple[str, int]] = None
 ) -> List[dict]:
+    """
+    Завершённые сотрудничества компании, новые первыми.
+    after — курсор (ended_at, id) последней показанной строки: следующая
+    страница начинается сразу за ней поиском по индексу, без OFFSET.
+    """
     with closing(get_conn()) as conn:
         c = conn.cursor()
         params: List[Any] = [company_id]
         query = """
-            SELECT e.*, m.full_name, m.public_id as master_public_id
+            SELECT e.id, e.master_id, e.ended_at, m.full_name, m.public_id as master_public_id
             FROM employments e
             JOIN masters m ON e.master_id = m.id
             WHERE e.company_id = ? AND e.status = 'ended'
-            ORDER BY datetime(e.ended_at) DESC, e.id DESC
         """
+        if after is not None:
+            query += " AND (e.ended_at, e.id) < (?, ?)"
+            params.extend(after)
+        query += " ORDER BY e.ended_at DESC, e.id DESC"
         if limit is not None:
-            query += " LIMIT ? OFFSET ?"
-            params.extend([limit, offset])
+            query += " LIMIT ?"
+            params.append(limit)
         c.execute(query, params)
         return [dict(row) for row in c.fetchall()]
 
@@ -843,7 +1424,14 @@ def get_current_employment(master_id: int) -> Optional[dict]:
         return _row(c.fetchone())
 
 
-def auto_close_leave_requests() -> List[dict]:
+def auto_close_leave_requests(
+    notifications: Optional[Callable[[dict], Iterable[Tuple[int, str]]]] = None,
+) -> List[dict]:
+    """
+    Завершает сотрудничество по запросам на увольнение без ответа компании.
+    notifications(row) возвращает пары (chat_id, text), которые записываются
+    в outbox в той же транзакции.
+    """
     now = datetime.utcnow()
     threshold = now - timedelta(days=2)
     now_iso = now.isoformat(timespec="seconds")
@@ -886,7 +1474,12 @@ def auto_close_leave_requests() -> List[dict]:
                 """,
                 (now_iso, *ids),
             )
-        return rows
+            if notifications is not None:
+                _add_outbox_messages(
+                    conn, [message for row in rows for message in notifications(row)]
+                )
+    invalidate_company_counters(*{row["company_id"] for row in rows})
+    return rows
 
 
 def has_any_current_employment(master_id: int) -> bool:
@@ -947,6 +1540,7 @@ def create_employment(master_id: int, company_id: int, position: str):
         """,
             (master_id, company_id, position),
         )
+    invalidate_company_counters(company_id)
 
 
 def get_pending_employments_for_company(company_id: int) -> List[dict]:
@@ -981,7 +1575,8 @@ def get_pending_leave_requests_for_company(company_id: int) -> List[dict]:
         return [dict(row) for row in c.fetchall()]
 
 
-def get_employment_by_id(employment_id: int) -> Optional[dict]:
+def get_employment_by_id(employment_id: int, include_passport: bool = False) -> Optional[dict]:
+    """Трудоустройство с данными исполнителя и компании; паспорт — как в _serialize_master."""
     with closing(get_conn()) as conn:
         c = conn.cursor()
         c.execute(
@@ -1001,17 +1596,12 @@ def get_employment_by_id(employment_id: int) -> Optional[dict]:
             (employment_id,),
         )
         row = c.fetchone()
-        data = _row(row)
-        if data and data.get("passport"):
-            decrypted, legacy = decrypt_passport(data["passport"])
-            data["passport"] = decrypted
-            if legacy and data.get("master_id"):
-                _migrate_legacy_passport(data["master_id"], decrypted)
-        return data
+    return _serialize_master(row, include_passport, id_key="master_id")
 
 
 def set_employment_accepted(employment_id: int):
     with closing(get_conn()) as conn, conn:
+        company_id = _company_id_of(conn, "employments", employment_id)
         conn.execute(
             """
             UPDATE employments
@@ -1020,10 +1610,12 @@ def set_employment_accepted(employment_id: int):
         """,
             (utc_now_iso(), employment_id),
         )
+    invalidate_company_counters(company_id)
 
 
 def set_employment_rejected(employment_id: int):
     with closing(get_conn()) as conn, conn:
+        company_id = _company_id_of(conn, "employments", employment_id)
         conn.execute(
             """
             UPDATE employments
@@ -1032,10 +1624,12 @@ def set_employment_rejected(employment_id: int):
         """,
             (employment_id,),
         )
+    invalidate_company_counters(company_id)
 
 
 def set_employment_leave_requested(employment_id: int):
     with closing(get_conn()) as conn, conn:
+        company_id = _company_id_of(conn, "employments", employment_id)
         conn.execute(
             """
             UPDATE employments
@@ -1044,10 +1638,26 @@ def set_employment_leave_requested(employment_id: int):
         """,
             (utc_now_iso(), employment_id),
         )
+    invalidate_company_counters(company_id)
+
+
+def get_leave_request_times() -> List[dict]:
+    """Время запросов на увольнение без ответа компании (для планировщика)."""
+    with closing(get_conn()) as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT id, leave_requested_at
+            FROM employments
+            WHERE status = 'leave_requested' AND leave_requested_at IS NOT NULL
+            """
+        )
+        return [dict(row) for row in c.fetchall()]
 
 
 def cancel_employment_leave_request(employment_id: int) -> bool:
     with closing(get_conn()) as conn, conn:
+        company_id = _company_id_of(conn, "employments", employment_id)
         cursor = conn.execute(
             """
             UPDATE employments
@@ -1056,11 +1666,14 @@ def cancel_employment_leave_request(employment_id: int) -> bool:
             """,
             (employment_id,),
         )
-        return cursor.rowcount > 0
+        cancelled = cursor.rowcount > 0
+    invalidate_company_counters(company_id)
+    return cancelled
 
 
 def end_employment(employment_id: int):
     with closing(get_conn()) as conn, conn:
+        company_id = _company_id_of(conn, "employments", employment_id)
         conn.execute(
             """
             UPDATE employments
@@ -1069,6 +1682,7 @@ def end_employment(employment_id: int):
         """,
             (utc_now_iso(), employment_id),
         )
+    invalidate_company_counters(company_id)
 
 
 # Temporary collaborations ----------------------------------------------------
@@ -1249,7 +1863,9 @@ def create_review(
             (master_id, company_id, text, utc_now_iso(), employment_id, rating),
         )
         review_id = cursor.lastrowid
-    update_master_rating(master_id)
+        if rating is not None:
+            _apply_master_rating_delta(conn, master_id, rating, 1)
+        _invalidate_master_snapshot(conn, master_id)
     return review_id
 
 
@@ -1273,15 +1889,11 @@ def get_master_rating(master_id: int) -> dict:
     with closing(get_conn()) as conn:
         c = conn.cursor()
         c.execute(
-            """
-            SELECT AVG(rating) as avg_rating, COUNT(rating) as ratings_count
-            FROM reviews
-            WHERE master_id = ? AND rating IS NOT NULL
-            """,
+            "SELECT avg_rating, ratings_count FROM masters WHERE id = ?",
             (master_id,),
         )
         row = c.fetchone()
-        if not row or row["ratings_count"] == 0:
+        if not row or not row["ratings_count"]:
             return {"avg_rating": None, "ratings_count": 0}
         return {
             "avg_rating": round(row["avg_rating"] or 0, 2),
@@ -1289,11 +1901,92 @@ def get_master_rating(master_id: int) -> dict:
         }
 
 
+# В правой части UPDATE видны старые значения столбцов
+_MASTER_RATING_DELTA_SQL = """
+    UPDATE masters
+    SET ratings_sum = ratings_sum + :rating_delta,
+        ratings_count = ratings_count + :count_delta,
+        avg_rating = CASE
+            WHEN ratings_count + :count_delta > 0
+            THEN CAST(ratings_sum + :rating_delta AS REAL) / (ratings_count + :count_delta)
+        END
+    WHERE id = :master_id
+"""
+
+
+def _apply_master_rating_delta(conn, master_id: int, rating_delta: int, count_delta: int):
+    _apply_master_rating_deltas(conn, [(master_id, rating_delta, count_delta)])
+
+
+def _apply_master_rating_deltas(conn, deltas: Iterable[Tuple[int, int, int]]):
+    conn.executemany(
+        _MASTER_RATING_DELTA_SQL,
+        [
+            {"master_id": master_id, "rating_delta": rating_delta, "count_delta": count_delta}
+            for master_id, rating_delta, count_delta in deltas
+        ],
+    )
+
+
+def _rebuild_master_ratings(conn, master_id: Optional[int] = None) -> int:
+    query = """
+        UPDATE masters
+        SET ratings_count = (
+                SELECT COUNT(rating) FROM reviews WHERE master_id = masters.id
+            ),
+            ratings_sum = (
+                SELECT COALESCE(SUM(rating), 0) FROM reviews WHERE master_id = masters.id
+            ),
+            avg_rating = (
+                SELECT AVG(rating) FROM reviews WHERE master_id = masters.id
+            )
+    """
+    # Рейтинг входит в публичный профиль: снимки пересобираются при следующем показе
+    if master_id is None:
+        updated = conn.execute(query).rowcount
+        _invalidate_master_snapshots(conn, "SELECT id FROM masters")
+        return updated
+    updated = conn.execute(query + " WHERE id = ?", (master_id,)).rowcount
+    _invalidate_master_snapshot(conn, master_id)
+    return updated
+
+
 def update_master_rating(master_id: int):
-    # Упрощённо: пока только заглушка для последующей оптимизации
-    # (хранение средней оценки в таблице masters если потребуется)
-    # Сейчас функция просто существует для совместимости.
-    get_master_rating(master_id)
+    """Пересчитывает сохранённый рейтинг исполнителя по таблице reviews."""
+    with closing(get_conn()) as conn, conn:
+        _rebuild_master_ratings(conn, master_id)
+
+
+def rebuild_master_ratings() -> int:
+    """
+    Пересчитывает сохранённые рейтинги всех исполнителей (backfill).
+    Возвращает количество обновлённых строк.
+    """
+    with closing(get_conn()) as conn, conn:
+        return _rebuild_master_ratings(conn)
+
+
+def verify_master_ratings() -> List[dict]:
+    """
+    Сравнивает сохранённые рейтинги с пересчётом по reviews.
+    Возвращает список расхождений.
+    """
+    with closing(get_conn()) as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT m.id, m.public_id, m.ratings_count, m.ratings_sum,
+                   COUNT(r.rating) AS actual_count,
+                   COALESCE(SUM(r.rating), 0) AS actual_sum
+            FROM masters m
+            LEFT JOIN reviews r ON r.master_id = m.id AND r.rating IS NOT NULL
+            GROUP BY m.id
+            HAVING m.ratings_count != COUNT(r.rating)
+                OR m.ratings_sum != COALESCE(SUM(r.rating), 0)
+            ORDER BY m.id
+            """
+        )
+        return [dict(row) for row in c.fetchall()]
 
 
 def get_reviews_for_employment(employment_id: int) -> List[dict]:
@@ -1370,7 +2063,8 @@ def create_review_appeal(review_id: int, master_id: int, company_id: Optional[in
                 reason,
             ),
         )
-        return cursor.lastrowid
+    invalidate_company_counters(company_id)
+    return cursor.lastrowid
 
 
 def get_active_appeal_for_review_and_master(review_id: int, master_id: int) -> Optional[dict]:
@@ -1420,7 +2114,7 @@ def get_pending_company_appeals(company_id: int) -> List[dict]:
             JOIN masters m ON ra.master_id = m.id
             WHERE ra.company_id = ?
               AND ra.status = 'pending_company_response'
-            ORDER BY ra.id DESC
+            ORDER BY ra.created_at DESC, ra.id DESC
         """,
             (company_id,),
         )
@@ -1428,6 +2122,7 @@ def get_pending_company_appeals(company_id: int) -> List[dict]:
 
 
 def get_review_appeal_by_id(appeal_id: int) -> Optional[dict]:
+    """Жалоба с отзывом; после автоудаления отзыва review_text и review_created_at = None."""
     with closing(get_conn()) as conn:
         c = conn.cursor()
         c.execute(
@@ -1436,7 +2131,7 @@ def get_review_appeal_by_id(appeal_id: int) -> Optional[dict]:
                    m.full_name as master_full_name, m.public_id as master_public_id,
                    c2.name as company_name, c2.public_id as company_public_id
             FROM review_appeals ra
-            JOIN reviews r ON ra.review_id = r.id
+            LEFT JOIN reviews r ON ra.review_id = r.id
             JOIN masters m ON ra.master_id = m.id
             LEFT JOIN companies c2 ON ra.company_id = c2.id
             WHERE ra.id = ?
@@ -1446,9 +2141,221 @@ def get_review_appeal_by_id(appeal_id: int) -> Optional[dict]:
         return _row(c.fetchone())
 
 
+def get_review_appeals_page(
+    limit: int,
+    after: Optional[Tuple[str, int]] = None,
+    status: Optional[str] = None,
+    company_id: Optional[int] = None,
+    master_id: Optional[int] = None,
+    created_from: Optional[str] = None,
+    created_before: Optional[str] = None,
+) -> List[dict]:
+    """
+    Страница жалоб для админки, новые первыми.
+    after — курсор (created_at, id) последней строки предыдущей страницы;
+    created_from включительно, created_before — не включая. Возвращаются
+    только столбцы таблицы очереди, карточка загружается отдельно.
+    """
+    with closing(get_conn()) as conn:
+        c = conn.cursor()
+        params: List[Any] = []
+        query = """
+            SELECT ra.id, ra.review_id, ra.master_id, ra.company_id, ra.status, ra.created_at,
+                   m.full_name as master_full_name, m.public_id as master_public_id,
+                   c2.name as company_name, c2.public_id as company_public_id
+            FROM review_appeals ra
+            JOIN masters m ON ra.master_id = m.id
+            LEFT JOIN companies c2 ON ra.company_id = c2.id
+            WHERE 1 = 1
+        """
+        if status is not None:
+            query += " AND ra.status = ?"
+            params.append(status)
+        if company_id is not None:
+            query += " AND ra.company_id = ?"
+            params.append(company_id)
+        if master_id is not None:
+            query += " AND ra.master_id = ?"
+            params.append(master_id)
+        if created_from is not None:
+            query += " AND ra.created_at >= ?"
+            params.append(created_from)
+        if created_before is not None:
+            query += " AND ra.created_at < ?"
+            params.append(created_before)
+        if after is not None:
+            query += " AND (ra.created_at, ra.id) < (?, ?)"
+            params.extend(after)
+        query += " ORDER BY ra.created_at DESC, ra.id DESC LIMIT ?"
+        params.append(limit)
+        c.execute(query, params)
+        return [dict(row) for row in c.fetchall()]
+
+
+def get_pending_review_appeal_times() -> List[dict]:
+    """Сроки по жалобам, ожидающим ответа компании (для планировщика)."""
+    with closing(get_conn()) as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT id, created_at, reminder_sent_at
+            FROM review_appeals
+            WHERE status = 'pending_company_response'
+            """
+        )
+        return [dict(row) for row in c.fetchall()]
+
+
+def get_pending_review_appeals() -> List[dict]:
+    with closing(get_conn()) as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT ra.*, r.text as review_text, r.created_at as review_created_at,
+                   m.full_name as master_full_name, m.public_id as master_public_id,
+                   c2.name as company_name, c2.public_id as company_public_id
+            FROM review_appeals ra
+            JOIN reviews r ON ra.review_id = r.id
+            JOIN masters m ON ra.master_id = m.id
+            LEFT JOIN companies c2 ON ra.company_id = c2.id
+            WHERE ra.status = 'pending_company_response'
+            """
+        )
+        return [dict(row) for row in c.fetchall()]
+
+
+def set_review_appeal_master_files(appeal_id: int, files_json: str):
+    with closing(get_conn()) as conn, conn:
+        conn.execute(
+            "UPDATE review_appeals SET master_files_message_id = ? WHERE id = ?",
+            (files_json, appeal_id),
+        )
+
+
+def mark_review_appeal_reminder_sent(appeal_id: int):
+    now = utc_now_iso()
+    with closing(get_conn()) as conn, conn:
+        conn.execute(
+            """
+            UPDATE review_appeals
+            SET reminder_sent_at = ?, updated_at = ?
+            WHERE id = ?
+            """,
+            (now, now, appeal_id),
+        )
+
+
+def mark_review_appeal_auto_removed(appeal_id: int):
+    now = utc_now_iso()
+    with closing(get_conn()) as conn, conn:
+        company_id = _company_id_of(conn, "review_appeals", appeal_id)
+        conn.execute(
+            """
+            UPDATE review_appeals
+            SET status = 'auto_removed_review', updated_at = ?, final_decision_at = ?
+            WHERE id = ?
+            """,
+            (now, now, appeal_id),
+        )
+    invalidate_company_counters(company_id)
+
+
+def process_due_review_appeals(
+    notifications: Optional[Callable[[dict], Iterable[Tuple[int, str]]]] = None,
+    reminder_after: timedelta = timedelta(days=3),
+    remove_after: timedelta = timedelta(days=5),
+) -> List[dict]:
+    """
+    Обрабатывает жалобы без ответа компании, срок которых наступил:
+    remind — отметка о напоминании компании (через reminder_after),
+    remove — удаление отзыва и закрытие жалобы (через remove_after).
+    Всё пакетно и в одной транзакции; notifications(row) возвращает пары
+    (chat_id, text), которые записываются в outbox там же.
+    """
+    now_iso = utc_now_iso()
+    now = datetime.fromisoformat(now_iso)
+    reminder_before = (now - reminder_after).isoformat(timespec="seconds")
+    remove_before = (now - remove_after).isoformat(timespec="seconds")
+
+    with closing(get_conn()) as conn, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT ra.id, ra.review_id, ra.master_id, ra.company_id, ra.created_at,
+                   r.text AS review_text, r.rating AS review_rating,
+                   m.tg_id AS master_tg_id, m.full_name AS master_full_name,
+                   m.public_id AS master_public_id,
+                   c2.tg_id AS company_tg_id,
+                   (ra.reminder_sent_at IS NULL AND c2.tg_id IS NOT NULL) AS remind,
+                   (ra.created_at <= ?) AS remove
+            FROM review_appeals ra
+            JOIN reviews r ON ra.review_id = r.id
+            JOIN masters m ON ra.master_id = m.id
+            LEFT JOIN companies c2 ON ra.company_id = c2.id
+            WHERE ra.status = 'pending_company_response'
+              AND ra.created_at <= ?
+              AND (ra.reminder_sent_at IS NULL OR ra.created_at <= ?)
+            """,
+            (remove_before, reminder_before, remove_before),
+        )
+        rows = []
+        for row in c.fetchall():
+            row = dict(row)
+            row["remind"] = bool(row["remind"])
+            row["remove"] = bool(row["remove"])
+            if row["remind"] or row["remove"]:
+                rows.append(row)
+        if not rows:
+            return rows
+
+        reminded = [(now_iso, now_iso, row["id"]) for row in rows if row["remind"]]
+        if reminded:
+            conn.executemany(
+                "UPDATE review_appeals SET reminder_sent_at = ?, updated_at = ? WHERE id = ?",
+                reminded,
+            )
+
+        removed = [row for row in rows if row["remove"]]
+        if removed:
+            reviews = {row["review_id"]: row for row in removed}
+            conn.executemany(
+                "DELETE FROM reviews WHERE id = ?", [(review_id,) for review_id in reviews]
+            )
+            deltas: Dict[int, List[int]] = {}
+            for row in reviews.values():
+                if row["review_rating"] is not None:
+                    delta = deltas.setdefault(row["master_id"], [0, 0])
+                    delta[0] -= row["review_rating"]
+                    delta[1] -= 1
+            _apply_master_rating_deltas(
+                conn, [(master_id, s, n) for master_id, (s, n) in deltas.items()]
+            )
+            master_ids = sorted({row["master_id"] for row in removed})
+            _invalidate_master_snapshots(
+                conn, ",".join("?" for _ in master_ids), master_ids
+            )
+            conn.executemany(
+                """
+                UPDATE review_appeals
+                SET status = 'auto_removed_review', updated_at = ?, final_decision_at = ?
+                WHERE id = ?
+                """,
+                [(now_iso, now_iso, row["id"]) for row in removed],
+            )
+
+        if notifications is not None:
+            _add_outbox_messages(
+                conn, [message for row in rows for message in notifications(row)]
+            )
+    invalidate_company_counters(*{row["company_id"] for row in removed})
+    return rows
+
+
 def update_review_appeal_company_response(appeal_id: int, comment: Optional[str], files_message_id: Optional[int]):
     now = utc_now_iso()
     with closing(get_conn()) as conn, conn:
+        company_id = _company_id_of(conn, "review_appeals", appeal_id)
         conn.execute(
             """
             UPDATE review_appeals
@@ -1461,8 +2368,372 @@ def update_review_appeal_company_response(appeal_id: int, comment: Optional[str]
         """,
             (comment, files_message_id, now, now, appeal_id),
         )
+    invalidate_company_counters(company_id)
 
 
 def delete_review(review_id: int):
     with closing(get_conn()) as conn, conn:
+        row = conn.execute(
+            "SELECT master_id, rating FROM reviews WHERE id = ?", (review_id,)
+        ).fetchone()
         conn.execute("DELETE FROM reviews WHERE id = ?", (review_id,))
+        if row:
+            if row["rating"] is not None:
+                _apply_master_rating_delta(conn, row["master_id"], -row["rating"], -1)
+            _invalidate_master_snapshot(conn, row["master_id"])
+
+
+def get_appeal_event_bounds() -> Tuple[Optional[int], int]:
+    """
+    id самого старого хранящегося события жалоб (None — журнал пуст) и id
+    последнего выданного. Последний берётся из sqlite_sequence: он не
+    теряется, когда очистка удаляет все события.
+    """
+    with closing(get_conn()) as conn:
+        first_id = conn.execute("SELECT MIN(id) FROM appeal_events").fetchone()[0]
+        row = conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'appeal_events'"
+        ).fetchone()
+    return first_id, row[0] if row else 0
+
+
+def get_appeal_events(after_id: int, limit: int = 100) -> List[dict]:
+    """
+    События жалоб после after_id вместе с текущей строкой очереди админки.
+    listed = 0 — жалобы (или её исполнителя) больше нет, в очереди она не показывается.
+    """
+    with closing(get_conn()) as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT ev.id as event_id, ev.kind, ev.appeal_id as id,
+                   ra.review_id, ra.master_id, ra.company_id, ra.status, ra.created_at,
+                   m.full_name as master_full_name, m.public_id as master_public_id,
+                   c2.name as company_name, c2.public_id as company_public_id,
+                   m.id IS NOT NULL as listed
+            FROM appeal_events ev
+            LEFT JOIN review_appeals ra ON ra.id = ev.appeal_id
+            LEFT JOIN masters m ON ra.master_id = m.id
+            LEFT JOIN companies c2 ON ra.company_id = c2.id
+            WHERE ev.id > ?
+            ORDER BY ev.id
+            LIMIT ?
+        """,
+            (after_id, limit),
+        )
+        return [dict(row) for row in c.fetchall()]
+
+
+def purge_appeal_events(max_age_days: int = 7) -> int:
+    threshold = (datetime.utcnow() - timedelta(days=max_age_days)).isoformat(timespec="seconds")
+    with closing(get_conn()) as conn, conn:
+        cursor = conn.execute("DELETE FROM appeal_events WHERE created_at < ?", (threshold,))
+        return cursor.rowcount
+
+
+# Outbox ----------------------------------------------------------------------
+
+
+def _add_outbox_messages(conn, messages: Iterable[Tuple[int, str]]):
+    now = utc_now_iso()
+    conn.executemany(
+        """
+        INSERT INTO outbox (chat_id, text, status, next_attempt_at, created_at)
+        VALUES (?, ?, 'pending', ?, ?)
+        """,
+        [(chat_id, text, now, now) for chat_id, text in messages],
+    )
+
+
+def add_outbox_message(chat_id: int, text: str):
+    with closing(get_conn()) as conn, conn:
+        _add_outbox_messages(conn, [(chat_id, text)])
+
+
+def claim_outbox_batch(limit: int, lease_seconds: int) -> List[dict]:
+    """
+    Забирает до limit готовых к отправке сообщений и сдвигает их next_attempt_at
+    на lease_seconds: если отправитель упадёт, сообщения вернутся в очередь.
+    """
+    now = datetime.utcnow()
+    now_iso = now.isoformat(timespec="seconds")
+    lease_until = (now + timedelta(seconds=lease_seconds)).isoformat(timespec="seconds")
+    with closing(get_conn()) as conn, conn:
+        # IMMEDIATE: два отправителя не заберут одни и те же строки
+        conn.execute("BEGIN IMMEDIATE")
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT id, chat_id, text, attempts
+            FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+            """,
+            (now_iso, limit),
+        )
+        rows = [dict(row) for row in c.fetchall()]
+        if rows:
+            conn.executemany(
+                "UPDATE outbox SET next_attempt_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(lease_until, row["id"]) for row in rows],
+            )
+        for row in rows:
+            row["attempts"] += 1
+        return rows
+
+
+def mark_outbox_delivered(outbox_ids: Sequence[int]):
+    now = utc_now_iso()
+    with closing(get_conn()) as conn, conn:
+        conn.executemany(
+            "UPDATE outbox SET status = 'delivered', delivered_at = ?, last_error = NULL WHERE id = ?",
+            [(now, outbox_id) for outbox_id in outbox_ids],
+        )
+
+
+def mark_outbox_retry(outbox_id: int, error: str, retry_in_seconds: Optional[int]):
+    """
+    Назначает повторную попытку через retry_in_seconds;
+    None — попытки исчерпаны, сообщение помечается как failed.
+    """
+    with closing(get_conn()) as conn, conn:
+        if retry_in_seconds is None:
+            conn.execute(
+                "UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?",
+                (error, outbox_id),
+            )
+            return
+        next_attempt_at = (datetime.utcnow() + timedelta(seconds=retry_in_seconds)).isoformat(
+            timespec="seconds"
+        )
+        conn.execute(
+            "UPDATE outbox SET next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (next_attempt_at, error, outbox_id),
+        )
+
+
+def purge_delivered_outbox(max_age_days: int = 7) -> int:
+    threshold = (datetime.utcnow() - timedelta(days=max_age_days)).isoformat(timespec="seconds")
+    with closing(get_conn()) as conn, conn:
+        cursor = conn.execute(
+            "DELETE FROM outbox WHERE status = 'delivered' AND delivered_at < ?",
+            (threshold,),
+        )
+        return cursor.rowcount
+
+
+# Leases ----------------------------------------------------------------------
+
+
+def acquire_lease(name: str, holder: str, ttl_seconds: int) -> bool:
+    """
+    Берёт или продлевает аренду name на ttl_seconds.
+    Возвращает False, если аренду держит другой процесс и она ещё не истекла.
+    """
+    now = datetime.utcnow()
+    now_iso = now.isoformat(timespec="seconds")
+    expires_at = (now + timedelta(seconds=ttl_seconds)).isoformat(timespec="seconds")
+    with closing(get_conn()) as conn, conn:
+        cursor = conn.execute(
+            """
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at <= ?
+            """,
+            (name, holder, expires_at, now_iso),
+        )
+        return cursor.rowcount > 0
+
+
+def release_lease(name: str, holder: str):
+    with closing(get_conn()) as conn, conn:
+        conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+
+# Table versions --------------------------------------------------------------
+
+
+def get_table_versions(tables: Sequence[str]) -> Dict[str, dict]:
+    """
+    Текущие версии таблиц: {name: {"version": ..., "updated_at": ...}}.
+    Версия растёт при каждой записи в таблицу (см. триггеры в init_db).
+    """
+    placeholders = ",".join("?" for _ in tables)
+    with closing(get_conn()) as conn:
+        rows = conn.execute(
+            f"SELECT name, version, updated_at FROM table_versions WHERE name IN ({placeholders})",
+            tuple(tables),
+        ).fetchall()
+    return {row["name"]: {"version": row["version"], "updated_at": row["updated_at"]} for row in rows}
+
+
+# Daily stats -----------------------------------------------------------------
+
+# Метрики daily_stats. Для статусов значение за день — чистое изменение
+# (+1 новому статусу, -1 прежнему), итог — сумма за все дни. Остальные
+# метрики — число существующих строк с данным днём в столбце-дате.
+STAT_EMPLOYMENTS_STATUS = "employments_status:"
+STAT_APPEALS_STATUS = "appeals_status:"
+STAT_COMPANIES_KYC = "companies_kyc:"
+STAT_MASTERS_REGISTERED = "masters_registered"  # по дню created_at
+STAT_COMPANIES_REGISTERED = "companies_registered"  # по дню created_at
+STAT_APPEALS_CREATED = "appeals_created"  # по дню created_at
+STAT_APPEALS_PENDING = "appeals_pending"  # ожидающие ответа компании, по дню created_at
+STAT_SUBSCRIPTIONS_EXPIRE = "subscriptions_expire"  # по дню subscription_until
+
+_TODAY_SQL = "strftime('%Y-%m-%d', 'now')"
+
+
+def _day_sql(column: str) -> str:
+    return f"COALESCE(substr({column}, 1, 10), {_TODAY_SQL})"
+
+
+def _stat_delta(metric_sql: str, day_sql: str, delta: int, when: str = "1") -> str:
+    return f"""
+        INSERT INTO daily_stats (metric, day, value)
+        SELECT {metric_sql}, {day_sql}, {delta} WHERE {when}
+        ON CONFLICT(metric, day) DO UPDATE SET value = value + excluded.value;"""
+
+
+def _status_triggers(table: str, column: str, prefix: str) -> List[Tuple[str, str, List[str]]]:
+    def metric(row: str) -> str:
+        return f"'{prefix}' || COALESCE({row}.{column}, '')"
+
+    return [
+        (
+            f"trg_{table}_stats_{column}_insert",
+            f"AFTER INSERT ON {table}",
+            [_stat_delta(metric("NEW"), _TODAY_SQL, 1)],
+        ),
+        (
+            f"trg_{table}_stats_{column}_update",
+            f"AFTER UPDATE OF {column} ON {table} WHEN OLD.{column} IS NOT NEW.{column}",
+            [_stat_delta(metric("OLD"), _TODAY_SQL, -1), _stat_delta(metric("NEW"), _TODAY_SQL, 1)],
+        ),
+        (
+            f"trg_{table}_stats_{column}_delete",
+            f"AFTER DELETE ON {table}",
+            [_stat_delta(metric("OLD"), _TODAY_SQL, -1)],
+        ),
+    ]
+
+
+def _day_keyed_triggers(
+    table: str, metric: str, day_column: str, when: str = "1", columns: Sequence[str] = ()
+) -> List[Tuple[str, str, List[str]]]:
+    """
+    Триггеры метрики «число строк по дню day_column», удовлетворяющих when
+    ({row} — NEW или OLD). columns — столбцы, от которых зависит метрика.
+    """
+    columns = [day_column, *columns]
+    changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in columns)
+
+    def delta(row: str, value: int) -> str:
+        return _stat_delta(f"'{metric}'", _day_sql(f"{row}.{day_column}"), value, when.format(row=row))
+
+    return [
+        (f"trg_{table}_stats_{metric}_insert", f"AFTER INSERT ON {table}", [delta("NEW", 1)]),
+        (
+            f"trg_{table}_stats_{metric}_update",
+            f"AFTER UPDATE OF {', '.join(columns)} ON {table} WHEN {changed}",
+            [delta("OLD", -1), delta("NEW", 1)],
+        ),
+        (f"trg_{table}_stats_{metric}_delete", f"AFTER DELETE ON {table}", [delta("OLD", -1)]),
+    ]
+
+
+_PENDING_APPEAL = "{row}.status = 'pending_company_response'"
+_HAS_SUBSCRIPTION = "COALESCE({row}.subscription_until, '') != ''"
+
+_DAILY_STATS_TRIGGERS: List[Tuple[str, str, List[str]]] = [
+    *_status_triggers("employments", "status", STAT_EMPLOYMENTS_STATUS),
+    *_status_triggers("review_appeals", "status", STAT_APPEALS_STATUS),
+    *_status_triggers("companies", "kyc_status", STAT_COMPANIES_KYC),
+    *_day_keyed_triggers("masters", STAT_MASTERS_REGISTERED, "created_at"),
+    *_day_keyed_triggers("companies", STAT_COMPANIES_REGISTERED, "created_at"),
+    *_day_keyed_triggers("companies", STAT_SUBSCRIPTIONS_EXPIRE, "subscription_until", _HAS_SUBSCRIPTION),
+    *_day_keyed_triggers("review_appeals", STAT_APPEALS_CREATED, "created_at"),
+    *_day_keyed_triggers("review_appeals", STAT_APPEALS_PENDING, "created_at", _PENDING_APPEAL, ["status"]),
+]
+
+
+def _rebuild_daily_stats(conn: sqlite3.Connection):
+    """
+    Пересчитывает daily_stats по текущим данным. Итоги по статусам
+    записываются на сегодняшний день: история их изменений не восстанавливается.
+    """
+    conn.execute("DELETE FROM daily_stats")
+    for metric_sql, day_sql, source in (
+        (f"'{STAT_EMPLOYMENTS_STATUS}' || COALESCE(status, '')", _TODAY_SQL, "employments"),
+        (f"'{STAT_APPEALS_STATUS}' || COALESCE(status, '')", _TODAY_SQL, "review_appeals"),
+        (f"'{STAT_COMPANIES_KYC}' || COALESCE(kyc_status, '')", _TODAY_SQL, "companies"),
+        (f"'{STAT_MASTERS_REGISTERED}'", _day_sql("created_at"), "masters"),
+        (f"'{STAT_COMPANIES_REGISTERED}'", _day_sql("created_at"), "companies"),
+        (f"'{STAT_APPEALS_CREATED}'", _day_sql("created_at"), "review_appeals"),
+        (
+            f"'{STAT_APPEALS_PENDING}'",
+            _day_sql("created_at"),
+            f"review_appeals WHERE {_PENDING_APPEAL.format(row='review_appeals')}",
+        ),
+        (
+            f"'{STAT_SUBSCRIPTIONS_EXPIRE}'",
+            _day_sql("subscription_until"),
+            f"companies WHERE {_HAS_SUBSCRIPTION.format(row='companies')}",
+        ),
+    ):
+        conn.execute(
+            f"""
+            INSERT INTO daily_stats (metric, day, value)
+            SELECT metric, day, COUNT(*) FROM (
+                SELECT {metric_sql} AS metric, {day_sql} AS day FROM {source}
+            )
+            GROUP BY metric, day
+            ON CONFLICT(metric, day) DO UPDATE SET value = value + excluded.value
+            """
+        )
+
+
+def rebuild_daily_stats():
+    """Пересчитывает сводную статистику админки заново (backfill)."""
+    with closing(get_conn()) as conn, conn:
+        _rebuild_daily_stats(conn)
+
+
+def get_stat_totals(prefix: str) -> Dict[str, int]:
+    """Итоги метрик с префиксом prefix: {часть после префикса: значение}."""
+    with closing(get_conn()) as conn:
+        rows = conn.execute(
+            """
+            SELECT metric, SUM(value) AS value FROM daily_stats
+            WHERE metric >= ? AND metric < ?
+            GROUP BY metric
+            """,
+            (prefix, prefix + "\uffff"),
+        ).fetchall()
+    return {row["metric"][len(prefix):]: row["value"] for row in rows if row["value"]}
+
+
+def get_stat_sum(metric: str, since_day: str = "", until_day: str = "9999-12-31") -> int:
+    """Сумма метрики за дни since_day..until_day включительно (YYYY-MM-DD)."""
+    with closing(get_conn()) as conn:
+        row = conn.execute(
+            "SELECT COALESCE(SUM(value), 0) FROM daily_stats WHERE metric = ? AND day >= ? AND day <= ?",
+            (metric, since_day, until_day),
+        ).fetchone()
+    return row[0]
+
+
+def get_daily_stats(metrics: Sequence[str], since_day: str = "") -> List[dict]:
+    """Значения метрик по дням, начиная с since_day (YYYY-MM-DD)."""
+    placeholders = ",".join("?" for _ in metrics)
+    with closing(get_conn()) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT metric, day, value FROM daily_stats
+            WHERE metric IN ({placeholders}) AND day >= ?
+            ORDER BY metric, day
+            """,
+            (*metrics, since_day),
+        ).fetchall()
+    return [dict(row) for row in rows]
@@ -0,0 +1,169 @@
+"""
+Асинхронный фасад над db.py и states.
+
+Каждый запрос выполняется в выделенном пуле потоков, поэтому медленный запрос
+не останавливает цикл событий aiogram. Синхронный API db.py и states
+остаётся доступным для скриптов и админ-панели.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional
+
+import db
+import states
+from config import DB_EXECUTOR_WORKERS
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    executor = _executor
+    if executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=max(DB_EXECUTOR_WORKERS, 1),
+                    thread_name_prefix="db",
+                )
+            executor = _executor
+    return executor
+
+
+def shutdown_db_executor(wait: bool = True) -> None:
+    """Останавливает пул потоков БД (вызывается при завершении бота)."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Выполняет синхронную функцию работы с БД в пуле потоков и ждёт результат."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+def _awaitable(func: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+
+    return wrapper
+
+
+# Users -----------------------------------------------------------------------
+
+get_or_create_user = _awaitable(db.get_or_create_user)
+get_user = _awaitable(db.get_user)
+set_user_role = _awaitable(db.set_user_role)
+set_user_phone = _awaitable(db.set_user_phone)
+
+# Companies & Masters ---------------------------------------------------------
+
+create_company = _awaitable(db.create_company)
+create_master = _awaitable(db.create_master)
+get_company_by_user = _awaitable(db.get_company_by_user)
+get_master_by_user = _awaitable(db.get_master_by_user)
+get_company_by_public_id = _awaitable(db.get_company_by_public_id)
+get_master_by_public_id = _awaitable(db.get_master_by_public_id)
+get_company_by_id = _awaitable(db.get_company_by_id)
+get_master_by_id = _awaitable(db.get_master_by_id)
+decrypt_master_passport = _awaitable(db.decrypt_master_passport)
+get_company_requests_count = _awaitable(db.get_company_requests_count)
+get_company_leave_requests_count = _awaitable(db.get_company_leave_requests_count)
+get_company_menu_counters = _awaitable(db.get_company_menu_counters)
+create_company_verification = _awaitable(db.create_company_verification)
+get_company_verification_by_company_id = _awaitable(db.get_company_verification_by_company_id)
+set_company_subscription = _awaitable(db.set_company_subscription)
+update_company_name = _awaitable(db.update_company_name)
+set_master_passport_locked = _awaitable(db.set_master_passport_locked)
+update_master_profile = _awaitable(db.update_master_profile)
+
+# Master public profile snapshots ----------------------------------------------
+
+get_master_profile_snapshot = _awaitable(db.get_master_profile_snapshot)
+save_master_profile_snapshot = _awaitable(db.save_master_profile_snapshot)
+
+# Employments -----------------------------------------------------------------
+
+get_company_employments = _awaitable(db.get_company_employments)
+get_company_ended_employments = _awaitable(db.get_company_ended_employments)
+get_current_employment = _awaitable(db.get_current_employment)
+auto_close_leave_requests = _awaitable(db.auto_close_leave_requests)
+has_any_current_employment = _awaitable(db.has_any_current_employment)
+has_pending_or_active_employment = _awaitable(db.has_pending_or_active_employment)
+has_pending_request_for_company = _awaitable(db.has_pending_request_for_company)
+create_employment = _awaitable(db.create_employment)
+get_pending_employments_for_company = _awaitable(db.get_pending_employments_for_company)
+get_pending_leave_requests_for_company = _awaitable(db.get_pending_leave_requests_for_company)
+get_employment_by_id = _awaitable(db.get_employment_by_id)
+set_employment_accepted = _awaitable(db.set_employment_accepted)
+set_employment_rejected = _awaitable(db.set_employment_rejected)
+set_employment_leave_requested = _awaitable(db.set_employment_leave_requested)
+get_leave_request_times = _awaitable(db.get_leave_request_times)
+cancel_employment_leave_request = _awaitable(db.cancel_employment_leave_request)
+end_employment = _awaitable(db.end_employment)
+
+# Temporary collaborations ----------------------------------------------------
+
+create_fast_connect_invite = _awaitable(db.create_fast_connect_invite)
+get_fast_connect_invite_by_token = _awaitable(db.get_fast_connect_invite_by_token)
+mark_fast_connect_invite_used = _awaitable(db.mark_fast_connect_invite_used)
+get_active_temporary_collaboration = _awaitable(db.get_active_temporary_collaboration)
+create_temporary_collaboration = _awaitable(db.create_temporary_collaboration)
+get_company_temporary_collaborations = _awaitable(db.get_company_temporary_collaborations)
+get_temporary_collaboration_by_id = _awaitable(db.get_temporary_collaboration_by_id)
+close_temporary_collaboration = _awaitable(db.close_temporary_collaboration)
+
+# Reviews ---------------------------------------------------------------------
+
+create_review = _awaitable(db.create_review)
+get_reviews_for_master = _awaitable(db.get_reviews_for_master)
+get_master_rating = _awaitable(db.get_master_rating)
+get_reviews_for_employment = _awaitable(db.get_reviews_for_employment)
+get_review_by_id = _awaitable(db.get_review_by_id)
+delete_review = _awaitable(db.delete_review)
+
+# Appeals ---------------------------------------------------------------------
+
+create_review_appeal = _awaitable(db.create_review_appeal)
+get_active_appeal_for_review_and_master = _awaitable(db.get_active_appeal_for_review_and_master)
+can_master_appeal_review = _awaitable(db.can_master_appeal_review)
+get_pending_company_appeals = _awaitable(db.get_pending_company_appeals)
+get_review_appeal_by_id = _awaitable(db.get_review_appeal_by_id)
+get_pending_review_appeals = _awaitable(db.get_pending_review_appeals)
+get_pending_review_appeal_times = _awaitable(db.get_pending_review_appeal_times)
+set_review_appeal_master_files = _awaitable(db.set_review_appeal_master_files)
+mark_review_appeal_reminder_sent = _awaitable(db.mark_review_appeal_reminder_sent)
+mark_review_appeal_auto_removed = _awaitable(db.mark_review_appeal_auto_removed)
+update_review_appeal_company_response = _awaitable(db.update_review_appeal_company_response)
+process_due_review_appeals = _awaitable(db.process_due_review_appeals)
+purge_appeal_events = _awaitable(db.purge_appeal_events)
+
+# Outbox ----------------------------------------------------------------------
+
+add_outbox_message = _awaitable(db.add_outbox_message)
+claim_outbox_batch = _awaitable(db.claim_outbox_batch)
+mark_outbox_delivered = _awaitable(db.mark_outbox_delivered)
+mark_outbox_retry = _awaitable(db.mark_outbox_retry)
+purge_delivered_outbox = _awaitable(db.purge_delivered_outbox)
+
+# Leases ----------------------------------------------------------------------
+
+acquire_lease = _awaitable(db.acquire_lease)
+release_lease = _awaitable(db.release_lease)
+
+# User states -----------------------------------------------------------------
+
+get_state = _awaitable(states.get_state)
+set_state = _awaitable(states.set_state)
+pop_state = _awaitable(states.pop_state)
+clear_expired_states = _awaitable(states.clear_expired_states)
+get_oldest_state_created_at = _awaitable(states.get_oldest_state_created_at)
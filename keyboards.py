@@ -2,7 +2,6 @@ from typing import List, Optional
 
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from db import get_company_requests_count, get_company_leave_requests_count
 
 
 def role_keyboard():
@@ -26,7 +25,9 @@ def master_menu_kb():
     return kb.as_markup()
 
 
-def company_menu_kb(company_id: Optional[int] = None):
+def company_menu_kb(counters: Optional[dict] = None):
+    """counters — результат get_company_menu_counters (запросы, увольнения, жалобы)."""
+    counters = counters or {}
     kb = InlineKeyboardBuilder()
     kb.button(text="Профиль компании", callback_data="company_profile")
     kb.button(text="Изменить профиль", callback_data="company_edit_profile")
@@ -36,14 +37,15 @@ def company_menu_kb(company_id: Optional[int] = None):
     kb.button(text="Проверить сотрудника по ID", callback_data="company_check_master")
 
     label = "Запросы"
-    if company_id is not None:
-        total = get_company_requests_count(company_id)
-        total += get_company_leave_requests_count(company_id)
-        if total > 0:
-            label = f"Запросы ({total})"
+    total = counters.get("requests", 0) + counters.get("leave_requests", 0)
+    if total > 0:
+        label = f"Запросы ({total})"
     kb.button(text=label, callback_data="company_view_requests")
 
-    kb.button(text="Жалобы на отзывы", callback_data="company_view_appeals")
+    label = "Жалобы на отзывы"
+    if counters.get("appeals", 0) > 0:
+        label = f"Жалобы на отзывы ({counters['appeals']})"
+    kb.button(text=label, callback_data="company_view_appeals")
     kb.button(text="Верификация компании", callback_data="company_verification")
     kb.button(text="Подписка и оплата", callback_data="company_subscription")
     kb.button(text="Поддержка", callback_data="company_support")
@@ -113,7 +115,7 @@ def company_ended_list_button_kb():
     return kb.as_markup()
 
 
-def company_ended_employees_kb(employments: List[dict], next_offset: Optional[int] = None):
+def company_ended_employees_kb(employments: List[dict], has_more: bool = False):
     kb = InlineKeyboardBuilder()
     for e in employments:
         ended_at = e.get("ended_at") or "-"
@@ -122,8 +124,13 @@ def company_ended_employees_kb(employments: List[dict], next_offset: Optional[in
             text=text,
             callback_data=f"company_ended_employee_{e['id']}",
         )
-    if next_offset is not None:
-        kb.button(text="Показать ещё", callback_data=f"company_ended_list_{next_offset}")
+    if has_more and employments:
+        # Курсор следующей страницы — (ended_at, id) последней показанной строки
+        last = employments[-1]
+        kb.button(
+            text="Показать ещё",
+            callback_data=f"company_ended_list_{last['ended_at'] or ''}_{last['id']}",
+        )
     kb.adjust(1)
     return kb.as_markup()
 
@@ -0,0 +1,116 @@
+"""
+Служебные команды для обслуживания базы данных.
+
+Примеры:
+    python manage.py ratings rebuild   # пересчитать рейтинги исполнителей
+    python manage.py ratings verify    # сверить сохранённые рейтинги с отзывами
+    python manage.py indexes check     # проверить планы SQL-запросов
+    python manage.py stats rebuild     # пересчитать сводную статистику админки
+"""
+import argparse
+import sys
+from contextlib import closing
+
+from db import (
+    close_pool,
+    get_conn,
+    init_db,
+    rebuild_daily_stats,
+    rebuild_master_ratings,
+    verify_master_ratings,
+)
+from query_plans import check_query_plans
+
+
+def cmd_ratings_rebuild(args: argparse.Namespace) -> int:
+    updated = rebuild_master_ratings()
+    print(f"Рейтинги пересчитаны: {updated} исполнителей")
+    return 0
+
+
+def cmd_ratings_verify(args: argparse.Namespace) -> int:
+    mismatches = verify_master_ratings()
+    if not mismatches:
+        print("Расхождений в рейтингах нет")
+        return 0
+
+    print(f"Найдено расхождений: {len(mismatches)}")
+    for row in mismatches:
+        print(
+            f"  {row['public_id'] or row['id']}: сохранено {row['ratings_sum']}/{row['ratings_count']}, "
+            f"по отзывам {row['actual_sum']}/{row['actual_count']}"
+        )
+    print("Для исправления выполните: python manage.py ratings rebuild")
+    return 1
+
+
+def cmd_indexes_check(args: argparse.Namespace) -> int:
+    with closing(get_conn()) as conn:
+        plans = check_query_plans(conn)
+
+    failed = 0
+    for plan in plans:
+        where = f"{plan.module}:{plan.lineno} {plan.function}"
+        if plan.error:
+            failed += 1
+            print(f"ОШИБКА {where}: {plan.error}")
+        elif plan.problems and plan.allowed_reason:
+            if args.verbose:
+                print(f"допустимо {where}: {'; '.join(plan.problems)} ({plan.allowed_reason})")
+        elif plan.problems:
+            failed += 1
+            print(f"ПЛОХОЙ ПЛАН {where}: {'; '.join(plan.problems)}")
+            if args.verbose:
+                print("    " + " ".join(plan.sql.split()))
+
+    print(f"Проверено запросов: {len(plans)}, с проблемами: {failed}")
+    return 1 if failed else 0
+
+
+def cmd_stats_rebuild(args: argparse.Namespace) -> int:
+    rebuild_daily_stats()
+    print("Сводная статистика пересчитана")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных «Белого списка»")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ratings = commands.add_parser("ratings", help="Денормализованные рейтинги исполнителей")
+    ratings_commands = ratings.add_subparsers(dest="ratings_command", required=True)
+    ratings_commands.add_parser(
+        "rebuild", help="Пересчитать рейтинги по таблице reviews"
+    ).set_defaults(func=cmd_ratings_rebuild)
+    ratings_commands.add_parser(
+        "verify", help="Сверить рейтинги с таблицей reviews"
+    ).set_defaults(func=cmd_ratings_verify)
+
+    indexes = commands.add_parser("indexes", help="Индексы и планы запросов")
+    indexes_commands = indexes.add_subparsers(dest="indexes_command", required=True)
+    check = indexes_commands.add_parser(
+        "check", help="Проверить, что запросы не читают таблицы целиком и не сортируют во временных B-деревьях"
+    )
+    check.add_argument("-v", "--verbose", action="store_true", help="Показать допустимые исключения и SQL")
+    check.set_defaults(func=cmd_indexes_check)
+
+    stats = commands.add_parser("stats", help="Сводная статистика админки (таблица daily_stats)")
+    stats_commands = stats.add_subparsers(dest="stats_command", required=True)
+    stats_commands.add_parser(
+        "rebuild", help="Пересчитать статистику по текущим данным"
+    ).set_defaults(func=cmd_stats_rebuild)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    init_db()
+    try:
+        return args.func(args)
+    finally:
+        close_pool()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,8 @@
+"""
+Middleware для диспетчера aiogram
+"""
+from .request_context import RequestContextMiddleware
+
+__all__ = [
+    "RequestContextMiddleware",
+]
@@ -0,0 +1,48 @@
+"""
+Загрузка контекста пользователя один раз на апдейт
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from db import get_user_context
+from db_async import run_db
+from states import get_state
+
+
+def load_request_context(
+    tg_id: int,
+    username: Optional[str],
+    first_name: Optional[str],
+) -> Dict[str, Any]:
+    context = get_user_context(tg_id, username, first_name)
+    context["pending_state"] = get_state(tg_id)
+    return context
+
+
+class RequestContextMiddleware(BaseMiddleware):
+    """
+    Внешний middleware: за один поход в пул потоков БД загружает строку users,
+    роль, профиль исполнителя/компании и текущее состояние пользователя
+    и передаёт их обработчикам как `user`, `role`, `master`, `company`
+    и `pending_state`.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user: Optional[User] = data.get("event_from_user")
+        if from_user is not None:
+            context = await run_db(
+                load_request_context,
+                from_user.id,
+                from_user.username,
+                from_user.first_name,
+            )
+            data.update(context)
+            data["role"] = context["user"]["role"] if context["user"] else None
+        return await handler(event, data)
@@ -0,0 +1,411 @@
+"""
+Очередь исходящих уведомлений.
+
+Обработчики ставят сообщение в очередь через notifier.enqueue(...) и сразу
+отвечают пользователю, а отправку выполняют фоновые воркеры с учётом лимитов
+Telegram: не больше NOTIFY_GLOBAL_RATE сообщений в секунду на бота и не чаще
+одного сообщения в NOTIFY_PER_CHAT_INTERVAL секунд в один чат.
+
+Слот отправки в чат резервируется при постановке в очередь, поэтому воркер
+не простаивает из-за одного «занятого» чата, а сообщения в один чат уходят
+в порядке постановки. Общий лимит на бота соблюдается в момент отправки.
+
+Уведомления, которые нельзя потерять при падении процесса, пишутся в таблицу
+outbox в одной транзакции с изменением данных; OutboxDispatcher забирает их
+пачками, отправляет через ту же очередь и отмечает доставленными (доставка
+«хотя бы один раз»).
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar, Union
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import Message
+
+from config import (
+    NOTIFY_GLOBAL_RATE,
+    NOTIFY_MAX_ATTEMPTS,
+    NOTIFY_PER_CHAT_INTERVAL,
+    NOTIFY_WORKERS,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_CONCURRENCY,
+    OUTBOX_LEASE_SECONDS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_RETRY_BASE_SECONDS,
+)
+from db_async import claim_outbox_batch, mark_outbox_delivered, mark_outbox_retry
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых отправку имеет смысл повторить
+_TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError)
+
+T = TypeVar("T")
+
+
+@dataclass
+class FanOutStats:
+    sent: int = 0
+    failed: int = 0
+    # Время от вызова send(item) до результата; для очереди уведомлений
+    # сюда входит и ожидание своей очереди, и повторы
+    durations: List[float] = field(default_factory=list)
+
+    @property
+    def avg_duration(self) -> float:
+        return sum(self.durations) / len(self.durations) if self.durations else 0.0
+
+    @property
+    def max_duration(self) -> float:
+        return max(self.durations, default=0.0)
+
+
+async def fan_out(
+    items: Iterable[T],
+    send: Callable[[T], Awaitable[Any]],
+    limit: int,
+) -> Tuple[List[Any], FanOutStats]:
+    """
+    Выполняет send(item) для всех items параллельно, но не больше limit
+    одновременно. Ошибка одного элемента не прерывает остальные: вместо
+    результата в списке окажется исключение. Неудачей считается и исключение
+    (выброшенное или возвращённое — так очередь сообщает об ошибке отправки),
+    и результат None (сообщение снято с очереди при остановке).
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max(limit, 1))
+    stats = FanOutStats()
+
+    async def run(item: T) -> Any:
+        async with semaphore:
+            started = loop.time()
+            try:
+                result = await send(item)
+            except Exception as e:
+                logger.exception("Ошибка при параллельной отправке")
+                result = e
+            stats.durations.append(loop.time() - started)
+        if result is None or isinstance(result, Exception):
+            stats.failed += 1
+        else:
+            stats.sent += 1
+        return result
+
+    results = await asyncio.gather(*(run(item) for item in items))
+    return results, stats
+
+
+@dataclass(order=True)
+class _Outgoing:
+    due: float
+    seq: int
+    chat_id: int = field(compare=False)
+    text: str = field(compare=False)
+    kwargs: Dict[str, Any] = field(compare=False)
+    future: "asyncio.Future[Union[Message, Exception, None]]" = field(compare=False)
+    failure_log: Tuple[Any, ...] = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+class NotificationQueue:
+    def __init__(
+        self,
+        workers: int = NOTIFY_WORKERS,
+        global_rate: float = NOTIFY_GLOBAL_RATE,
+        per_chat_interval: float = NOTIFY_PER_CHAT_INTERVAL,
+        max_attempts: int = NOTIFY_MAX_ATTEMPTS,
+    ):
+        self._workers_count = max(workers, 1)
+        self._global_interval = 1.0 / global_rate if global_rate > 0 else 0.0
+        self._per_chat_interval = max(per_chat_interval, 0.0)
+        self._max_attempts = max(max_attempts, 1)
+
+        self._bot: Optional[Bot] = None
+        self._heap: List[_Outgoing] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        self._in_progress = 0
+
+        self._global_next = 0.0
+        self._chat_next: Dict[int, float] = {}
+        # Очередь родительского процесса, если этот процесс — воркер (см. forward_to)
+        self._forward: Any = None
+
+    @property
+    def pending(self) -> int:
+        """Сколько сообщений ещё не отправлено (в очереди и в процессе отправки)."""
+        return len(self._heap) + self._in_progress
+
+    def forward_to(self, queue: Any) -> None:
+        """
+        Режим воркера при BOT_WORKERS > 1: сообщения не отправляются в этом
+        процессе, а передаются в queue родителю. Лимиты на бота и на чат
+        соблюдает одна очередь в родителе, а не каждая копия отдельно.
+        """
+        self._forward = queue
+
+    def start(self, bot: Bot) -> None:
+        """Запускает воркеры отправки (вызывается из main бота)."""
+        if self._workers:
+            return
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"notify-{i}")
+            for i in range(self._workers_count)
+        ]
+        self._wakeup.set()
+
+    async def stop(self, timeout: float = 10.0) -> int:
+        """
+        Ждёт отправки очереди не дольше timeout секунд и останавливает воркеры.
+        Возвращает количество неотправленных сообщений.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.pending and self._workers and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        dropped = len(self._heap)
+        for item in self._heap:
+            if not item.future.done():
+                item.future.set_result(None)
+        self._heap.clear()
+        return dropped
+
+    def enqueue(
+        self,
+        chat_id: int,
+        text: str,
+        *,
+        failure_log: Optional[Tuple[Any, ...]] = None,
+        **kwargs: Any,
+    ) -> "asyncio.Future[Union[Message, Exception, None]]":
+        """
+        Ставит сообщение в очередь и сразу возвращает управление.
+
+        kwargs передаются в bot.send_message. failure_log — аргументы для
+        logger.exception на случай, если сообщение так и не удалось отправить.
+        Возвращает future с отправленным Message, исключением последней
+        попытки, если отправить не удалось, или None, если очередь остановлена
+        раньше (и сразу None, если сообщение передано родителю, см. forward_to);
+        ждать его не обязательно.
+        """
+        loop = asyncio.get_running_loop()
+        if failure_log is None:
+            failure_log = ("Не удалось отправить уведомление в чат %s", chat_id)
+        if self._forward is not None:
+            self._forward.put((chat_id, text, failure_log, kwargs))
+            future = loop.create_future()
+            future.set_result(None)
+            return future
+        item = _Outgoing(
+            due=self._reserve_slot(chat_id, loop.time()),
+            seq=next(self._seq),
+            chat_id=chat_id,
+            text=text,
+            kwargs=kwargs,
+            future=loop.create_future(),
+            failure_log=failure_log,
+        )
+        self._push(item)
+        return item.future
+
+    def _reserve_slot(self, chat_id: int, now: float, not_before: float = 0.0) -> float:
+        due = max(now, not_before, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = due + self._per_chat_interval
+        if len(self._chat_next) > 10000:
+            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+        return due
+
+    def _push(self, item: _Outgoing) -> None:
+        heapq.heappush(self._heap, item)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _next_due(self) -> _Outgoing:
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = None
+            if self._heap:
+                delay = self._heap[0].due - loop.time()
+                if delay <= 0:
+                    return heapq.heappop(self._heap)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self._next_due()
+            self._in_progress += 1
+            try:
+                await self._send(item)
+            finally:
+                self._in_progress -= 1
+
+    async def _wait_global_slot(self) -> None:
+        # Общий лимит проверяется в момент отправки: сообщение, отложенное
+        # лимитом своего чата, не должно задерживать сообщения в другие чаты
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._global_next)
+        self._global_next = slot + self._global_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _send(self, item: _Outgoing) -> None:
+        loop = asyncio.get_running_loop()
+        await self._wait_global_slot()
+        item.attempts += 1
+        try:
+            message = await self._bot.send_message(item.chat_id, item.text, **item.kwargs)
+        except TelegramRetryAfter as e:
+            if item.attempts < self._max_attempts:
+                logger.warning(
+                    "Telegram просит подождать %s с перед отправкой в чат %s",
+                    e.retry_after,
+                    item.chat_id,
+                )
+                self._retry(item, loop.time() + e.retry_after)
+                return
+            self._fail(item, e)
+        except _TRANSIENT_ERRORS as e:
+            if item.attempts < self._max_attempts:
+                self._retry(item, loop.time() + 2 ** item.attempts)
+                return
+            self._fail(item, e)
+        except Exception as e:
+            self._fail(item, e)
+        else:
+            if not item.future.done():
+                item.future.set_result(message)
+
+    def _retry(self, item: _Outgoing, not_before: float) -> None:
+        loop = asyncio.get_running_loop()
+        item.due = self._reserve_slot(item.chat_id, loop.time(), not_before)
+        item.seq = next(self._seq)
+        self._push(item)
+
+    def _fail(self, item: _Outgoing, error: Exception) -> None:
+        logger.exception(*item.failure_log)
+        # Исключение возвращается результатом, а не через set_exception: future
+        # обычно никто не ждёт, и asyncio ругался бы на неполученную ошибку
+        if not item.future.done():
+            item.future.set_result(error)
+
+
+class OutboxDispatcher:
+    def __init__(
+        self,
+        queue: NotificationQueue,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        concurrency: int = OUTBOX_CONCURRENCY,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+        lease_seconds: int = OUTBOX_LEASE_SECONDS,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        retry_base_seconds: int = OUTBOX_RETRY_BASE_SECONDS,
+    ):
+        self._queue = queue
+        self._batch_size = max(batch_size, 1)
+        self._concurrency = max(concurrency, 1)
+        self._poll_interval = poll_interval
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max(max_attempts, 1)
+        self._retry_base_seconds = retry_base_seconds
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="outbox")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self) -> None:
+        """Сообщает, что в outbox появились сообщения (не ждать poll_interval)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                claimed = await self.dispatch_once()
+            except Exception:
+                logger.exception("Ошибка при доставке сообщений из outbox")
+                claimed = 0
+            if claimed >= self._batch_size:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch_once(self) -> int:
+        """
+        Отправляет одну пачку сообщений из outbox.
+        Возвращает количество взятых в работу сообщений.
+        """
+        rows = await claim_outbox_batch(self._batch_size, self._lease_seconds)
+        if not rows:
+            return 0
+
+        results, stats = await fan_out(
+            rows,
+            lambda row: self._queue.enqueue(
+                row["chat_id"],
+                row["text"],
+                failure_log=("Не удалось доставить сообщение outbox #%s", row["id"]),
+            ),
+            self._concurrency,
+        )
+        logger.info(
+            "Outbox: отправлено %s, не отправлено %s, время доставки (с ожиданием в очереди) "
+            "%.2f с в среднем, %.2f с максимум",
+            stats.sent,
+            stats.failed,
+            stats.avg_duration,
+            stats.max_duration,
+        )
+
+        ok = [message is not None and not isinstance(message, Exception) for message in results]
+        delivered = [row["id"] for row, sent in zip(rows, ok) if sent]
+        if delivered:
+            await mark_outbox_delivered(delivered)
+        for row, result, sent in zip(rows, results, ok):
+            if sent:
+                continue
+            if row["attempts"] >= self._max_attempts:
+                retry_in = None
+            else:
+                retry_in = min(self._retry_base_seconds * 2 ** (row["attempts"] - 1), 3600)
+            error = repr(result) if isinstance(result, Exception) else "notification queue stopped"
+            await mark_outbox_retry(row["id"], error, retry_in)
+        return len(rows)
+
+
+notifier = NotificationQueue()
+outbox_dispatcher = OutboxDispatcher(notifier)
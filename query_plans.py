@@ -0,0 +1,345 @@
+"""
+Проверка планов SQL-запросов (EXPLAIN QUERY PLAN).
+
+Находит в модулях работы с БД запросы, которые передаются в execute/executemany
+(в том числе собранные из констант модуля, через `+` и из фрагментов, дописанных
+по условиям, — каждый вариант отдельно), и проверяет их планы на текущей схеме:
+запрос не должен читать таблицу целиком (SCAN) или сортировать во временном
+B-дереве (USE TEMP B-TREE). Исключения перечислены в ALLOWED с объяснением;
+execute, текст которого восстановить не удалось, считается ошибкой.
+
+Запускается через `python manage.py indexes check`.
+"""
+import ast
+import os
+import re
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULES = ("db.py", os.path.join("states", "state_manager.py"))
+
+# Допустимые проблемы: (модуль, функция) → причина — для любого плана функции,
+# (модуль, функция, строка плана) — только для этой строки
+ALLOWED: Dict[Tuple[str, ...], str] = {
+    ("db.py", "init_db"): "разовое заполнение пустых столбцов при обновлении схемы",
+    ("db.py", "migrate_legacy_passports"): "разовая миграция всех паспортов",
+    ("db.py", "_rebuild_master_ratings"): "полный пересчёт рейтингов, если master_id не задан",
+    ("db.py", "verify_master_ratings"): "сверка всех исполнителей — полный проход по задумке",
+    ("db.py", "get_appeal_event_bounds"): "sqlite_sequence — по строке на таблицу с AUTOINCREMENT",
+    ("db.py", "get_company_employments"): "status IN (...): сортируются сотрудники одной компании",
+    ("db.py", "get_master_employments"): "сортируются трудоустройства одного исполнителя",
+    ("db.py", "get_current_employment"): "status IN (...): сортируются трудоустройства одного исполнителя",
+    ("db.py", "get_pending_employments_for_company"): (
+        "сортируются заявки одной компании, ожидающие подтверждения"
+    ),
+    ("db.py", "get_company_temporary_collaborations"): (
+        "фильтр status IN (...) и ORDER BY datetime(started_at) по сотрудничествам одной компании"
+    ),
+    ("db.py", "_rebuild_daily_stats"): "полный пересчёт статистики по задумке",
+    ("db.py", "get_review_appeals_page", "SCAN ra USING INDEX idx_review_appeals_created_at"): (
+        "без фильтров очередь читается по индексу в порядке выдачи и останавливается на LIMIT"
+    ),
+}
+
+# Функции, где текст в execute собирается во время работы и не является
+# запросом к данным: (модуль, функция) → что выполняется
+UNRENDERED: Dict[Tuple[str, str], str] = {
+    ("db.py", "_configure_connection"): "PRAGMA из _connection_pragmas()",
+}
+
+# Подстановки для f-строк: выражение внутри {...} → фрагмент SQL
+_FSTRING_SAMPLES = {
+    "placeholders": "?",
+    "master_ids_query": "?",
+    "table": "employments",
+    "', '.join(sets)": "full_name = ?",
+    # _rebuild_daily_stats: одна из строк перечня метрик
+    "metric_sql": "'masters_registered'",
+    "day_sql": "substr(created_at, 1, 10)",
+    "source": "masters",
+}
+
+_STATEMENT_RE = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+# Команды, планы которых не проверяются (схема и настройки соединения)
+_UNCHECKED_RE = re.compile(
+    r"^\s*(CREATE|DROP|ALTER|PRAGMA|ANALYZE|VACUUM|BEGIN|COMMIT|ROLLBACK)\b", re.IGNORECASE
+)
+# Больше вариантов одного запроса не перебираем
+_MAX_VARIANTS = 64
+
+
+@dataclass
+class QueryPlan:
+    module: str
+    function: str
+    lineno: int
+    sql: str
+    plan: List[str] = field(default_factory=list)
+    problems: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def allowed_reason(self) -> Optional[str]:
+        reason = ALLOWED.get((self.module, self.function))
+        if reason is not None or not self.problems:
+            return reason
+        reasons = [ALLOWED.get((self.module, self.function, problem)) for problem in self.problems]
+        if None in reasons:
+            return None
+        return "; ".join(dict.fromkeys(reasons))
+
+# Условие if, под которым дописан фрагмент запроса: (id узла If, ветка)
+_Condition = Tuple[int, str]
+
+
+@dataclass
+class _StringVar:
+    """Строка, собранная в переменную: query = "..."; if ...: query += "..." """
+
+    path: Tuple[_Condition, ...]
+    # Фрагменты: варианты текста и условия, под которыми фрагмент дописан
+    fragments: List[Tuple[List[str], Tuple[_Condition, ...]]]
+
+    def variants(self) -> List[str]:
+        """
+        Запрос без необязательных фрагментов, с каждым из них по отдельности
+        и со всеми сразу (ветки else в последний вариант не входят).
+        """
+        paths = [conditions for _, conditions in self.fragments if conditions]
+        enabled_sets = [set()]
+        enabled_sets += [set(conditions) for conditions in paths]
+        enabled_sets.append({c for conditions in paths for c in conditions if c[1] == "body"})
+        result: List[str] = []
+        for enabled in enabled_sets:
+            texts = [""]
+            for alternatives, conditions in self.fragments:
+                if set(conditions) <= enabled:
+                    texts = _combine(texts, alternatives)
+            result.extend(texts)
+        return _unique(result)
+
+
+def _unique(texts: List[str]) -> List[str]:
+    return list(dict.fromkeys(texts))[:_MAX_VARIANTS]
+
+
+def _combine(left: List[str], right: List[str]) -> List[str]:
+    return _unique([a + b for a in left for b in right])
+
+
+def _render(node: ast.AST, strings: Dict[str, "_StringVar"]) -> Optional[List[str]]:
+    """Варианты текста выражения или None, если его не восстановить."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, ast.JoinedStr):
+        texts = [""]
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                texts = _combine(texts, [value.value])
+                continue
+            part = None
+            if isinstance(value.value, ast.Name) and value.value.id in strings:
+                part = strings[value.value.id].variants()
+            sample = _FSTRING_SAMPLES.get(ast.unparse(value.value))
+            if sample is not None:
+                part = [sample]
+            if part is None:
+                return None
+            texts = _combine(texts, part)
+        return texts
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left = _render(node.left, strings)
+        right = _render(node.right, strings)
+        if left is None or right is None:
+            return None
+        return _combine(left, right)
+    if isinstance(node, ast.Name) and node.id in strings:
+        return strings[node.id].variants()
+    return None
+
+
+def _leading_text(node: ast.AST) -> str:
+    """Начало литерала запроса — по нему видно, что это за команда."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr) and node.values and isinstance(node.values[0], ast.Constant):
+        return node.values[0].value
+    if isinstance(node, ast.BinOp):
+        return _leading_text(node.left)
+    return ""
+
+
+def _module_strings(tree: ast.Module) -> Dict[str, _StringVar]:
+    """Строковые константы модуля (например, _MASTER_RATING_DELTA_SQL)."""
+    strings: Dict[str, _StringVar] = {}
+    for node in tree.body:
+        if (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+        ):
+            texts = _render(node.value, strings)
+            if texts is not None:
+                strings[node.targets[0].id] = _StringVar((), [(texts, ())])
+    return strings
+
+
+class _QueryCollector:
+    """
+    Обходит тело функции по порядку, следит за строками, из которых
+    собирается запрос, и запоминает все вызовы execute/executemany.
+    """
+
+    def __init__(self, strings: Dict[str, _StringVar]):
+        self.strings = dict(strings)
+        self.path: Tuple[_Condition, ...] = ()
+        # (строка, варианты SQL или None, если текст не восстановить)
+        self.queries: List[Tuple[int, Optional[List[str]]]] = []
+
+    def visit_body(self, body: List[ast.stmt]) -> None:
+        for stmt in body:
+            self.visit(stmt)
+
+    def visit(self, stmt: ast.stmt) -> None:
+        if isinstance(stmt, ast.If):
+            self.collect_calls(stmt.test)
+            for branch in ("body", "orelse"):
+                saved = self.path
+                self.path = saved + ((id(stmt), branch),)
+                self.visit_body(getattr(stmt, branch))
+                self.path = saved
+        elif isinstance(stmt, (ast.For, ast.AsyncFor)):
+            self.collect_calls(stmt.iter)
+            self.bind_loop(stmt)
+            self.visit_body(stmt.body)
+            self.visit_body(stmt.orelse)
+        elif isinstance(stmt, ast.While):
+            self.collect_calls(stmt.test)
+            self.visit_body(stmt.body)
+            self.visit_body(stmt.orelse)
+        elif isinstance(stmt, (ast.With, ast.AsyncWith)):
+            for item in stmt.items:
+                self.collect_calls(item.context_expr)
+            self.visit_body(stmt.body)
+        elif isinstance(stmt, ast.Try):
+            self.visit_body(stmt.body)
+            for handler in stmt.handlers:
+                self.visit_body(handler.body)
+            self.visit_body(stmt.orelse)
+            self.visit_body(stmt.finalbody)
+        elif isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            self.visit_body(stmt.body)
+        else:
+            self.collect_calls(stmt)
+            self.assign(stmt)
+
+    def bind_loop(self, stmt: ast.For) -> None:
+        # for ddl in ("...", "..."): переменная принимает каждое из значений
+        if isinstance(stmt.target, ast.Name) and isinstance(stmt.iter, (ast.Tuple, ast.List)):
+            texts: List[str] = []
+            for element in stmt.iter.elts:
+                rendered = _render(element, self.strings)
+                if rendered is None:
+                    return
+                texts.extend(rendered)
+            self.strings[stmt.target.id] = _StringVar(self.path, [(_unique(texts), ())])
+
+    def assign(self, stmt: ast.stmt) -> None:
+        if (
+            isinstance(stmt, ast.Assign)
+            and len(stmt.targets) == 1
+            and isinstance(stmt.targets[0], ast.Name)
+        ):
+            texts = _render(stmt.value, self.strings)
+            if texts is not None:
+                self.strings[stmt.targets[0].id] = _StringVar(self.path, [(texts, ())])
+        elif (
+            isinstance(stmt, ast.AugAssign)
+            and isinstance(stmt.op, ast.Add)
+            and isinstance(stmt.target, ast.Name)
+            and stmt.target.id in self.strings
+        ):
+            var = self.strings[stmt.target.id]
+            texts = _render(stmt.value, self.strings)
+            if texts is None:
+                # Дописано что-то неизвестное — запрос дальше не восстановить
+                del self.strings[stmt.target.id]
+                return
+            conditions = self.path[len(var.path):] if self.path[: len(var.path)] == var.path else self.path
+            var.fragments.append((texts, conditions))
+
+    def collect_calls(self, node: ast.AST) -> None:
+        for child in ast.walk(node):
+            if (
+                isinstance(child, ast.Call)
+                and getattr(child.func, "attr", None) in ("execute", "executemany")
+                and child.args
+            ):
+                sql_node = child.args[0]
+                texts = _render(sql_node, self.strings)
+                if texts is None:
+                    if not _UNCHECKED_RE.match(_leading_text(sql_node)):
+                        self.queries.append((child.lineno, None))
+                    continue
+                statements = [text for text in texts if _STATEMENT_RE.match(text)]
+                if statements:
+                    self.queries.append((child.lineno, statements))
+
+
+def collect_queries(module: str) -> List[QueryPlan]:
+    """
+    Находит SQL-запросы в модуле (путь относительно корня проекта). Запрос,
+    собранный по условиям, даёт несколько вариантов; execute, текст которого
+    восстановить не удалось, попадает в результат с ошибкой.
+    """
+    with open(os.path.join(BASE_DIR, module), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    strings = _module_strings(tree)
+    found = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        collector = _QueryCollector(strings)
+        collector.visit_body(node.body)
+        for lineno, statements in collector.queries:
+            if statements is None:
+                if (module, node.name) not in UNRENDERED:
+                    found.append(
+                        QueryPlan(module, node.name, lineno, "", error="не удалось восстановить текст запроса")
+                    )
+                continue
+            for sql in statements:
+                found.append(QueryPlan(module, node.name, lineno, sql))
+    return found
+
+
+def _sample_params(sql: str):
+    named = re.findall(r"(?<!:):([A-Za-z_]\w*)", sql)
+    if named:
+        return {name: None for name in named}
+    return [None] * sql.count("?")
+
+
+def explain(conn: sqlite3.Connection, query: QueryPlan) -> QueryPlan:
+    if query.error:
+        return query
+    try:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + query.sql, _sample_params(query.sql)).fetchall()
+    except sqlite3.Error as e:
+        query.error = str(e)
+        return query
+    query.plan = [row[3] for row in rows]
+    query.problems = [
+        detail
+        for detail in query.plan
+        if (detail.startswith("SCAN ") and detail != "SCAN CONSTANT ROW")
+        or "USE TEMP B-TREE" in detail
+    ]
+    return query
+
+
+def check_query_plans(conn: sqlite3.Connection, modules=MODULES) -> List[QueryPlan]:
+    """Возвращает планы всех найденных запросов."""
+    return [explain(conn, query) for module in modules for query in collect_queries(module)]
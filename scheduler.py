@@ -0,0 +1,147 @@
+"""
+Планировщик фоновых задач по дедлайнам.
+
+Вместо ежечасного обхода всей базы планировщик держит min-heap ближайших
+сроков (авто-увольнение, напоминание и автоудаление по жалобе, истечение
+состояний) и спит ровно до ближайшего из них. Сроки заполняются при старте
+из БД и добавляются обработчиками, когда меняются соответствующие строки.
+
+Задача регистрируется под своим видом (kind) и получает ключи всех строк,
+срок которых наступил. Если задача упала, её ключи повторяются через
+retry_seconds. Устаревшие записи (строку уже обработали или отменили)
+безопасны: задача просто не найдёт, что делать.
+
+Задача, зарегистрированная с lease, выполняется только под арендой в БД:
+если её сейчас держит другой процесс бота, срок переносится на retry_seconds.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from config import MAINTENANCE_LEASE_SECONDS
+from db_async import acquire_lease, release_lease
+
+logger = logging.getLogger(__name__)
+
+# Кто держит аренду: процесс на конкретной машине
+LEASE_HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+
+DeadlineJob = Callable[[List[Hashable]], Awaitable[Any]]
+
+
+class DeadlineScheduler:
+    def __init__(self, retry_seconds: float = 60.0):
+        self._retry_seconds = retry_seconds
+        self._jobs: Dict[str, DeadlineJob] = {}
+        self._leases: Dict[str, str] = {}
+        self._heap: List[Tuple[datetime, int, str, Hashable]] = []
+        self._deadlines: Dict[Tuple[str, Hashable], datetime] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Сколько сроков сейчас запланировано."""
+        return len(self._deadlines)
+
+    def register(self, kind: str, job: DeadlineJob, *, lease: Optional[str] = None) -> None:
+        """
+        Регистрирует задачу для сроков вида kind.
+        lease — имя аренды, под которой задача выполняется в одном процессе.
+        """
+        if kind in self._jobs:
+            raise RuntimeError(f"Задача планировщика {kind!r} уже зарегистрирована")
+        self._jobs[kind] = job
+        if lease is not None:
+            self._leases[kind] = lease
+
+    def schedule(self, kind: str, key: Hashable, due: datetime) -> None:
+        """
+        Планирует выполнение задачи kind для key в момент due (наивное UTC).
+        Повторный вызов с тем же key переносит срок.
+        """
+        if kind not in self._jobs:
+            raise RuntimeError(f"Задача планировщика {kind!r} не зарегистрирована")
+        if self._deadlines.get((kind, key)) == due:
+            return
+        self._deadlines[(kind, key)] = due
+        heapq.heappush(self._heap, (due, next(self._seq), kind, key))
+        if self._wakeup is not None and self._heap[0][0] == due:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="scheduler")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _pop_due(self, now: datetime) -> Dict[str, List[Hashable]]:
+        due: Dict[str, List[Hashable]] = {}
+        while self._heap and self._heap[0][0] <= now:
+            when, _, kind, key = heapq.heappop(self._heap)
+            # Запись могли перенести — тогда в куче лежит более новая
+            if self._deadlines.get((kind, key)) != when:
+                continue
+            del self._deadlines[(kind, key)]
+            due.setdefault(kind, []).append(key)
+        return due
+
+    async def _run(self) -> None:
+        while True:
+            delay = None
+            if self._heap:
+                delay = max((self._heap[0][0] - datetime.utcnow()).total_seconds(), 0.0)
+            self._wakeup.clear()
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for kind, keys in self._pop_due(datetime.utcnow()).items():
+                await self._run_job(kind, keys)
+
+    def _retry(self, kind: str, keys: List[Hashable]) -> None:
+        retry_at = datetime.utcnow() + timedelta(seconds=self._retry_seconds)
+        for key in keys:
+            if (kind, key) not in self._deadlines:
+                self.schedule(kind, key, retry_at)
+
+    async def _run_job(self, kind: str, keys: List[Hashable]) -> None:
+        lease = self._leases.get(kind)
+        if lease is not None:
+            try:
+                acquired = await acquire_lease(lease, LEASE_HOLDER, MAINTENANCE_LEASE_SECONDS)
+            except Exception:
+                logger.exception("Не удалось взять аренду %s", lease)
+                acquired = False
+            if not acquired:
+                logger.info("Задачу %s выполняет другой процесс, повтор позже", kind)
+                self._retry(kind, keys)
+                return
+        try:
+            await self._jobs[kind](keys)
+        except Exception:
+            logger.exception("Ошибка в задаче планировщика %s", kind)
+            self._retry(kind, keys)
+        finally:
+            if lease is not None:
+                try:
+                    await release_lease(lease, LEASE_HOLDER)
+                except Exception:
+                    logger.exception("Не удалось освободить аренду %s", lease)
+
+
+scheduler = DeadlineScheduler()
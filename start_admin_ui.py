@@ -1,18 +1,58 @@
 from __future__ import annotations
 
+import gzip
 import json
+import logging
+import mimetypes
+import time
+from contextlib import closing
+from datetime import date, datetime, timedelta
+from functools import wraps
 from pathlib import Path
 
-from flask import Flask, jsonify, request, send_file, send_from_directory
+from flask import Flask, Response, jsonify, make_response, request, send_file, send_from_directory
 from flask_cors import CORS
 
+from config import (
+    ADMIN_UI_COMPRESS_MIN_SIZE,
+    ADMIN_UI_CONNECTION_LIMIT,
+    ADMIN_UI_CORS_ORIGINS,
+    ADMIN_UI_HOST,
+    ADMIN_UI_KEEPALIVE_TIMEOUT,
+    ADMIN_UI_MODE,
+    ADMIN_UI_PORT,
+    ADMIN_UI_THREADS,
+    LOG_LEVEL,
+)
+
+try:
+    import brotli
+except ImportError:
+    # Без пакета brotli ответы сжимаются только gzip
+    brotli = None
+
 try:
     from db import (
+        STAT_APPEALS_CREATED,
+        STAT_APPEALS_PENDING,
+        STAT_APPEALS_STATUS,
+        STAT_COMPANIES_KYC,
+        STAT_COMPANIES_REGISTERED,
+        STAT_EMPLOYMENTS_STATUS,
+        STAT_MASTERS_REGISTERED,
+        STAT_SUBSCRIPTIONS_EXPIRE,
+        get_appeal_event_bounds,
+        get_appeal_events,
         get_conn,
         get_company_by_id,
+        get_daily_stats,
         get_master_by_id,
         get_review_appeal_by_id,
+        get_review_appeals_page,
         get_review_by_id,
+        get_stat_sum,
+        get_stat_totals,
+        get_table_versions,
         log_admin_action,
         set_company_blocked,
         set_company_subscription,
@@ -28,55 +68,324 @@ BASE_DIR = Path(__file__).resolve().parent
 DIST_DIR = BASE_DIR / "admin-ui" / "dist"
 INDEX_FILE = DIST_DIR / "index.html"
 
-app = Flask(__name__, static_folder=str(DIST_DIR), static_url_path="")
-CORS(app)  # Разрешаем CORS для API
+# Встроенный static-маршрут Flask перекрывал static_proxy: файлы отдаёт только он
+app = Flask(__name__, static_folder=None)
+if ADMIN_UI_CORS_ORIGINS:
+    CORS(app, resources={r"/api/*": {"origins": ADMIN_UI_CORS_ORIGINS}})
+
+logger = logging.getLogger(__name__)
+
+# Vite кладёт в dist/assets файлы с хэшем содержимого в имени — их можно кэшировать навсегда
+IMMUTABLE_ASSETS_PREFIX = "assets/"
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Сжатие: текстовые ответы API и файлы сборки (в dist/ рядом лежат .br и .gz)
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/css", "text/plain", "application/javascript"}
+COMPRESSIBLE_SUFFIXES = {".html", ".js", ".css", ".svg", ".json", ".map", ".txt"}
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Таблицы, из которых собираются ответы API жалоб
+APPEALS_TABLES = ("review_appeals", "reviews", "masters", "companies")
+
+
+def _compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    # Для ответов API — быстрые уровни, для файлов сборки (сжимаются один раз) — максимальные
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6)
+
+
+def _accepted_encodings():
+    """Поддерживаемые клиентом кодировки в порядке предпочтения сервера."""
+    return [
+        encoding
+        for encoding in PRECOMPRESSED_SUFFIXES
+        if request.accept_encodings[encoding] and (encoding != "br" or brotli is not None)
+    ]
+
+
+def precompress_dist() -> int:
+    """
+    Создаёт рядом с текстовыми файлами dist/ сжатые копии (.br, .gz), если
+    их нет или сборка новее. Возвращает число записанных файлов.
+    """
+    written = 0
+    for path in DIST_DIR.rglob("*"):
+        if not path.is_file() or path.suffix not in COMPRESSIBLE_SUFFIXES:
+            continue
+        data = None
+        for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+            if encoding == "br" and brotli is None:
+                continue
+            target = path.with_name(path.name + suffix)
+            if target.exists() and target.stat().st_mtime >= path.stat().st_mtime:
+                continue
+            if data is None:
+                data = path.read_bytes()
+            target.write_bytes(_compress(data, encoding, best=True))
+            written += 1
+    return written
+
+
+def _send_asset(asset_path: str, **kwargs) -> "flask.Response":
+    """Отдаёт файл из dist/, по возможности — его заранее сжатую копию."""
+    if Path(asset_path).suffix not in COMPRESSIBLE_SUFFIXES:
+        return send_from_directory(DIST_DIR, asset_path, **kwargs)
+
+    for encoding in _accepted_encodings():
+        compressed_path = asset_path + PRECOMPRESSED_SUFFIXES[encoding]
+        if (DIST_DIR / compressed_path).is_file():
+            mimetype = mimetypes.guess_type(asset_path)[0] or "application/octet-stream"
+            response = send_from_directory(DIST_DIR, compressed_path, mimetype=mimetype, **kwargs)
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_from_directory(DIST_DIR, asset_path, **kwargs)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _send_index() -> "flask.Response":
+    # index.html ссылается на текущие хэшированные файлы, поэтому всегда перепроверяется
+    response = _send_asset(INDEX_FILE.name)
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route("/")
 def index() -> "flask.Response":
-    return send_file(INDEX_FILE)
+    return _send_index()
 
 
 @app.route("/<path:asset_path>")
 def static_proxy(asset_path: str) -> "flask.Response":
+    # Неизвестный адрес API — ошибка в JSON, а не страница приложения
+    if asset_path == "api" or asset_path.startswith("api/"):
+        response = jsonify({"error": "Not found"})
+        response.status_code = 404
+        return response
     file_path = DIST_DIR / asset_path
-    if file_path.exists():
-        return send_from_directory(DIST_DIR, asset_path)
-    return send_file(INDEX_FILE)
+    if not file_path.is_file():
+        return _send_index()
+    if asset_path.startswith(IMMUTABLE_ASSETS_PREFIX):
+        response = _send_asset(asset_path, max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+    response = _send_asset(asset_path)
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.after_request
+def compress_response(response: "flask.Response") -> "flask.Response":
+    """Сжимает ответы API; файлы (direct_passthrough) и поток SSE не трогает."""
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encodings = _accepted_encodings()
+    data = response.get_data()
+    if not encodings or len(data) < ADMIN_UI_COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(_compress(data, encodings[0]))
+    response.headers["Content-Encoding"] = encodings[0]
+    return response
+
+
+def conditional(*tables: str):
+    """
+    Условный GET для ответа, собранного из tables: ETag из версий таблиц,
+    Last-Modified — время последней записи. Версии читаются до запроса
+    данных, поэтому ETag никогда не новее содержимого ответа.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = get_table_versions(tables)
+            etag = "-".join(str(versions.get(table, {}).get("version", 0)) for table in tables)
+            updated = [v["updated_at"] for v in versions.values() if v["updated_at"]]
+            last_modified = datetime.fromisoformat(max(updated)) if updated else None
+
+            # If-Modified-Since точен только до секунды, поэтому при наличии ETag решает он
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = bool(
+                    since and last_modified and last_modified <= since.replace(tzinfo=None)
+                )
+            if not_modified:
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+APPEALS_PAGE_SIZE = 50
+APPEALS_MAX_PAGE_SIZE = 200
+
+# Статистика: период по умолчанию и максимальный, дней
+STATS_DEFAULT_DAYS = 7
+STATS_MAX_DAYS = 366
+# Возраст жалоб, ожидающих ответа компании: (название, от, до) в днях;
+# 3 и 5 дней — сроки напоминания и автоудаления
+APPEAL_AGE_BUCKETS = (("0-1d", 0, 1), ("1-3d", 1, 3), ("3-5d", 3, 5), ("5d+", 5, None))
+
+# Поток событий жалоб: как часто проверять журнал и слать keep-alive комментарий
+APPEAL_EVENTS_POLL_SECONDS = 1.0
+APPEAL_EVENTS_HEARTBEAT_SECONDS = 15.0
+APPEAL_EVENTS_BATCH = 100
+
+
+def _int_arg(name: str):
+    value = request.args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+
+def _date_arg(name: str):
+    value = request.args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+
+
+def _appeals_cursor(appeal: dict) -> str:
+    return f"{appeal['created_at']}_{appeal['id']}"
+
+
+def _parse_appeals_cursor(cursor: str):
+    created_at, _, appeal_id = cursor.rpartition("_")
+    try:
+        return created_at, int(appeal_id)
+    except ValueError:
+        raise ValueError("invalid cursor")
 
 
 # API Endpoints
 @app.route("/api/review-appeals", methods=["GET"])
+@conditional(*APPEALS_TABLES)
 def get_review_appeals():
-    """Получить список жалоб на отзывы"""
+    """
+    Получить страницу жалоб на отзывы, новые первыми.
+
+    Параметры: status, company_id, master_id, date_from и date_to (YYYY-MM-DD,
+    включительно), limit и cursor — значение next_cursor предыдущего ответа.
+    last_event_id в ответе — позиция журнала на момент выборки: с неё
+    продолжает поток /api/review-appeals/events.
+    """
     try:
-        from db import get_conn
-        
-        with get_conn() as conn:
-            c = conn.cursor()
-            c.execute("""
-                SELECT ra.*, 
-                       r.text as review_text, 
-                       r.created_at as review_created_at,
-                       m.full_name as master_full_name, 
-                       m.public_id as master_public_id,
-                       c2.name as company_name, 
-                       c2.public_id as company_public_id
-                FROM review_appeals ra
-                JOIN reviews r ON ra.review_id = r.id
-                JOIN masters m ON ra.master_id = m.id
-                LEFT JOIN companies c2 ON ra.company_id = c2.id
-                ORDER BY ra.created_at DESC
-                LIMIT 100
-            """)
-            rows = c.fetchall()
-            appeals = [dict(row) for row in rows]
-            return jsonify(appeals)
+        limit = _int_arg("limit") or APPEALS_PAGE_SIZE
+        limit = max(1, min(limit, APPEALS_MAX_PAGE_SIZE))
+        cursor = request.args.get("cursor")
+        after = _parse_appeals_cursor(cursor) if cursor else None
+        date_from = _date_arg("date_from")
+        date_to = _date_arg("date_to")
+        filters = {
+            "status": request.args.get("status") or None,
+            "company_id": _int_arg("company_id"),
+            "master_id": _int_arg("master_id"),
+            "created_from": date_from.isoformat() if date_from else None,
+            "created_before": (date_to + timedelta(days=1)).isoformat() if date_to else None,
+        }
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # Позиция журнала читается до выборки: события между ними клиент получит повторно
+        _, last_event_id = get_appeal_event_bounds()
+        # Лишняя строка показывает, есть ли следующая страница
+        appeals = get_review_appeals_page(limit + 1, after=after, **filters)
+        next_cursor = _appeals_cursor(appeals[limit - 1]) if len(appeals) > limit else None
+        return jsonify(
+            {"items": appeals[:limit], "next_cursor": next_cursor, "last_event_id": last_event_id}
+        )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _sse(event: str, data: dict, event_id=None) -> str:
+    message = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"id: {event_id}\n{message}" if event_id is not None else message
+
+
+def _appeal_event_stream(after_id, disconnected=None):
+    first_id, last_id = get_appeal_event_bounds()
+    oldest_id = first_id if first_id is not None else last_id + 1
+    if after_id is None:
+        after_id = last_id
+    elif after_id > last_id or after_id < oldest_id - 1:
+        # Нужные события уже удалены (или база другая) — клиент перезагружает список
+        after_id = last_id
+        yield _sse("reset", {}, after_id)
+
+    yield "retry: 3000\n\n"
+    idle = 0.0
+    # waitress сообщает об отключении клиента сразу; иначе оно обнаружится при записи keep-alive
+    while not (disconnected and disconnected()):
+        events = get_appeal_events(after_id, APPEAL_EVENTS_BATCH)
+        for event in events:
+            after_id = event.pop("event_id")
+            kind = event.pop("kind")
+            event["listed"] = bool(event["listed"])
+            yield _sse("appeal", {"kind": kind, "appeal": event}, after_id)
+        if events:
+            idle = 0.0
+            continue
+        time.sleep(APPEAL_EVENTS_POLL_SECONDS)
+        idle += APPEAL_EVENTS_POLL_SECONDS
+        if idle >= APPEAL_EVENTS_HEARTBEAT_SECONDS:
+            idle = 0.0
+            yield ": ping\n\n"
+
+
+@app.route("/api/review-appeals/events", methods=["GET"])
+def review_appeal_events():
+    """
+    Поток Server-Sent Events: создание жалоб и смена их статуса (ответ
+    компании, автоудаление). Продолжает с Last-Event-ID (браузер шлёт его
+    при переподключении) или с параметра last_event_id; без них — с текущего
+    момента.
+    """
+    value = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        after_id = int(value) if value else None
+    except ValueError:
+        return jsonify({"error": "last_event_id must be an integer"}), 400
+    return Response(
+        _appeal_event_stream(after_id, request.environ.get("waitress.client_disconnected")),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/api/review-appeals/<int:appeal_id>", methods=["GET"])
+@conditional(*APPEALS_TABLES)
 def get_review_appeal(appeal_id: int):
     """Получить детали жалобы"""
     try:
@@ -89,6 +398,7 @@ def get_review_appeal(appeal_id: int):
 
 
 @app.route("/api/review-appeals/<int:appeal_id>/photos", methods=["GET"])
+@conditional(*APPEALS_TABLES)
 def get_appeal_photos(appeal_id: int):
     """Получить фото из жалобы"""
     try:
@@ -121,12 +431,115 @@ def get_appeal_photos(appeal_id: int):
         return jsonify({"error": str(e)}), 500
 
 
+def _stats_days() -> int:
+    return max(1, min(_int_arg("days") or STATS_DEFAULT_DAYS, STATS_MAX_DAYS))
+
+
+@app.route("/api/stats", methods=["GET"])
+def get_stats():
+    """
+    Сводка для дашборда из таблицы daily_stats. days — за сколько последних
+    дней считать новых исполнителей, компании и жалобы (по умолчанию 7).
+    Подписка считается активной до конца дня subscription_until (UTC).
+    """
+    try:
+        days = _stats_days()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    today = datetime.utcnow().date()
+    since = (today - timedelta(days=days - 1)).isoformat()
+    try:
+        kyc = get_stat_totals(STAT_COMPANIES_KYC)
+        return jsonify(
+            {
+                "period_days": days,
+                "new_masters": get_stat_sum(STAT_MASTERS_REGISTERED, since),
+                "new_companies": get_stat_sum(STAT_COMPANIES_REGISTERED, since),
+                "new_appeals": get_stat_sum(STAT_APPEALS_CREATED, since),
+                "pending_kyc": kyc.get("waiting", 0),
+                "active_subscriptions": get_stat_sum(STAT_SUBSCRIPTIONS_EXPIRE, today.isoformat()),
+                "employments_by_status": get_stat_totals(STAT_EMPLOYMENTS_STATUS),
+                "appeals_by_status": get_stat_totals(STAT_APPEALS_STATUS),
+                "companies_by_kyc_status": kyc,
+            }
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/stats/registrations", methods=["GET"])
+def get_registration_stats():
+    """Новые исполнители и компании по дням (UTC) за последние days дней."""
+    try:
+        days = _stats_days()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    today = datetime.utcnow().date()
+    series = {
+        (today - timedelta(days=offset)).isoformat(): {"masters": 0, "companies": 0}
+        for offset in range(days - 1, -1, -1)
+    }
+    names = {STAT_MASTERS_REGISTERED: "masters", STAT_COMPANIES_REGISTERED: "companies"}
+    try:
+        for row in get_daily_stats(list(names), min(series)):
+            if row["day"] in series:
+                series[row["day"]][names[row["metric"]]] = row["value"]
+        return jsonify({"days": [{"day": day, **counts} for day, counts in series.items()]})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/stats/appeals-age", methods=["GET"])
+def get_appeal_age_stats():
+    """Жалобы, ожидающие ответа компании, по возрасту в днях."""
+    today = datetime.utcnow().date()
+    counts = {label: 0 for label, _, _ in APPEAL_AGE_BUCKETS}
+    try:
+        for row in get_daily_stats([STAT_APPEALS_PENDING]):
+            age = (today - date.fromisoformat(row["day"])).days
+            for label, low, high in APPEAL_AGE_BUCKETS:
+                if age >= low and (high is None or age < high):
+                    counts[label] += row["value"]
+                    break
+        return jsonify(
+            {
+                "buckets": [{"label": label, "count": counts[label]} for label, _, _ in APPEAL_AGE_BUCKETS],
+                "total": sum(counts.values()),
+            }
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 if __name__ == "__main__":
     if not INDEX_FILE.exists():
         raise RuntimeError(
             "Admin UI build not found. Run `npm install` and `npm run build` in ./admin-ui to generate dist/."
         )
 
-    host = "0.0.0.0"
-    port = 5001
-    app.run(host=host, port=port)
+    logging.basicConfig(
+        level=getattr(logging, LOG_LEVEL, logging.INFO),
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
+    if ADMIN_UI_MODE == "production":
+        from waitress import serve
+
+        try:
+            logger.info("Сжато файлов сборки: %s", precompress_dist())
+        except OSError:
+            logger.warning("Не удалось записать сжатые копии в %s, файлы отдаются как есть", DIST_DIR)
+        serve(
+            app,
+            host=ADMIN_UI_HOST,
+            port=ADMIN_UI_PORT,
+            threads=ADMIN_UI_THREADS,
+            connection_limit=ADMIN_UI_CONNECTION_LIMIT,
+            channel_timeout=ADMIN_UI_KEEPALIVE_TIMEOUT,
+            # Нужно для waitress.client_disconnected: поток SSE освобождается сразу после отключения
+            channel_request_lookahead=1,
+            ident="admin-ui",
+        )
+    else:
+        app.run(host=ADMIN_UI_HOST, port=ADMIN_UI_PORT, threaded=True)
@@ -2,16 +2,30 @@
 Управление состояниями пользователей (state machine)
 """
 from .state_manager import (
+    PendingState,
     get_state,
     pop_state,
     set_state,
     clear_expired_states,
+    get_oldest_state_created_at,
+    flush_states,
+    start_state_flusher,
+    stop_state_flusher,
 )
+from .actions import find_unhandled_state_actions, get_state_action, state_action
 
 __all__ = [
+    "PendingState",
     "get_state",
     "pop_state",
     "set_state",
     "clear_expired_states",
+    "get_oldest_state_created_at",
+    "flush_states",
+    "start_state_flusher",
+    "stop_state_flusher",
+    "state_action",
+    "get_state_action",
+    "find_unhandled_state_actions",
 ]
 
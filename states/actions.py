@@ -0,0 +1,67 @@
+"""
+Реестр обработчиков состояний: action → корутина
+"""
+import ast
+import inspect
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+StateActionHandler = Callable[..., Awaitable[Any]]
+
+_handlers: Dict[str, StateActionHandler] = {}
+
+
+def state_action(action: str) -> Callable[[StateActionHandler], StateActionHandler]:
+    """
+    Регистрирует корутину как обработчик сообщений в состоянии action.
+    """
+
+    def decorator(func: StateActionHandler) -> StateActionHandler:
+        if action in _handlers:
+            raise RuntimeError(f"Обработчик состояния {action!r} уже зарегистрирован")
+        _handlers[action] = func
+        return func
+
+    return decorator
+
+
+def get_state_action(action: str) -> Optional[StateActionHandler]:
+    """
+    Возвращает обработчик состояния или None, если он не зарегистрирован.
+    """
+    return _handlers.get(action)
+
+
+def _set_state_actions(tree: ast.AST) -> Dict[str, int]:
+    """
+    Находит в дереве вызовы set_state(tg_id, "action", ...) с литералом
+    в качестве action. Возвращает {action: номер первой строки}.
+    """
+    found: Dict[str, int] = {}
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call) or len(node.args) < 2:
+            continue
+        func = node.func
+        name = func.id if isinstance(func, ast.Name) else getattr(func, "attr", None)
+        action = node.args[1]
+        if (
+            name == "set_state"
+            and isinstance(action, ast.Constant)
+            and isinstance(action.value, str)
+        ):
+            found.setdefault(action.value, node.lineno)
+    return found
+
+
+def find_unhandled_state_actions(*modules: ModuleType) -> List[str]:
+    """
+    Проверяет, что для каждого состояния, которое модули передают в set_state,
+    зарегистрирован обработчик. Возвращает описания найденных пропусков.
+    """
+    missing = []
+    for module in modules:
+        tree = ast.parse(inspect.getsource(module))
+        for action, lineno in sorted(_set_state_actions(tree).items()):
+            if action not in _handlers:
+                missing.append(f"{module.__name__}:{lineno}: {action}")
+    return missing
@@ -1,14 +1,26 @@
 """
 Управление состояниями пользователей в БД
+
+Перед таблицей user_states стоит LRU-кэш в памяти процесса: чтения обслуживаются
+из кэша, записи либо сразу уходят в БД (write-through), либо, если запущен
+фоновый flusher, накапливаются и сбрасываются пачкой раз в
+STATE_FLUSH_INTERVAL_SECONDS (write-behind).
 """
 import json
+import logging
+import threading
+import time
+from collections import OrderedDict
 from contextlib import closing
 from dataclasses import dataclass, asdict
 from datetime import datetime, timedelta
 from typing import Any, Dict, Optional
 
+from config import STATE_CACHE_SIZE, STATE_CACHE_TTL_SECONDS, STATE_FLUSH_INTERVAL_SECONDS
 from db import get_conn, utc_now_iso
 
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class PendingState:
@@ -16,67 +28,240 @@ class PendingState:
     data: Dict[str, Any]
 
 
+@dataclass(frozen=True)
+class _CachedState:
+    # action=None — состояния нет (отрицательный кэш или отложенное удаление)
+    action: Optional[str]
+    data_json: str
+    created_at: str
+    cached_at: float
+
+
+_lock = threading.Lock()
+_cache: "OrderedDict[int, _CachedState]" = OrderedDict()
+_dirty: Dict[int, _CachedState] = {}  # ещё не записанные в БД изменения
+_in_flight: Dict[int, _CachedState] = {}  # изменения, которые сейчас пишет flush_states
+
+_flusher: Optional[threading.Thread] = None
+_flusher_stop = threading.Event()
+
+
+def _remember(tg_id: int, entry: _CachedState) -> None:
+    """Кладёт запись в кэш и вытесняет самые старые чистые записи. Вызывать под _lock."""
+    _cache[tg_id] = entry
+    _cache.move_to_end(tg_id)
+    if len(_cache) <= STATE_CACHE_SIZE:
+        return
+    for key in list(_cache):
+        if len(_cache) <= STATE_CACHE_SIZE:
+            break
+        if key not in _dirty:
+            del _cache[key]
+
+
+def _lookup(tg_id: int) -> Optional[_CachedState]:
+    """Ищет состояние в памяти. Вызывать под _lock."""
+    entry = _cache.get(tg_id)
+    if entry is not None:
+        fresh = time.monotonic() - entry.cached_at < STATE_CACHE_TTL_SECONDS
+        if fresh or tg_id in _dirty:
+            _cache.move_to_end(tg_id)
+            return entry
+        del _cache[tg_id]
+    return _dirty.get(tg_id) or _in_flight.get(tg_id)
+
+
+def _write_behind() -> bool:
+    return _flusher is not None
+
+
+def _store(tg_id: int, entry: _CachedState) -> None:
+    if _write_behind():
+        with _lock:
+            _dirty[tg_id] = entry
+            _remember(tg_id, entry)
+        return
+
+    with closing(get_conn()) as conn, conn:
+        if entry.action is None:
+            conn.execute("DELETE FROM user_states WHERE tg_id = ?", (tg_id,))
+        else:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO user_states (tg_id, action, data, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (tg_id, entry.action, entry.data_json, entry.created_at, entry.created_at),
+            )
+    with _lock:
+        _remember(tg_id, entry)
+
+
 def set_state(tg_id: int, action: str, **data):
     """
     Устанавливает состояние для пользователя.
-    Состояние сохраняется в БД.
+    Состояние сохраняется в кэше и в БД (сразу или при ближайшем сбросе).
     """
     now = utc_now_iso()
     data_json = json.dumps(data, ensure_ascii=False)
-    
-    with closing(get_conn()) as conn, conn:
-        conn.execute(
-            """
-            INSERT OR REPLACE INTO user_states (tg_id, action, data, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (tg_id, action, data_json, now, now),
-        )
+    _store(tg_id, _CachedState(action, data_json, now, time.monotonic()))
 
 
 def get_state(tg_id: int) -> Optional[PendingState]:
     """
-    Получает текущее состояние пользователя из БД.
+    Получает текущее состояние пользователя (из кэша, при промахе — из БД).
     """
-    with closing(get_conn()) as conn:
-        c = conn.cursor()
-        c.execute(
-            "SELECT action, data FROM user_states WHERE tg_id = ?",
-            (tg_id,),
-        )
-        row = c.fetchone()
-        if not row:
-            return None
-        
-        try:
-            data = json.loads(row["data"]) if row["data"] else {}
-        except (json.JSONDecodeError, TypeError):
-            data = {}
-        
-        return PendingState(action=row["action"], data=data)
+    with _lock:
+        entry = _lookup(tg_id)
+
+    if entry is None:
+        with closing(get_conn()) as conn:
+            c = conn.cursor()
+            c.execute(
+                "SELECT action, data, created_at FROM user_states WHERE tg_id = ?",
+                (tg_id,),
+            )
+            row = c.fetchone()
+        if row:
+            loaded = _CachedState(row["action"], row["data"] or "", row["created_at"], time.monotonic())
+        else:
+            loaded = _CachedState(None, "", "", time.monotonic())
+        with _lock:
+            # Пока шёл запрос, состояние могли поменять — побеждает более новая запись
+            entry = _lookup(tg_id)
+            if entry is None:
+                entry = loaded
+                _remember(tg_id, entry)
+
+    if entry.action is None:
+        return None
+
+    try:
+        data = json.loads(entry.data_json) if entry.data_json else {}
+    except (json.JSONDecodeError, TypeError):
+        data = {}
+
+    return PendingState(action=entry.action, data=data)
 
 
 def pop_state(tg_id: int) -> Optional[PendingState]:
     """
-    Получает и удаляет состояние пользователя из БД.
+    Получает и удаляет состояние пользователя.
     """
     state = get_state(tg_id)
     if state:
-        with closing(get_conn()) as conn, conn:
-            conn.execute("DELETE FROM user_states WHERE tg_id = ?", (tg_id,))
+        _store(tg_id, _CachedState(None, "", "", time.monotonic()))
     return state
 
 
+def flush_states() -> int:
+    """
+    Записывает накопленные изменения состояний в БД одной транзакцией.
+    Возвращает количество записанных изменений.
+    """
+    with _lock:
+        if not _dirty:
+            return 0
+        batch = dict(_dirty)
+        _dirty.clear()
+        _in_flight.update(batch)
+
+    upserts = [
+        (tg_id, e.action, e.data_json, e.created_at, e.created_at)
+        for tg_id, e in batch.items()
+        if e.action is not None
+    ]
+    deletes = [(tg_id,) for tg_id, e in batch.items() if e.action is None]
+    try:
+        with closing(get_conn()) as conn, conn:
+            if upserts:
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO user_states (tg_id, action, data, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    upserts,
+                )
+            if deletes:
+                conn.executemany("DELETE FROM user_states WHERE tg_id = ?", deletes)
+    except Exception:
+        with _lock:
+            # Вернём изменения в очередь, если их не перекрыли более новые
+            for tg_id, entry in batch.items():
+                _dirty.setdefault(tg_id, entry)
+        raise
+    finally:
+        with _lock:
+            for tg_id, entry in batch.items():
+                if _in_flight.get(tg_id) is entry:
+                    del _in_flight[tg_id]
+    return len(batch)
+
+
+def _flusher_loop(interval: float) -> None:
+    while not _flusher_stop.wait(interval):
+        try:
+            flush_states()
+        except Exception:
+            logger.exception("Не удалось сбросить состояния пользователей в БД")
+
+
+def start_state_flusher(interval: Optional[float] = None) -> bool:
+    """
+    Включает отложенную запись состояний (write-behind) с фоновым сбросом
+    раз в interval секунд. При interval <= 0 остаётся write-through.
+    """
+    global _flusher
+    if interval is None:
+        interval = STATE_FLUSH_INTERVAL_SECONDS
+    if interval <= 0 or _flusher is not None:
+        return False
+    _flusher_stop.clear()
+    _flusher = threading.Thread(
+        target=_flusher_loop, args=(interval,), name="state-flusher", daemon=True
+    )
+    _flusher.start()
+    return True
+
+
+def stop_state_flusher() -> int:
+    """
+    Останавливает фоновый сброс и записывает оставшиеся изменения.
+    Возвращает количество записанных при остановке изменений.
+    """
+    global _flusher
+    flusher = _flusher
+    if flusher is not None:
+        _flusher_stop.set()
+        flusher.join()
+        _flusher = None
+    return flush_states()
+
+
+def get_oldest_state_created_at() -> Optional[str]:
+    """
+    Время создания самого старого сохранённого состояния (для планировщика).
+    """
+    flush_states()
+    with closing(get_conn()) as conn:
+        row = conn.execute("SELECT MIN(created_at) AS oldest FROM user_states").fetchone()
+    return row["oldest"] if row else None
+
+
 def clear_expired_states(max_age_hours: int = 24):
     """
     Удаляет устаревшие состояния (старше max_age_hours часов).
     """
     threshold = datetime.utcnow() - timedelta(hours=max_age_hours)
     threshold_iso = threshold.isoformat(timespec="seconds")
-    
+
+    flush_states()
     with closing(get_conn()) as conn, conn:
         conn.execute(
             "DELETE FROM user_states WHERE created_at < ?",
             (threshold_iso,),
         )
-
+    with _lock:
+        for tg_id, entry in list(_cache.items()):
+            if entry.action is not None and entry.created_at < threshold_iso and tg_id not in _dirty:
+                del _cache[tg_id]
@@ -0,0 +1,207 @@
+"""
+Запуск бота в несколько процессов с разбиением обновлений по tg_id.
+
+Родительский процесс только принимает обновления (polling или webhook) и
+раскладывает их по очередям воркеров: shard = tg_id % BOT_WORKERS. Все
+обновления одного пользователя попадают в один процесс и обрабатываются
+по порядку, поэтому кэш состояний каждого пользователя живёт в одном месте.
+Фоновые задачи воркеры выполняют по очереди под арендой в таблице leases.
+
+Уведомления (notifier.enqueue) воркеры не отправляют сами, а передают
+родителю через общую очередь: лимиты Telegram на бота и на чат соблюдает
+одна NotificationQueue в родительском процессе, там же работает outbox.
+Родитель следит за воркерами и перезапускает упавшие на тех же очередях.
+"""
+import asyncio
+import logging
+import multiprocessing
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+RawUpdate = Dict[str, Any]
+
+
+def update_user_id(update: RawUpdate) -> Optional[int]:
+    """tg_id пользователя, от которого пришло обновление (или id чата)."""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user.get("id")
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat.get("id")
+    return None
+
+
+def shard_for(tg_id: Optional[int], count: int) -> int:
+    return tg_id % count if tg_id is not None else 0
+
+
+class ShardRouter:
+    """
+    Процессы-воркеры, их очереди входящих обновлений и общая очередь
+    уведомлений от воркеров к родителю (сторона родителя).
+    """
+
+    def __init__(self, count: int):
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue() for _ in range(count)]
+        self.notifications = self._context.Queue()
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * count
+        self._target: Optional[Callable[[int, Any, Any], None]] = None
+        self._stopping = False
+
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(
+            target=self._target,
+            args=(index, self._queues[index], self.notifications),
+            name=f"bot-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+
+    def start(self, target: Callable[[int, Any, Any], None]) -> None:
+        self._target = target
+        for index in range(len(self._queues)):
+            self._spawn(index)
+        logger.info("Запущено воркеров: %s", len(self._processes))
+
+    def route(self, update: RawUpdate) -> None:
+        self._queues[shard_for(update_user_id(update), len(self._queues))].put(update)
+
+    def restart_dead(self) -> int:
+        """
+        Перезапускает завершившиеся воркеры на тех же очередях: накопившиеся
+        обновления их пользователей обработает новый процесс.
+        Возвращает количество перезапущенных.
+        """
+        restarted = 0
+        for index, process in enumerate(self._processes):
+            if self._stopping or process is None or process.is_alive():
+                continue
+            logger.error(
+                "Воркер %s завершился (код выхода %s), перезапускаю",
+                process.name,
+                process.exitcode,
+            )
+            process.close()
+            self._spawn(index)
+            restarted += 1
+        return restarted
+
+    async def supervise(self, interval: float = 5.0) -> None:
+        """Раз в interval секунд проверяет, что все воркеры живы."""
+        while True:
+            await asyncio.sleep(interval)
+            self.restart_dead()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """
+        Просит воркеры доработать очередь и завершиться, после чего закрывает
+        очередь уведомлений (None — конец потока для consume_notifications).
+        """
+        self._stopping = True
+        for queue in self._queues:
+            queue.put(None)
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("Воркер %s не завершился вовремя, останавливаю", process.name)
+                process.terminate()
+        self._processes = [None] * len(self._queues)
+        self.notifications.put(None)
+
+
+async def poll_updates(bot: Bot, route: Callable[[RawUpdate], None], allowed_updates: List[str]) -> None:
+    """Получает обновления через getUpdates и передаёт их в route."""
+    offset = None
+    delay = 1.0
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=30, allowed_updates=allowed_updates
+            )
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except (TelegramNetworkError, TelegramServerError):
+            logger.warning("Ошибка getUpdates, повтор через %s с", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+            continue
+        delay = 1.0
+        for update in updates:
+            route(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+            offset = update.update_id + 1
+
+
+def build_router_app(route: Callable[[RawUpdate], None], path: str, secret: str) -> web.Application:
+    """aiohttp-приложение, которое принимает вебхук и передаёт обновления в route."""
+
+    async def handle(request: web.Request) -> web.Response:
+        if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            return web.Response(status=401, text="Unauthorized")
+        route(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    return app
+
+
+async def consume_updates(queue: Any, handle: Callable[[RawUpdate], Awaitable[Any]]) -> None:
+    """
+    Читает обновления из очереди воркера до получения None. Обновления разных
+    пользователей обрабатываются параллельно, одного — строго по порядку.
+    """
+    loop = asyncio.get_running_loop()
+    tails: Dict[Optional[int], asyncio.Task] = {}
+
+    async def run_after(previous: Optional[asyncio.Task], update: RawUpdate) -> None:
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await handle(update)
+        except Exception:
+            logger.exception("Ошибка при обработке обновления %s", update.get("update_id"))
+
+    def forget(key: Optional[int], task: asyncio.Task) -> None:
+        if tails.get(key) is task:
+            del tails[key]
+
+    while True:
+        update = await loop.run_in_executor(None, queue.get)
+        if update is None:
+            break
+        key = update_user_id(update)
+        task = asyncio.create_task(run_after(tails.get(key), update))
+        tails[key] = task
+        task.add_done_callback(lambda t, key=key: forget(key, t))
+
+    await asyncio.gather(*tails.values(), return_exceptions=True)
+
+
+async def consume_notifications(queue: Any, enqueue: Callable[..., Any]) -> None:
+    """
+    Читает уведомления воркеров до получения None и ставит их в очередь
+    отправки родителя: enqueue(chat_id, text, failure_log=..., **kwargs).
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await loop.run_in_executor(None, queue.get)
+        if item is None:
+            break
+        chat_id, text, failure_log, kwargs = item
+        try:
+            enqueue(chat_id, text, failure_log=failure_log, **kwargs)
+        except Exception:
+            logger.exception("Не удалось поставить уведомление воркера в очередь")